@@ -263,7 +263,8 @@ def main():
     trigger = Measurements()
     trigger.append(('sync', str(freq), str(nside), 'Q'), x)
     trigger.append(('sync', str(freq), str(nside), 'U'), x)
-    simer = Hammurabi(measurements=trigger, xml_path=xmlpath)
+    # outputs are masked right after reading, as named in masked mock_data
+    simer = Hammurabi(measurements=trigger, xml_path=xmlpath, mask_dict=mock_mask)
 
     ensemble_size = 5
     pipe = DynestyPipeline(simer, factory_list, likelihood, prior, ensemble_size)
@@ -8,6 +8,7 @@ from .fields.test_field.test_field_factory import TestFieldFactory
 from .fields.test_field.test_field import TestField
 from .observables.observable_dict import ObservableDict, Measurements, Simulations, Covariances, Masks
 from .simulators.simulator import Simulator
+from .simulators.cached_simulator import CachedSimulator
 from .priors.prior import Prior
 from .priors.flat_prior import FlatPrior
 from .pipelines.pipeline import Pipeline
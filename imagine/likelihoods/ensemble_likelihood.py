@@ -5,11 +5,12 @@ it combines covariance matrices from both observations and simulations
 """
 import numpy as np
 import logging as log
+from mpi4py import MPI
 from copy import deepcopy
 from imagine.observables.observable_dict import Simulations
 from imagine.likelihoods.likelihood import Likelihood
-from imagine.tools.covariance_estimator import oas_mcov
-from imagine.tools.mpi_helper import mpi_slogdet, mpi_lu_solve, mpi_trace
+from imagine.tools.covariance_estimator import oas_mcov, oas_lowrank_mcov
+from imagine.tools.mpi_helper import LUFactor, DistributedArray, mpi_trace, mpi_arrange, get_comm
 from imagine.tools.icy_decorator import icy
 
 
@@ -26,11 +27,43 @@ class EnsembleLikelihood(Likelihood):
         Covariances
     mask_dict : imagine.observables.observable_dict.Masks
         Masks
+    lowrank : bool
+        If True, observables without measurement covariance
+        never form the dense simulation covariance,
+        the OAS estimate (scaled identity plus rank-N update)
+        is solved with the Woodbury identity
+        and its log-determinant comes from the matrix determinant lemma,
+        both working on the N*N core with N the ensemble size
+
+    Simulations flagged as deterministic (identical realizations)
+    take the zero-variance path, where the simulation covariance is never estimated
+    and measurement covariances are factorized only once
     """
-    def __init__(self, measurement_dict, covariance_dict=None, mask_dict=None):
+    def __init__(self, measurement_dict, covariance_dict=None, mask_dict=None, lowrank=False):
         log.debug('@ ensemble_likelihood::__init__')
+        self.lowrank = lowrank
         super(EnsembleLikelihood, self).__init__(measurement_dict, covariance_dict, mask_dict)
 
+    @property
+    def lowrank(self):
+        return self._lowrank
+
+    @property
+    def covariance_dict(self):
+        return self._covariance_dict
+
+    @covariance_dict.setter
+    def covariance_dict(self, covariance_dict):
+        log.debug('@ ensemble_likelihood::covariance_dict')
+        Likelihood.covariance_dict.fset(self, covariance_dict)
+        # measurement covariance factors, filled upon zero-variance path
+        self._covariance_factors = dict()
+
+    @lowrank.setter
+    def lowrank(self, lowrank):
+        assert (lowrank in (True, False))
+        self._lowrank = lowrank
+
     def __call__(self, observable_dict):
         """
         EnsembleLikelihood class call function
@@ -52,17 +85,30 @@ class EnsembleLikelihood(Likelihood):
         likelicache = float(0)
         if self._covariance_dict is None:
             for name in self._measurement_dict.keys():
-                obs_mean, obs_cov = oas_mcov(observable_dict[name].data)  # to distributed data
+                if observable_dict[name].deterministic:
+                    likelicache += self._zero_variance_term(name, observable_dict[name])
+                    continue
+                if self._lowrank:
+                    likelicache += self._lowrank_term(observable_dict[name].distributed,
+                                                      self._measurement_dict[name].data)
+                    continue
+                obs_mean, obs_cov = oas_mcov(observable_dict[name].distributed)  # to distributed data
                 data = deepcopy(self._measurement_dict[name].data)  # to distributed data
                 diff = np.nan_to_num(data - obs_mean)
                 if (mpi_trace(obs_cov) < 1E-28):  # zero will not be reached, at most E-32
                     likelicache += -0.5*np.vdot(diff, diff)
                 else:
-                    sign, logdet = mpi_slogdet(obs_cov*2.*np.pi)
-                    likelicache += -0.5*(np.vdot(diff, mpi_lu_solve(obs_cov, diff))+sign*logdet)
+                    likelicache += self._gaussian_term(obs_cov, diff)
         else:
             for name in self._measurement_dict.keys():
-                obs_mean, obs_cov = oas_mcov(observable_dict[name].data)  # to distributed data
+                if observable_dict[name].deterministic:
+                    likelicache += self._zero_variance_term(name, observable_dict[name])
+                    continue
+                if self._lowrank and name not in self._covariance_dict.keys():
+                    likelicache += self._lowrank_term(observable_dict[name].distributed,
+                                                      self._measurement_dict[name].data)
+                    continue
+                obs_mean, obs_cov = oas_mcov(observable_dict[name].distributed)  # to distributed data
                 data = deepcopy(self._measurement_dict[name].data)  # to distributed data
                 diff = np.nan_to_num(data - obs_mean)
                 if name in self._covariance_dict.keys():  # not all measurements have cov
@@ -70,12 +116,105 @@ class EnsembleLikelihood(Likelihood):
                     if (mpi_trace(full_cov) < 1E-28):  # zero will not be reached, at most E-32
                         likelicache += -0.5*np.vdot(diff, diff)
                     else:
-                        sign, logdet = mpi_slogdet(full_cov*2.*np.pi)
-                        likelicache += -0.5*(np.vdot(diff, mpi_lu_solve(full_cov, diff))+sign*logdet)
+                        likelicache += self._gaussian_term(full_cov, diff)
                 else:
                     if (mpi_trace(obs_cov) < 1E-28):  # zero will not be reached, at most E-32
                         likelicache += -0.5*np.vdot(diff, diff)
                     else:
-                        sign, logdet = mpi_slogdet(obs_cov*2.*np.pi)
-                        likelicache += -0.5*(np.vdot(diff, mpi_lu_solve(obs_cov, diff))+sign*logdet)
+                        likelicache += self._gaussian_term(obs_cov, diff)
         return likelicache
+
+    def _gaussian_term(self, cov, diff):
+        """
+        log-likelihood term of a single observable,
+        the covariance matrix is factorized once for both
+        the log-determinant and the linear solve
+
+        Parameters
+        ----------
+        cov : numpy.ndarray
+            distributed covariance matrix
+        diff : numpy.ndarray
+            copied difference between measurement and ensemble mean
+
+        Returns
+        -------
+        log-likelihood term (copied to all nodes)
+        """
+        factor = LUFactor(DistributedArray.arranged(cov, cov.shape[1]))
+        sign, logdet = factor.slogdet()
+        logdet += factor.size*np.log(2.*np.pi)  # log-determinant of 2*pi*cov
+        return -0.5*(np.vdot(diff, factor.solve(diff))+sign*logdet)
+
+    def _zero_variance_term(self, name, observable):
+        """
+        log-likelihood term of a single observable with identical realizations,
+        the simulation covariance vanishes,
+        so only the measurement covariance (if any) enters,
+        which is factorized upon the first call and kept,
+        so that the factor lives on the communicator in use during sampling
+        (e.g. the one of pipeline), which must not change afterwards
+
+        Parameters
+        ----------
+        name : str tuple
+            observable name
+        observable : imagine.observables.observable.Observable
+            deterministic simulated ensemble
+
+        Returns
+        -------
+        log-likelihood term (copied to all nodes)
+        """
+        log.debug('@ ensemble_likelihood::_zero_variance_term')
+        diff = np.nan_to_num(self._measurement_dict[name].data - observable.ensemble_mean)
+        if self._covariance_dict is None or name not in self._covariance_dict.keys():
+            return -0.5*np.vdot(diff, diff)
+        if name not in self._covariance_factors.keys():
+            factor = LUFactor(self._covariance_dict[name].distributed)
+            sign, logdet = factor.slogdet()
+            logdet += factor.size*np.log(2.*np.pi)  # log-determinant of 2*pi*cov
+            self._covariance_factors[name] = (factor, sign, logdet)
+        factor, sign, logdet = self._covariance_factors[name]  # pre-factorized
+        return -0.5*(np.vdot(diff, factor.solve(diff))+sign*logdet)
+
+    def _lowrank_term(self, ensemble, data):
+        """
+        log-likelihood term of a single observable
+        with the low-rank OAS covariance D*I + F*U^T*U,
+        where U is the centered ensemble
+
+        Woodbury identity and matrix determinant lemma give
+
+        inv(cov) = (I - (F/D)*U^T*inv(C)*U)/D,
+        det(cov) = D^n*det(C),
+        with C = I + (F/D)*U*U^T of size (N, N)
+
+        Parameters
+        ----------
+        ensemble : numpy.ndarray or DistributedArray
+            distributed simulated ensemble
+        data : numpy.ndarray
+            copied measurement
+
+        Returns
+        -------
+        log-likelihood term (copied to all nodes)
+        """
+        log.debug('@ ensemble_likelihood::_lowrank_term')
+        obs_mean, u, gram, diagonal, factor = oas_lowrank_mcov(ensemble)
+        diff = np.nan_to_num(data - obs_mean)
+        if (np.trace(gram) < 1E-28):  # zero will not be reached, at most E-32
+            return -0.5*np.vdot(diff, diff)
+        data_size = diff.shape[1]
+        # project difference onto the ensemble
+        local_begin, local_end = mpi_arrange(data_size)
+        projection = np.dot(diff[0, local_begin:local_end], u)
+        get_comm().Allreduce(MPI.IN_PLACE, [projection, MPI.DOUBLE], op=MPI.SUM)
+        # N*N core
+        ratio = factor/diagonal
+        core = np.eye(gram.shape[0]) + ratio*gram
+        sign, logdet = np.linalg.slogdet(core)
+        logdet += data_size*np.log(2.*np.pi*diagonal)  # log-determinant of 2*pi*cov
+        quadratic = (np.vdot(diff, diff) - ratio*np.vdot(projection, np.linalg.solve(core, projection)))/diagonal
+        return -0.5*(quadratic+sign*logdet)
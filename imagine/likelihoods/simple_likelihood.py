@@ -3,7 +3,7 @@ import logging as log
 from copy import deepcopy
 from imagine.observables.observable_dict import Simulations
 from imagine.likelihoods.likelihood import Likelihood
-from imagine.tools.mpi_helper import mpi_slogdet, mpi_lu_solve
+from imagine.tools.mpi_helper import LUFactor
 from imagine.tools.icy_decorator import icy
 
 
@@ -25,6 +25,37 @@ class SimpleLikelihood(Likelihood):
         log.debug('@ simple_likelihood::__init__')
         super(SimpleLikelihood, self).__init__(measurement_dict, covariance_dict, mask_dict)
 
+    @property
+    def covariance_dict(self):
+        return self._covariance_dict
+
+    @covariance_dict.setter
+    def covariance_dict(self, covariance_dict):
+        """
+        measurement covariances do not change during sampling,
+        so each of them is factorized only once, upon the first call,
+        and the factor is kept together with the log-determinant,
+        factorizing upon the first call (not here) puts the covariance layout
+        and the factor on the communicator in use during sampling
+        (e.g. the one of pipeline), which must not change afterwards
+        """
+        log.debug('@ simple_likelihood::covariance_dict')
+        Likelihood.covariance_dict.fset(self, covariance_dict)
+        # measurement covariance factors, filled upon the first call
+        self._covariance_factors = dict()
+
+    def _covariance_factor(self, name):
+        """
+        LUFactor of a measurement covariance with log-determinant of 2*pi*cov,
+        factorized upon the first call and kept
+        """
+        if name not in self._covariance_factors.keys():
+            factor = LUFactor(self._covariance_dict[name].distributed)
+            (sign, logdet) = factor.slogdet()
+            logdet += factor.size*np.log(2.*np.pi)  # log-determinant of 2*pi*cov
+            self._covariance_factors[name] = (factor, sign, logdet)
+        return self._covariance_factors[name]
+
     def __call__(self, observable_dict):
         """
         SimpleLikelihood object call function
@@ -56,9 +87,8 @@ class SimpleLikelihood(Likelihood):
                 data = deepcopy(self._measurement_dict[name].data)  # to distributed data
                 diff = np.nan_to_num(data - obs_mean)
                 if name in self._covariance_dict.keys():  # not all measreuments have cov
-                    cov = deepcopy(self._covariance_dict[name].data)  # to distributed data
-                    (sign, logdet) = mpi_slogdet(cov*2.*np.pi)
-                    likelicache += -0.5*(np.vdot(diff, mpi_lu_solve(cov, diff))+sign*logdet)
+                    (factor, sign, logdet) = self._covariance_factor(name)  # pre-factorized
+                    likelicache += -0.5*(np.vdot(diff, factor.solve(diff))+sign*logdet)
                 else:
                     likelicache += -0.5*np.vdot(diff, diff)
         return likelicache
@@ -22,18 +22,32 @@ but at least a full version of one single realization.
 'covariance' data distributes itself into all computing nodes,
 which means to have a full set of 'covariance' data,
 we have to collect pieces from all the computing nodes.
+
+the global layout (local rows on each node) is cached in a DistributedArray,
+it is taken from DistributedArray input or appended data when known,
+otherwise collected from all nodes upon the first request,
+so that setting and appending data never involve communication
+(except checking ndarray input to append, as before),
+and later queries of shape/mean/global data skip the collection.
+
+'simulated' data is hosted in a local buffer which may hold more rows
+than the realizations stored, appending fills the buffer in place
+and grows it geometrically only when it is full,
+with known ensemble size the buffer can be reserved once
+and each realization written into its own slot.
+
+'simulated' data can be flagged as deterministic by its producer,
+which means all realizations (on all nodes) are identical,
+so that the ensemble has zero variance,
+the flag is dropped once the data is set or appended.
 """
 import numpy as np
-from mpi4py import MPI
 from copy import deepcopy
 import logging as log
 from imagine.tools.mpi_helper import mpi_mean, mpi_shape, mpi_prosecutor, mpi_global
+from imagine.tools.mpi_helper import DistributedArray
 from imagine.tools.icy_decorator import icy
 
-comm = MPI.COMM_WORLD
-mpisize = comm.Get_size()
-mpirank = comm.Get_rank()
-
 @icy
 class Observable(object):
     """
@@ -42,16 +56,33 @@ class Observable(object):
 
     Parameters
     ----------
-    data : numpy.ndarray
+    data : numpy.ndarray or DistributedArray
         distributed/copied data
     dtype : str
         Data type, must be either: 'measured', 'simulated' or 'covariance'
     """
     def __init__(self, data=None, dtype=None):
         self.dtype = dtype
+        self._deterministic = False
         self.data = data
         self.rw_flag = False
 
+    def _resize(self, rows, capacity=None):
+        """
+        set the number of local realizations to rows,
+        reallocate the local buffer if it cannot hold the given capacity,
+        without given capacity the buffer grows geometrically
+        """
+        if capacity is None:
+            capacity = rows
+            if capacity > self._buffer.shape[0]:
+                capacity = max(capacity, 2*self._buffer.shape[0])
+        if capacity > self._buffer.shape[0]:
+            buffer = np.zeros((capacity, self._buffer.shape[1]), dtype=self._buffer.dtype)
+            buffer[:self._data.shape[0]] = self._data
+            self._buffer = buffer
+        self._data = self._buffer[:rows]
+
     @property
     def data(self):
         """
@@ -59,13 +90,23 @@ class Observable(object):
         """
         return self._data
 
+    @property
+    def distributed(self):
+        """
+        LOCAL data with its cached global layout (`DistributedArray`, read-only).
+        """
+        if self._distributed is None and self._data is not None:
+            # layout left out by in-place writing
+            self._distributed = DistributedArray(self._data)
+        return self._distributed
+
     @property
     def shape(self):
         """
         Shape of the GLOBAL array, i.e. considering all processors
         (`numpy.ndarray`, read-only).
         """
-        return mpi_shape(self._data)  # estimate shape from all nodes
+        return mpi_shape(self.distributed)  # from the cached layout
 
     @property
     def global_data(self):
@@ -74,7 +115,7 @@ class Observable(object):
         Note that only master node hosts the global data,
         while slave nodes hosts None.
         """
-        return mpi_global(self.data)
+        return mpi_global(self.distributed)
 
     @property
     def size(self):
@@ -92,7 +133,7 @@ class Observable(object):
             assert (self._data.shape[0] == 1)  # single realization
             return self._data  # since each node has a full copy
         elif (self._dtype == 'simulated'):
-            return mpi_mean(self._data)  # calculate mean from all nodes
+            return mpi_mean(self.distributed)  # calculate mean from all nodes
         else:
             raise TypeError('unsupported data type')
 
@@ -110,6 +151,19 @@ class Observable(object):
         """
         return self._dtype
 
+    @property
+    def deterministic(self):
+        """
+        Deterministic flag, if true, all realizations of SIMULATED dtype are identical
+        """
+        return self._deterministic
+
+    @deterministic.setter
+    def deterministic(self, deterministic):
+        assert (deterministic in (True, False))
+        assert (not deterministic or self._dtype == 'simulated')
+        self._deterministic = deterministic
+
     @data.setter
     def data(self, data):
         """
@@ -117,14 +171,29 @@ class Observable(object):
         no extra check for 'simulated'
         """
         log.debug('@ observable::data')
+        self._deterministic = False
         if data is None:
             self._data = None
+            self._buffer = None
+            self._distributed = None
         else:
+            row_counts = None
+            if isinstance(data, DistributedArray):
+                row_counts = data.row_counts
+                data = data.data
             assert (len(data.shape) == 2)
             assert isinstance(data, np.ndarray)
             if (self._dtype == 'measured'):  # copy single-row data from memory
                 assert (data.shape[0] == 1)
-            self._data = np.copy(data)
+                self._data = np.copy(data)
+                self._distributed = DistributedArray.copied(self._data)
+            else:
+                self._data = np.copy(data)
+                # layout collected upon request if unknown
+                self._distributed = None
+                if row_counts is not None:
+                    self._distributed = DistributedArray(self._data, row_counts)
+            self._buffer = self._data
             if (self._dtype == 'covariance'):
                 g_rows, g_cols = self.shape
                 assert (g_rows == g_cols)
@@ -151,18 +220,91 @@ class Observable(object):
         rewrite flag will be switched off once rewriten has been performed
         """
         log.debug('@ observable::append')
-        assert isinstance(new_data, (np.ndarray, Observable))
+        assert isinstance(new_data, (np.ndarray, DistributedArray, Observable))
         assert (self._dtype == 'simulated')
+        # layout of new data, None if unknown
         if isinstance(new_data, np.ndarray):
+            new_data = DistributedArray(new_data)
             mpi_prosecutor(new_data)
-            if (self._rw_flag):  # rewriting
-                self._data = np.copy(new_data)
-                self._rw_flag = False
-            else:
-                self._data = np.vstack([self._data, new_data])
+            new_counts = new_data.row_counts
         elif isinstance(new_data, Observable):
-            if (self._rw_flag):
-                self._data = np.copy(new_data.data)
-                self._rw_flag = False
-            else:
-                self._data = np.vstack([self._data, new_data.data])
+            new_counts = None
+            if new_data._distributed is not None:
+                new_counts = new_data._distributed.row_counts
+        else:
+            new_counts = new_data.row_counts
+        self._deterministic = False
+        if (self._rw_flag):  # rewriting
+            self._data = np.copy(new_data.data)
+            self._buffer = self._data
+            row_counts = new_counts
+            self._rw_flag = False
+        else:
+            assert (new_data.data.shape[1] == self._data.shape[1])
+            rows = self._data.shape[0]
+            row_counts = None
+            if self._distributed is not None and new_counts is not None:
+                row_counts = self._distributed.row_counts + new_counts
+            # filled in place, instead of copying all realizations each time
+            self._resize(rows + new_data.data.shape[0])
+            self._data[rows:] = new_data.data
+        # layout collected upon request if unknown
+        self._distributed = None
+        if row_counts is not None:
+            self._distributed = DistributedArray(self._data, row_counts)
+
+    def reserve(self, capacity, size=None):
+        """
+        reserve the local buffer of SIMULATED dtype
+        for the given number of local realizations,
+        realizations already stored are kept
+
+        Parameters
+        ----------
+        capacity : int
+            number of local realizations the buffer holds
+        size : int
+            data size, required only if no data is stored yet
+        """
+        log.debug('@ observable::reserve')
+        assert (self._dtype == 'simulated')
+        capacity = int(capacity)
+        if self._data is None:
+            assert (size is not None)
+            self._buffer = np.zeros((capacity, int(size)), dtype=np.float64)
+            self._data = self._buffer[:0]
+            self._distributed = None
+        else:
+            assert (size is None or int(size) == self._data.shape[1])
+            self._resize(self._data.shape[0], capacity)
+            if self._distributed is not None:
+                self._distributed = DistributedArray(self._data, self._distributed.row_counts)
+
+    def fill(self, index, realization):
+        """
+        write a single realization into the given local slot of SIMULATED dtype,
+        no communication is involved,
+        slots beyond the stored realizations extend the local ensemble,
+        with the buffer grown if it has not been reserved
+
+        Parameters
+        ----------
+        index : int
+            local realization index
+        realization : numpy.ndarray
+            single realization in shape (1, data size) or (data size,)
+        """
+        log.debug('@ observable::fill')
+        assert (self._dtype == 'simulated')
+        assert (self._buffer is not None)
+        index = int(index)
+        assert (index >= 0)
+        realization = np.reshape(realization, (-1,))
+        assert (realization.shape[0] == self._buffer.shape[1])
+        self._deterministic = False
+        rows = self._data.shape[0]
+        if index >= rows:
+            self._resize(index+1)
+            # global layout is collected again upon request
+            self._distributed = None
+        self._data[index] = realization
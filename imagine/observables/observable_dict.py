@@ -54,17 +54,13 @@ Masking method
 """
 import numpy as np
 import logging as log
-from mpi4py import MPI
 
 from imagine.observables.observable import Observable
-from imagine.tools.masker import mask_obs, mask_cov
+from imagine.tools.masker import CompiledMask
+from imagine.tools.mpi_helper import DistributedArray
 from imagine.tools.icy_decorator import icy
 
 
-comm = MPI.COMM_WORLD
-mpisize = comm.Get_size()
-mpirank = comm.Get_rank()
-
 @icy
 class ObservableDict(object):
     """
@@ -120,14 +116,23 @@ class ObservableDict(object):
 @icy
 class Masks(ObservableDict):
     """
-    Stores HEALPix mask maps
+    Stores HEALPix mask maps,
+    each mask map is compiled into kept pixel indices once upon appending
 
     See `imagine.observables.observable_dict` module documentation for
     further details.
     """
     def __init__(self):
+        self._compiled = dict()
         super(Masks, self).__init__()
 
+    @property
+    def compiled(self):
+        """
+        Compiled masks (`dict` of `imagine.tools.masker.CompiledMask`, read-only)
+        """
+        return self._compiled
+
     def append(self, name, new, plain=False):
         """
         Adds/updates name and data
@@ -163,6 +168,7 @@ class Masks(ObservableDict):
             self._archive.update({name: Observable(new, 'measured')})
         else:
             raise TypeError('unsupported data type')
+        self._compiled.update({name: CompiledMask(self._archive[name].data)})
 
 
 @icy
@@ -217,10 +223,10 @@ class Measurements(ObservableDict):
             pass
         else:
             assert isinstance(mask_dict, Masks)
-            for name, msk in mask_dict._archive.items():
+            for name, msk in mask_dict.compiled.items():
                 if name in self._archive.keys():
-                    masked = mask_obs(self._archive[name].data, msk.data)
-                    new_name = (name[0], name[1], str(masked.shape[1]), name[3])
+                    masked = msk.apply_obs(self._archive[name].data)
+                    new_name = (name[0], name[1], str(msk.masked_size), name[3])
                     self._archive.pop(name, None)  # pop out obsolete data
                     self.append(new_name, masked, plain=True)  # append new as plain data
 
@@ -234,8 +240,26 @@ class Simulations(ObservableDict):
     further details.
     """
     def __init__(self):
+        # layout of each entry, given at appending/reserving
+        self._plain = dict()
         super(Simulations, self).__init__()
 
+    def is_plain(self, name):
+        """
+        Checks if an entry holds plain (unstructured) data
+        rather than HEALPix-like sky maps, as given at appending/reserving
+
+        Parameters
+        ----------
+        name : str tuple
+            name of an existing entry
+
+        Returns
+        -------
+        bool
+        """
+        return self._plain[name]
+
     def append(self, name, new_data, plain=False):
         """
         Adds/updates name and data
@@ -273,6 +297,55 @@ class Simulations(ObservableDict):
                 self._archive.update({name: Observable(new_data, 'simulated')})
             else:
                 raise TypeError('unsupported data type')
+            self._plain[name] = plain
+
+    def reserve(self, name, capacity, plain=False):
+        """
+        Reserves local buffer for a known number of realizations,
+        see `imagine.observables.observable.Observable.reserve`
+
+        Parameters
+        ----------
+        name : str tuple
+            Should follow the convention:
+            ``(data-name,str(data-freq),str(data-Nside/size),str(ext))``.
+        capacity : int
+            number of local realizations
+        plain : bool
+            If True, means unstructured data.
+            If False (default case), means HEALPix-like sky map.
+        """
+        log.debug('@ observable_dict::Simulations::reserve')
+        assert (len(name) == 4)
+        if plain:
+            size = int(name[2])
+        else:
+            size = 12*int(name[2])**2
+        if name not in self._archive.keys():
+            self._archive.update({name: Observable(None, 'simulated')})
+            self._archive[name].reserve(capacity, size)
+            self._plain[name] = plain
+        else:
+            self._archive[name].reserve(capacity)
+
+    def fill(self, name, index, realization):
+        """
+        Writes a single realization into its local slot,
+        see `imagine.observables.observable.Observable.fill`
+
+        Parameters
+        ----------
+        name : str tuple
+            Should follow the convention:
+            ``(data-name,str(data-freq),str(data-Nside/size),str(ext))``,
+            reserved already
+        index : int
+            local realization index
+        realization : numpy.ndarray
+            single realization
+        """
+        log.debug('@ observable_dict::Simulations::fill')
+        self._archive[name].fill(index, realization)
 
     def apply_mask(self, mask_dict):
         log.debug('@ observable_dict::Simulations::apply_mask')
@@ -280,11 +353,18 @@ class Simulations(ObservableDict):
             pass
         else:
             assert isinstance(mask_dict, Masks)
-            for name, msk in mask_dict._archive.items():
+            for name, msk in mask_dict.compiled.items():
                 if name in self._archive.keys():
-                    masked = mask_obs(self._archive[name].data, msk.data)
-                    new_name = (name[0], name[1], str(masked.shape[1]), name[3])
+                    obs = self._archive[name]
+                    masked = msk.apply_obs(obs.data)
+                    new_name = (name[0], name[1], str(msk.masked_size), name[3])
+                    # masking keeps the row layout, if known
+                    if obs._distributed is not None:
+                        masked = DistributedArray(masked, obs._distributed.row_counts)
+                    masked = Observable(masked, 'simulated')
+                    masked.deterministic = obs.deterministic
                     self._archive.pop(name, None)  # pop out obsolete
+                    self._plain.pop(name, None)
                     self.append(new_name, masked, plain=True)  # append new as plain data
 
 
@@ -339,9 +419,9 @@ class Covariances(ObservableDict):
             pass
         else:
             assert isinstance(mask_dict, Masks)
-            for name, msk in mask_dict._archive.items():
+            for name, msk in mask_dict.compiled.items():
                 if name in self._archive.keys():
-                    masked = mask_cov(self._archive[name].data, msk.data)
-                    new_name = (name[0], name[1], str(masked.shape[1]), name[3])
+                    masked = msk.apply_cov(self._archive[name].distributed)
+                    new_name = (name[0], name[1], str(msk.masked_size), name[3])
                     self._archive.pop(name, None)  # pop out obsolete
                     self.append(new_name, masked, plain=True)  # append new as plain data
@@ -1,14 +1,29 @@
+import uuid
 import logging as log
 import dynesty
 import numpy as np
 from mpi4py import MPI
 from imagine.pipelines.pipeline import Pipeline
+from imagine.tools.mpi_helper import comm_context, MPIPool
 from imagine.tools.icy_decorator import icy
 
 
-comm = MPI.COMM_WORLD
-mpisize = comm.Get_size()
-mpirank = comm.Get_rank()
+# pipelines in pool mode on this rank, by token,
+# tasks from the master rank carry the token instead of a pickled pipeline
+_pool_pipelines = dict()
+
+
+class _PoolCall(object):
+    """
+    picklable handle of a pipeline method (or attribute) in pool mode
+    """
+    def __init__(self, token, name):
+        self.token = token
+        self.name = name
+
+    def __call__(self, cube):
+        return getattr(_pool_pipelines[self.token], self.name)(cube)
+
 
 @icy
 class DynestyPipeline(Pipeline):
@@ -17,12 +32,44 @@ class DynestyPipeline(Pipeline):
 
     See base class for initialization details.
 
+    Parameters
+    ----------
+    pool_mode : bool
+        If True, only the master rank runs the sampler,
+        proposed live points are evaluated concurrently by rank groups,
+        see `DynestyPipeline._pool_call`
+    group_size : int
+        Number of ranks evaluating one live point jointly in pool mode,
+        must divide the communicator size
+
     Note
     ----
     Instances of this class are callable
     """
-    def __init__(self, simulator, factory_list, likelihood, prior, ensemble_size=1):
-        super(DynestyPipeline, self).__init__(simulator, factory_list, likelihood, prior, ensemble_size)
+    def __init__(self, simulator, factory_list, likelihood, prior, ensemble_size=1, comm=None,
+                 pool_mode=False, group_size=1):
+        self.pool_mode = pool_mode
+        self.group_size = group_size
+        super(DynestyPipeline, self).__init__(simulator, factory_list, likelihood, prior, ensemble_size, comm)
+
+    @property
+    def pool_mode(self):
+        return self._pool_mode
+
+    @pool_mode.setter
+    def pool_mode(self, pool_mode):
+        assert (pool_mode in (True, False))
+        self._pool_mode = pool_mode
+
+    @property
+    def group_size(self):
+        return self._group_size
+
+    @group_size.setter
+    def group_size(self, group_size):
+        group_size = int(group_size)
+        assert (group_size > 0)
+        self._group_size = group_size
 
     def __call__(self, kwargs=dict()):
         """
@@ -37,14 +84,77 @@ class DynestyPipeline(Pipeline):
         Dynesty sampling results
         """
         log.debug('@ dynesty_pipeline::__call__')
+        if self._pool_mode:
+            return self._pool_call(kwargs)
         # init dynesty
         sampler = dynesty.NestedSampler(self._mpi_likelihood,
                                         self.prior,
                                         len(self._active_parameters),
                                         **self._sampling_controllers)
-        sampler.run_nested(**kwargs)
+        with comm_context(self._comm):
+            sampler.run_nested(**kwargs)
         return sampler.results
 
+    def _pool_call(self, kwargs):
+        """
+        sampling in pool mode,
+        the master rank runs the sampler with a pool of rank groups (see `MPIPool`),
+        each batch of proposed live points (of size `queue_size`,
+        by default the number of groups) is dealt out to the groups,
+        so that groups evaluate different live points concurrently,
+        in this way, ensemble size is multiplied by the group size only
+
+        all likelihood evaluations go through the pool,
+        'use_pool' in sampling controllers should not be switched off
+
+        Parameters
+        ----------
+        kwargs : dict
+            extra input argument controlling sampling process
+
+        Returns
+        -------
+        Dynesty sampling results, on all ranks
+        """
+        log.debug('@ dynesty_pipeline::_pool_call')
+        with comm_context(self._comm) as comm:
+            token = comm.bcast(uuid.uuid4().hex if comm.Get_rank() == 0 else None, root=0)
+            _pool_pipelines[token] = self
+            pool = MPIPool(self._group_size)
+            try:
+                if pool.is_master:
+                    sampler = dynesty.NestedSampler(_PoolCall(token, '_group_likelihood'),
+                                                    _PoolCall(token, 'prior'),
+                                                    len(self._active_parameters),
+                                                    pool=pool,
+                                                    **self._sampling_controllers)
+                    sampler.run_nested(**kwargs)
+                    results = sampler.results
+                else:
+                    pool.wait()
+                    results = None
+            finally:
+                pool.close()
+                del _pool_pipelines[token]
+            return comm.bcast(results, root=0)
+
+    def _group_likelihood(self, cube):
+        """
+        log-likelihood calculator in pool mode,
+        with joint force of the rank group in use
+
+        Parameters
+        ----------
+        cube
+            list of variable values
+
+        Returns
+        -------
+        log-likelihood value
+        """
+        log.debug('@ dynesty_pipeline::_group_likelihood')
+        return self._joint_likelihood(cube, None)
+
     def _mpi_likelihood(self, cube):
         """
         mpi log-likelihood calculator
@@ -63,14 +173,33 @@ class DynestyPipeline(Pipeline):
         -------
         log-likelihood value
         """
-        log.debug('@ multinest_pipeline::_mpi_likelihood')
-        # gather cubes from all nodes
-        cube_local_size = cube.size
-        cube_pool = np.empty(cube_local_size*mpisize, dtype=np.float64)
-        comm.Allgather([cube, MPI.DOUBLE], [cube_pool, MPI.DOUBLE])
-        # check if all nodes are at the same parameter-space position
-        assert ((cube_pool == np.tile(cube_pool[:cube_local_size], mpisize)).all())
-        return self._core_likelihood(cube)
+        log.debug('@ dynesty_pipeline::_mpi_likelihood')
+        return self._joint_likelihood(cube, self._comm)
+
+    def _joint_likelihood(self, cube, comm):
+        """
+        log-likelihood at the same cube on all nodes of the communicator
+
+        Parameters
+        ----------
+        cube
+            list of variable values
+        comm : mpi4py.MPI.Comm
+            if None, the one in use
+
+        Returns
+        -------
+        log-likelihood value
+        """
+        with comm_context(comm) as comm:
+            mpisize = comm.Get_size()
+            # gather cubes from all nodes
+            cube_local_size = cube.size
+            cube_pool = np.empty(cube_local_size*mpisize, dtype=np.float64)
+            comm.Allgather([cube, MPI.DOUBLE], [cube_pool, MPI.DOUBLE])
+            # check if all nodes are at the same parameter-space position
+            assert ((cube_pool == np.tile(cube_pool[:cube_local_size], mpisize)).all())
+            return self._core_likelihood(cube)
 
     def _core_likelihood(self, cube):
         """
@@ -87,31 +216,14 @@ class DynestyPipeline(Pipeline):
         -------
         log-likelihood value
         """
-        log.debug('@ multinest_pipeline::_core_likelihood')
+        log.debug('@ dynesty_pipeline::_core_likelihood')
         # security boundary check
         if np.any(cube > 1.) or np.any(cube < 0.):
             log.debug('cube %s requested. returned most negative possible number' % str(cube))
             return np.nan_to_num(-np.inf)
-        # return active variables from pymultinest cube to factories
-        # and then generate new field objects
-        head_idx = int(0)
-        tail_idx = int(0)
-        field_list = tuple()
         # random seeds manipulation
         self._randomness()
-        # the ordering in factory list and variable list is vital
-        for factory in self._factory_list:
-            variable_dict = dict()
-            tail_idx = head_idx + len(factory.active_parameters)
-            factory_cube = cube[head_idx:tail_idx]
-            for i, av in enumerate(factory.active_parameters):
-                variable_dict[av] = factory_cube[i]
-            field_list += (factory.generate(variables=variable_dict,
-                                            ensemble_size=self._ensemble_size,
-                                            ensemble_seeds=self._ensemble_seeds),)
-            log.debug('create '+factory.name+' field')
-            head_idx = tail_idx
-        assert(head_idx == len(self._active_parameters))
+        field_list = self._field_list(cube, self._ensemble_seeds)
         observables = self._simulator(field_list)
         # apply mask
         observables.apply_mask(self.likelihood.mask_dict)
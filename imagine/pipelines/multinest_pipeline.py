@@ -4,12 +4,14 @@ import os
 import pymultinest
 from mpi4py import MPI
 from imagine.pipelines.pipeline import Pipeline
+from imagine.observables.observable_dict import Simulations
+from imagine.tools.mpi_helper import comm_context, get_comm
 from imagine.tools.icy_decorator import icy
 
 
-comm = MPI.COMM_WORLD
-mpisize = comm.Get_size()
-mpirank = comm.Get_rank()
+# message tag of simulated blocks in task farm
+_FARM_TAG = 2357
+
 
 @icy
 class MultinestPipeline(Pipeline):
@@ -18,13 +20,29 @@ class MultinestPipeline(Pipeline):
 
     See base class for initialization details.
 
+    Parameters
+    ----------
+    task_farm : bool
+        If True, simulations are handed out dynamically to idle nodes,
+        see `MultinestPipeline._farm_likelihood`
+
     Note
     ----
     Instances of this class are callable
 
     """
-    def __init__(self, simulator, factory_list, likelihood, prior, ensemble_size=1):
-        super(MultinestPipeline, self).__init__(simulator, factory_list, likelihood, prior, ensemble_size)
+    def __init__(self, simulator, factory_list, likelihood, prior, ensemble_size=1, comm=None, task_farm=False):
+        self.task_farm = task_farm
+        super(MultinestPipeline, self).__init__(simulator, factory_list, likelihood, prior, ensemble_size, comm)
+
+    @property
+    def task_farm(self):
+        return self._task_farm
+
+    @task_farm.setter
+    def task_farm(self, task_farm):
+        assert (task_farm in (True, False))
+        self._task_farm = task_farm
 
     def __call__(self, kwargs=dict()):
         """
@@ -53,10 +71,11 @@ class MultinestPipeline(Pipeline):
         assert os.path.isdir(basedir)
 
         # Runs pyMultinest
-        results = pymultinest.solve(LogLikelihood=self._mpi_likelihood,
-                                    Prior=self.prior,
-                                    n_dims=len(self._active_parameters),
-                                    **self._sampling_controllers)
+        with comm_context(self._comm):
+            results = pymultinest.solve(LogLikelihood=self._mpi_likelihood,
+                                        Prior=self.prior,
+                                        n_dims=len(self._active_parameters),
+                                        **self._sampling_controllers)
         return results
 
     def _mpi_likelihood(self, cube):
@@ -79,20 +98,126 @@ class MultinestPipeline(Pipeline):
         log-likelihood value
         """
         log.debug('@ multinest_pipeline::_mpi_likelihood')
-        # gather cubes from all nodes
-        cube_local_size = cube.size
-        cube_pool = np.empty(cube_local_size*mpisize, dtype=np.float64)
-        comm.Allgather([cube, MPI.DOUBLE], [cube_pool, MPI.DOUBLE])
-        # calculate log-likelihood for each node
-        loglike_pool = np.empty(mpisize, dtype=np.float64)
-        for i in range(mpisize):  # loop through nodes
-            cube_local = cube_pool[i*cube_local_size : (i+1)*cube_local_size]
-            loglike_pool[i] = self._core_likelihood(cube_local)
-        # scatter log-likelihood to each node
-        loglike_local = np.empty(1, dtype=np.float64)
-        comm.Scatter([loglike_pool, MPI.DOUBLE], [loglike_local, MPI.DOUBLE], root=0)
+        with comm_context(self._comm) as comm:
+            mpisize = comm.Get_size()
+            # gather cubes from all nodes
+            cube_local_size = cube.size
+            cube_pool = np.empty(cube_local_size*mpisize, dtype=np.float64)
+            comm.Allgather([cube, MPI.DOUBLE], [cube_pool, MPI.DOUBLE])
+            # calculate log-likelihood for each node
+            if self._task_farm and mpisize > 1:
+                loglike_pool = self._farm_likelihood(np.reshape(cube_pool, (mpisize, cube_local_size)))
+            else:
+                loglike_pool = np.empty(mpisize, dtype=np.float64)
+                for i in range(mpisize):  # loop through nodes
+                    cube_local = cube_pool[i*cube_local_size : (i+1)*cube_local_size]
+                    loglike_pool[i] = self._core_likelihood(cube_local)
+            # scatter log-likelihood to each node
+            loglike_local = np.empty(1, dtype=np.float64)
+            comm.Scatter([loglike_pool, MPI.DOUBLE], [loglike_local, MPI.DOUBLE], root=0)
         return loglike_local
 
+    def _farm_likelihood(self, cubes):
+        """
+        log-likelihood calculator of all nodes' cubes with a dynamic task farm
+
+        the ensemble of each cube is distributed as one realization block per node,
+        each (cube, block) task is simulated on a single node (COMM_SELF),
+        idle nodes take the next task from a counter hosted by the master node,
+        so that nodes with fast simulations take more tasks,
+        simulated blocks are sent to their owners in the distributed ensemble,
+        then log-likelihood of each cube is calculated with joint force of all nodes,
+        seeds of each block are drawn by its owner as without task farm,
+        so results are kept
+
+        Parameters
+        ----------
+        cubes
+            variable values of all nodes, in shape (number of nodes, number of variables)
+
+        Returns
+        -------
+        log-likelihood values of all cubes
+        """
+        log.debug('@ multinest_pipeline::_farm_likelihood')
+        comm = get_comm()
+        mpisize = comm.Get_size()
+        mpirank = comm.Get_rank()
+        # security boundary check
+        valid = [not (np.any(cube > 1.) or np.any(cube < 0.)) for cube in cubes]
+        # seeds of own blocks, seeds[owner][cube index]
+        seeds = list()
+        for i in range(len(cubes)):
+            if valid[i]:
+                self._randomness()
+            seeds.append(self._ensemble_seeds)
+        seeds = comm.allgather(seeds)
+        tasks = [(i, b) for i in range(len(cubes)) if valid[i] for b in range(mpisize)]
+        # hand out tasks
+        blocks = dict()
+        requests = list()
+        counter = np.zeros(1, dtype=np.int64)
+        win = MPI.Win.Create(counter, comm=comm)
+        one = np.ones(1, dtype=np.int64)
+        task_id = np.zeros(1, dtype=np.int64)
+        while True:
+            win.Lock(0)
+            win.Fetch_and_op(one, task_id, 0)
+            win.Unlock(0)
+            if task_id[0] >= len(tasks):
+                break
+            i, b = tasks[task_id[0]]
+            block = self._simulate_block(cubes[i], seeds[b][i])
+            if b == mpirank:
+                blocks[i] = block
+            else:
+                requests.append(comm.isend((i, block), dest=b, tag=_FARM_TAG))
+        win.Free()
+        # collect own blocks
+        while len(blocks) < sum(valid):
+            i, block = comm.recv(source=MPI.ANY_SOURCE, tag=_FARM_TAG)
+            blocks[i] = block
+        MPI.Request.waitall(requests)
+        # joint log-likelihood
+        loglike_pool = np.empty(len(cubes), dtype=np.float64)
+        for i in range(len(cubes)):
+            if not valid[i]:
+                log.debug('cube %s requested. returned most negative possible number' % str(cubes[i]))
+                loglike_pool[i] = np.nan_to_num(-np.inf)
+                continue
+            observables = Simulations()
+            for name, data, plain, deterministic in blocks[i]:
+                observables.append(name, data, plain=plain)
+                observables[name].deterministic = deterministic
+            current_likelihood = self.likelihood(observables)
+            if self._check_threshold and current_likelihood > self._likelihood_threshold:
+                raise ValueError('log-likelihood beyond threashould')
+            loglike_pool[i] = current_likelihood * self.likelihood_rescaler
+        return loglike_pool
+
+    def _simulate_block(self, cube, seeds):
+        """
+        simulate (and mask) a realization block on this node alone
+
+        Parameters
+        ----------
+        cube
+            list of variable values
+        seeds
+            ensemble seeds of the block
+
+        Returns
+        -------
+        list of (name, local data, plain flag, deterministic flag)
+        """
+        log.debug('@ multinest_pipeline::_simulate_block')
+        field_list = self._field_list(cube, seeds)
+        with comm_context(MPI.COMM_SELF):
+            observables = self._simulator(field_list)
+            observables.apply_mask(self.likelihood.mask_dict)
+            return [(name, observables[name].data, observables.is_plain(name),
+                     observables[name].deterministic) for name in observables.keys()]
+
     def _core_likelihood(self, cube):
         """
         core log-likelihood calculator
@@ -104,26 +229,9 @@ class MultinestPipeline(Pipeline):
         if np.any(cube > 1.) or np.any(cube < 0.):
             log.debug('cube %s requested. returned most negative possible number' % str(cube))
             return np.nan_to_num(-np.inf)
-        # return active variables from pymultinest cube to factories
-        # and then generate new field objects
-        head_idx = int(0)
-        tail_idx = int(0)
-        field_list = tuple()
         # random seeds manipulation
         self._randomness()
-        # the ordering in factory list and variable list is vital
-        for factory in self._factory_list:
-            variable_dict = dict()
-            tail_idx = head_idx + len(factory.active_parameters)
-            factory_cube = cube[head_idx:tail_idx]
-            for i, av in enumerate(factory.active_parameters):
-                variable_dict[av] = factory_cube[i]
-            field_list += (factory.generate(variables=variable_dict,
-                                            ensemble_size=self._ensemble_size,
-                                            ensemble_seeds=self._ensemble_seeds),)
-            log.debug('create '+factory.name+' field')
-            head_idx = tail_idx
-        assert(head_idx == len(self._active_parameters))
+        field_list = self._field_list(cube, self._ensemble_seeds)
         observables = self._simulator(field_list)
         # apply mask
         observables.apply_mask(self.likelihood.mask_dict)
@@ -46,8 +46,12 @@ class Pipeline(object):
         Prior object
     ensemble_size : int
         Number of observable realizations PER COMPUTING NODE to be generated in simulator
+    comm : mpi4py.MPI.Comm
+        communicator the pipeline runs on,
+        if None, the one in use (see `imagine.tools.mpi_helper.get_comm`)
     """
-    def __init__(self, simulator, factory_list, likelihood, prior, ensemble_size=1):
+    def __init__(self, simulator, factory_list, likelihood, prior, ensemble_size=1, comm=None):
+        self.comm = comm
         self.active_parameters = tuple()
         self.active_ranges = dict()
         self.factory_list = factory_list
@@ -154,6 +158,16 @@ class Pipeline(object):
         self._ensemble_size = ensemble_size
         log.debug('set ensemble size to %i' % int(ensemble_size))
 
+    @property
+    def comm(self):
+        return self._comm
+
+    @comm.setter
+    def comm(self, comm):
+        self._comm = comm
+        if comm is not None:
+            log.debug('set communicator of size %i' % comm.Get_size())
+
     @property
     def sampling_controllers(self):
         return self._sampling_controllers
@@ -236,33 +250,26 @@ class Pipeline(object):
         else:
             raise ValueError('unsupport random type')
 
-    def _core_likelihood(self, cube):
+    def _field_list(self, cube, ensemble_seeds):
         """
-        Log-likelihood calculator
+        generate field objects from variable values and ensemble seeds
 
         Parameters
         ----------
         cube
             list of variable values
+        ensemble_seeds
+            ensemble seeds of fields, usually the current ones
 
         Returns
         -------
-        log-likelihood
+        tuple of field objects
         """
-        log.debug('@ pipeline::_core_likelihood')
-        #t = Timer()
-        log.debug('sampler at %s' % str(cube))
-        # security boundary check
-        if np.any(cube > 1.) or np.any(cube < 0.):
-            log.debug('cube %s requested. returned most negative possible number' % str(cube))
-            return np.nan_to_num(-np.inf)
         # return active variables from pymultinest cube to factories
         # and then generate new field objects
         head_idx = int(0)
         tail_idx = int(0)
         field_list = tuple()
-        # random seeds manipulation
-        self._randomness()
         # the ordering in factory list and variable list is vital
         for factory in self._factory_list:
             variable_dict = dict()
@@ -272,10 +279,35 @@ class Pipeline(object):
                 variable_dict[av] = factory_cube[i]
             field_list += (factory.generate(variables=variable_dict,
                                             ensemble_size=self._ensemble_size,
-                                            ensemble_seeds=self._ensemble_seeds),)
+                                            ensemble_seeds=ensemble_seeds),)
             log.debug('create '+factory.name+' field')
             head_idx = tail_idx
         assert(head_idx == len(self._active_parameters))
+        return field_list
+
+    def _core_likelihood(self, cube):
+        """
+        Log-likelihood calculator
+
+        Parameters
+        ----------
+        cube
+            list of variable values
+
+        Returns
+        -------
+        log-likelihood
+        """
+        log.debug('@ pipeline::_core_likelihood')
+        #t = Timer()
+        log.debug('sampler at %s' % str(cube))
+        # security boundary check
+        if np.any(cube > 1.) or np.any(cube < 0.):
+            log.debug('cube %s requested. returned most negative possible number' % str(cube))
+            return np.nan_to_num(-np.inf)
+        # random seeds manipulation
+        self._randomness()
+        field_list = self._field_list(cube, self._ensemble_seeds)
         # create observables from fresh fields
         #t.tick('simulator')
         observables = self._simulator(field_list)
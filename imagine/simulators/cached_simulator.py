@@ -0,0 +1,278 @@
+"""
+content-addressed on-disk cache of simulation results
+
+outputs of each simulated realization are stored under the hash of
+simulator configuration (see `Simulator.fingerprint`, e.g. XML parameters,
+executable and masks of Hammurabi), an optional tag,
+and parameters (random seed included) reported by all fields for the realization,
+so that repeated requests (nested sampling restarts, repeated runs,
+'fixed' random type) are served without running the simulator
+
+realizations with zero (thread-time dependent) random seed are never cached
+
+outputs are stored as returned by the simulator (e.g. under masked names),
+with their layout (plain or HEALPix-like) and deterministic flag,
+in a compressed npz file per realization inside the cache directory,
+least recently used files are removed once the total size exceeds the limit,
+the cache directory can be shared by nodes and runs
+"""
+
+import os
+import hashlib
+import numbers
+import numpy as np
+import tempfile as tf
+import logging as log
+from collections import OrderedDict
+from imagine.simulators.simulator import Simulator
+from imagine.observables.observable_dict import Simulations
+from imagine.tools.icy_decorator import icy
+
+
+@icy
+class CachedSimulator(Simulator):
+    """
+    wraps a simulator with on-disk memoization
+
+    Parameters
+    ----------
+    simulator : imagine.simulators.simulator.Simulator
+        simulator with output_checklist
+
+    cache_dir : str
+        cache directory, created if missing,
+        by default 'imagine_cache' in the current working directory
+
+    max_size : int
+        size limit of cache directory in bytes
+
+    tag : str
+        extra identifier in hashing, in addition to simulator fingerprint,
+        e.g. for settings the fingerprint misses (as files read by the simulator),
+        by default empty
+    """
+    def __init__(self, simulator, cache_dir=None, max_size=2**30, tag=None):
+        log.debug('@ cached_simulator::__init__')
+        self.simulator = simulator
+        self.tag = tag
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        # counted per realization
+        self._hits = int(0)
+        self._misses = int(0)
+        self._skipped = int(0)
+
+    @property
+    def simulator(self):
+        return self._simulator
+
+    @simulator.setter
+    def simulator(self, simulator):
+        assert isinstance(simulator, Simulator)
+        self._simulator = simulator
+
+    @property
+    def output_checklist(self):
+        return self._simulator.output_checklist
+
+    def fingerprint(self, field_list):
+        return self._simulator.fingerprint(field_list)
+
+    @property
+    def tag(self):
+        return self._tag
+
+    @tag.setter
+    def tag(self, tag):
+        if tag is None:
+            tag = ''
+        assert isinstance(tag, str)
+        self._tag = tag
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, max_size):
+        assert (max_size > 0)
+        self._max_size = int(max_size)
+
+    @property
+    def cache_dir(self):
+        return self._cache_dir
+
+    @cache_dir.setter
+    def cache_dir(self, cache_dir):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.getcwd(), 'imagine_cache')
+        assert isinstance(cache_dir, str)
+        self._cache_dir = os.path.abspath(cache_dir)
+        os.makedirs(self._cache_dir, exist_ok=True)
+        # index of stored files, from least to most recently used
+        entries = list()
+        for name in os.listdir(self._cache_dir):
+            if name.endswith('.npz'):
+                stat = os.stat(os.path.join(self._cache_dir, name))
+                entries.append((stat.st_mtime, os.path.join(self._cache_dir, name), stat.st_size))
+        self._index = OrderedDict((path, size) for _, path, size in sorted(entries))
+        self._size = sum(self._index.values())
+        log.debug('set cache directory at %s' % self._cache_dir)
+
+    @property
+    def statistics(self):
+        """
+        numbers of realizations served from cache (hits),
+        simulated and stored (misses), simulated without caching (skipped),
+        and hit rate among cacheable realizations
+        """
+        total = self._hits + self._misses
+        return {'hits': self._hits,
+                'misses': self._misses,
+                'skipped': self._skipped,
+                'hit_rate': self._hits/total if total else 0.}
+
+    def __call__(self, field_list):
+        """
+        serve cached realizations, simulate the rest by the wrapped simulator
+
+        Parameters
+        ----------
+
+        field_list
+            list of GeneralField objects
+
+        Returns
+        -------
+        Simulations object
+        """
+        log.debug('@ cached_simulator::__call__')
+        ensemble_size = field_list[0].ensemble_size
+        for field in field_list:
+            assert (field.ensemble_size == ensemble_size)
+        fingerprint = self._simulator.fingerprint(field_list)
+        marks = [self._mark(fingerprint, field_list, i) for i in range(ensemble_size)]
+        # look up realizations, {realization id: {name: (plain, deterministic, map)}}
+        found = dict()
+        missing = list()
+        for i in range(ensemble_size):
+            if marks[i] is None:
+                self._skipped += 1
+                missing.append(i)
+                continue
+            found[i] = self._load(marks[i])
+            if found[i] is None:
+                del found[i]
+                self._misses += 1
+                missing.append(i)
+            else:
+                self._hits += 1
+        log.debug('cache statistics %s' % str(self.statistics))
+        # simulate the rest
+        if len(missing) == ensemble_size:
+            sims = self._simulator(field_list)
+        elif len(missing) > 0:
+            sims = self._simulator([self._subset(field, missing) for field in field_list])
+        for j, i in enumerate(missing):
+            found[i] = self._entry(sims, j)
+            if marks[i] is not None:
+                self._store(marks[i], found[i])
+        if len(missing) == ensemble_size:
+            return sims
+        # assemble
+        output = Simulations()
+        for name, (plain, _, _) in found[0].items():
+            output.reserve(name, ensemble_size, plain=plain)
+            for i in range(ensemble_size):
+                output.fill(name, i, found[i][name][2])
+            output[name].deterministic = all(found[i][name][1] for i in range(ensemble_size))
+        return output
+
+    def _mark(self, fingerprint, field_list, realization_id):
+        """
+        hash of the given realization,
+        None if any field has zero (thread-time dependent) random seed
+        """
+        record = [fingerprint, self._tag]
+        for field in field_list:
+            pars = field.report_parameters(realization_id)
+            if 'random_seed' in field.field_checklist.keys() and pars['random_seed'] == 0:
+                return None
+            record.append((type(field).__name__, field.name,
+                           tuple(sorted((k, self._canonical(v)) for k, v in pars.items()))))
+        return hashlib.sha256(repr(record).encode()).hexdigest()
+
+    def _canonical(self, value):
+        """
+        representation independent of numerical type
+        """
+        if isinstance(value, numbers.Real):
+            return repr(float(value))
+        return repr(value)
+
+    def _subset(self, field, index):
+        """
+        copy of the field with realizations in the given index only
+        """
+        parameters = dict(field.parameters)
+        parameters.pop('random_seed', None)
+        return type(field)(parameters, len(index), [field.ensemble_seeds[i] for i in index])
+
+    def _entry(self, sims, index):
+        """
+        outputs of a local realization in Simulations,
+        {name: (plain, deterministic, map)}
+        """
+        return dict((name, (sims.is_plain(name), sims[name].deterministic, sims[name].data[index]))
+                    for name in sims.keys())
+
+    def _load(self, mark):
+        """
+        read stored outputs of a realization, None if absent
+        """
+        path = os.path.join(self._cache_dir, mark+'.npz')
+        try:
+            with np.load(path) as f:
+                rslt = dict()
+                for k, name in enumerate(f['names']):
+                    rslt[tuple(str(n) for n in name)] = (bool(f['plain'][k]),
+                                                        bool(f['deterministic'][k]),
+                                                        f['map_%d' % k])
+            os.utime(path)
+        except (OSError, ValueError, KeyError):  # including removal by other nodes
+            if path in self._index.keys():
+                self._size -= self._index.pop(path)
+            return None
+        if path not in self._index.keys():  # stored by other nodes
+            self._index[path] = os.path.getsize(path)
+            self._size += self._index[path]
+        self._index.move_to_end(path)
+        return rslt
+
+    def _store(self, mark, entry):
+        """
+        write outputs of a realization atomically (compressed)
+        and evict least recently used files beyond size limit
+        """
+        path = os.path.join(self._cache_dir, mark+'.npz')
+        names = list(entry.keys())
+        arrays = dict(('map_%d' % k, entry[name][2]) for k, name in enumerate(names))
+        fd, temp_path = tf.mkstemp(prefix='.', suffix='.tmp', dir=self._cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f,
+                                names=np.array([list(name) for name in names], dtype=str),
+                                plain=np.array([entry[name][0] for name in names], dtype=bool),
+                                deterministic=np.array([entry[name][1] for name in names], dtype=bool),
+                                **arrays)
+        os.replace(temp_path, path)
+        if path in self._index.keys():
+            self._size -= self._index.pop(path)
+        self._index[path] = os.path.getsize(path)
+        self._size += self._index[path]
+        while self._size > self._max_size and len(self._index) > 1:
+            old_path, old_size = self._index.popitem(last=False)
+            self._size -= old_size
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                pass
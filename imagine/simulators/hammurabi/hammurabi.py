@@ -10,13 +10,21 @@ to accommodate updates of Hampyx in future
 only register/update_observables/fields need modifications
 """
 
+import os
+import hashlib
 import numpy as np
 import logging as log
 from imagine.simulators.simulator import Simulator
-from imagine.observables.observable_dict import Measurements, Simulations
+from imagine.observables.observable_dict import Measurements, Simulations, Masks
 from imagine.tools.icy_decorator import icy
 from imagine.tools.timer import Timer
-from .hampyx import Hampyx
+from .hampyx import Hampyx, run_ensemble
+
+
+# physical quantities (top level of field cue in XML tree)
+# on which each linear observable depends
+_LINEAR_DEPENDENCE = {'fd': ('magneticfield', 'thermalelectron'),
+                      'dm': ('thermalelectron',)}
 
 
 @icy
@@ -36,15 +44,47 @@ class Hammurabi(Simulator):
 
     xml_path
         hammurabi xml parameter file path
+
+    max_workers
+        maximal number of realizations simulated concurrently on each node,
+        each with its own Hampyx copy (parameter file and outputs)
+
+    wk_dir
+        directory for temporary parameter files and outputs,
+        by default a scratch directory, see `imagine.simulators.hammurabi.hampyx`
+
+    superposition
+        if True, Faraday depth and dispersion measure outputs,
+        which are linear in the random field,
+        are superposed from a regular part simulated once per call
+        and random parts cached per (non-zero) random seed,
+        so that with 'fixed' random type only the regular part is recomputed,
+        see `Hammurabi.decomposable` for applicable field lists
+
+    mask_dict
+        Masks object, usually the one of likelihood,
+        outputs with a mask are gathered at kept pixels
+        directly from memory-mapped output files (see `Hampyx.sim_map_index`),
+        and packed up as plain data under masked names,
+        so that masking Simulations afterwards is skipped
     """
     def __init__(self, measurements,
                  xml_path=None,
-                 exe_path=None):
+                 exe_path=None,
+                 max_workers=1,
+                 wk_dir=None,
+                 superposition=False,
+                 mask_dict=None):
         log.debug('@ hammurabi::__init__')
         self.exe_path = exe_path
         self.xml_path = xml_path
+        self.max_workers = max_workers
+        self.superposition = superposition
+        # random parts of the last call, {(seeds, parameters): {output key: map}}
+        self._superposition_cache = dict()
         self.output_checklist = measurements
-        self._ham = Hampyx(self._xml_path, self._exe_path)
+        self._ham = Hampyx(self._xml_path, self._exe_path, wk_dir)
+        self.mask_dict = mask_dict
         self.register_observables()
         self.ensemble_size = int(0)
 
@@ -66,6 +106,51 @@ class Hammurabi(Simulator):
     def xml_path(self, xml_path):
         self._xml_path = xml_path
 
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    @max_workers.setter
+    def max_workers(self, max_workers):
+        assert isinstance(max_workers, int)
+        assert (max_workers > 0)
+        self._max_workers = max_workers
+
+    @property
+    def mask_dict(self):
+        return self._mask_dict
+
+    @mask_dict.setter
+    def mask_dict(self, mask_dict):
+        if mask_dict is not None:
+            assert isinstance(mask_dict, Masks)
+        self._mask_dict = mask_dict
+        # only kept pixels are read from disk
+        self._ham.memmap = (mask_dict is not None)
+        index = dict()
+        for key in self._output_checklist:
+            if self._mask(key) is not None:
+                index[key] = self._mask(key).index
+        self._ham.sim_map_index = index if index else None
+
+    @property
+    def superposition(self):
+        return self._superposition
+
+    @superposition.setter
+    def superposition(self, superposition):
+        assert (superposition in (True, False))
+        self._superposition = superposition
+
+    @property
+    def timing(self):
+        """
+        time (in seconds) spent in each stage of hammurabiX runs,
+        accumulated over all realizations,
+        'xml' and 'read' for file I/O, 'exe' for the simulation
+        """
+        return self._ham.timing
+
     @property
     def output_checklist(self):
         return self._output_checklist
@@ -86,9 +171,11 @@ class Hammurabi(Simulator):
 
     def register_observables(self):
         """
-        modify hammurabi XML tree according to known output_checklist
+        modify hammurabi XML tree according to known output_checklist,
+        and request only maps in output_checklist from Hampyx
         """
         log.debug('@ hammurabi::register_observables')
+        self._ham.sim_map_request = self._output_checklist
         # clean up
         try:
             self._ham.del_par(['observable', 'sync'], 'all')
@@ -114,17 +201,25 @@ class Hammurabi(Simulator):
 
     def register_fields(self, field_list):
         """
-        update hammurabi XML tree according to field list controllist
+        update hammurabi XML tree according to field list controllist,
+        and register field list checklist as parameter template slots
         """
         log.debug('@ hammurabi::register_fields')
+        targets = list()
         for field in field_list:
             # update logical parameters
             controllist = field.field_controllist
             for key, clue in controllist.items():
                 assert (len(clue) == 2)
                 self._ham.mod_par(clue[0], clue[1])
+            # physical parameters updated per realization
+            targets += [tuple(clue) for clue in field.field_checklist.values()]
+            # switches toggled in superposition
+            if self._superposition and 'cue' in controllist.keys():
+                targets.append((controllist['cue'][0], 'cue'))
             # update ensemble size
             self.ensemble_size = field.ensemble_size
+        self._ham.compile_par(targets)
 
     def update_fields(self, field_list, realization_id):
         """
@@ -166,6 +261,20 @@ class Hammurabi(Simulator):
         self.register_fields(field_list)
         # execute hammurabi ensemble
         sims = Simulations()
+        for key in self._output_checklist:
+            if self._mask(key) is None:
+                sims.reserve(key, self._ensemble_size)
+            else:
+                sims.reserve(self._output_name(key), self._ensemble_size, plain=True)
+        if self.deterministic(field_list):
+            self._deterministic_run(field_list, sims)
+            return sims
+        if self._superposition and self.decomposable(field_list):
+            self._superposition_run(field_list, sims)
+            return sims
+        if self._max_workers > 1 and self._ensemble_size > 1:
+            self._concurrent_run(field_list, sims)
+            return sims
         for i in range(self._ensemble_size):
             # update parameters
             self.update_fields(field_list, i)
@@ -173,9 +282,259 @@ class Hammurabi(Simulator):
             self._ham()
             #t.tock('hamX')
             # pack up outputs
-            for key in self._output_checklist:
-                sims.append(key, np.vstack([self._ham.sim_map[key]]))
+            self._pack(sims, i, self._ham.sim_map)
         # return
         #t.tock('simulator')
         #print(str(t.record))
         return sims
+
+    def _mask(self, key):
+        """
+        compiled mask of an output, None if not masked
+        """
+        if self._mask_dict is None:
+            return None
+        return self._mask_dict.compiled.get(key)
+
+    def _output_name(self, key):
+        """
+        name of an output in Simulations, following masked Measurements
+        """
+        msk = self._mask(key)
+        if msk is None:
+            return key
+        return (key[0], key[1], str(msk.masked_size), key[3])
+
+    def _pack(self, sims, realization_id, sim_map):
+        """
+        write outputs of a realization into reserved Simulations,
+        masked outputs are already gathered at kept pixels by Hampyx
+        """
+        for key in self._output_checklist:
+            sims.fill(self._output_name(key), realization_id, sim_map[key])
+
+    def fingerprint(self, field_list):
+        """
+        description of hammurabi configuration for the field list,
+        i.e., XML parameter tree with field controllist applied
+        (apart from parameters updated per realization and output file names),
+        executable (path, size and modification time),
+        outputs and their masks
+
+        Parameters
+        ----------
+
+        field_list
+            list of GeneralField objects
+
+        Returns
+        -------
+        str
+        """
+        log.debug('@ hammurabi::fingerprint')
+        self.register_fields(field_list)
+        digest = hashlib.sha256(self._ham.fingerprint())
+        exe = self._ham.exe_path
+        stat = os.stat(exe)
+        digest.update(repr((super(Hammurabi, self).fingerprint(field_list),
+                            exe, stat.st_size, stat.st_mtime_ns)).encode())
+        for key in self._output_checklist:
+            if self._mask(key) is not None:
+                digest.update(repr(key).encode())
+                digest.update(self._mask(key).index.tobytes())
+        return digest.hexdigest()
+
+    def deterministic(self, field_list):
+        """
+        check if the field list produces identical realizations,
+        i.e., no field has random seed in its checklist
+
+        Parameters
+        ----------
+
+        field_list
+            list of GeneralField objects
+
+        Returns
+        -------
+        bool
+        """
+        for field in field_list:
+            if 'random_seed' in field.field_checklist.keys():
+                return False
+        return True
+
+    def _deterministic_run(self, field_list, sims):
+        """
+        run hammurabi once and copy outputs to the whole ensemble,
+        outputs are flagged as deterministic
+
+        Parameters
+        ----------
+
+        field_list
+            list of GeneralField objects
+
+        sims
+            Simulations object with reserved outputs
+        """
+        log.debug('@ hammurabi::_deterministic_run')
+        self.update_fields(field_list, 0)
+        self._ham()
+        for i in range(self._ensemble_size):
+            self._pack(sims, i, self._ham.sim_map)
+        for key in self._output_checklist:
+            sims[self._output_name(key)].deterministic = True
+
+    def decomposable(self, field_list):
+        """
+        check if outputs of the field list are superposition of
+        regular and random parts, i.e.,
+        outputs are only Faraday depth and dispersion measure,
+        random fields are magnetic or thermal electron fields switchable by cue,
+        Faraday depth meets no random thermal electron field
+        (which is bilinear with magnetic field),
+        and random magnetic fields are isotropic (anisotropy 'rho' of 1 if any),
+        since an anisotropic one is shaped by the local regular field,
+        which is switched off for random parts
+
+        Parameters
+        ----------
+
+        field_list
+            list of GeneralField objects
+
+        Returns
+        -------
+        bool
+        """
+        names = set(key[0] for key in self._output_checklist)
+        if not names.issubset(_LINEAR_DEPENDENCE.keys()):
+            return False
+        for field in field_list:
+            if 'random_seed' in field.field_checklist.keys():
+                kind = self._kind(field)
+                if kind not in _LINEAR_DEPENDENCE['fd']:
+                    return False
+                if kind == 'thermalelectron' and 'fd' in names:
+                    return False
+                if 'rho' in field.field_checklist.keys() and field.parameters.get('rho') != 1.:
+                    return False
+        return True
+
+    def _kind(self, field):
+        """
+        physical quantity of a field, top level of its cue in XML tree,
+        None if it has no cue
+        """
+        clue = field.field_controllist.get('cue')
+        if clue is None:
+            return None
+        return clue[0][0]
+
+    def _switch(self, field_list, on):
+        """
+        switch on (by controllist) or off fields in XML tree
+        """
+        for field in field_list:
+            clue = field.field_controllist.get('cue')
+            if clue is not None:
+                self._ham.mod_par(clue[0], clue[1] if on else {'cue': '0'})
+
+    def _superposition_run(self, field_list, sims):
+        """
+        run hammurabi ensemble by superposing
+        the regular part, simulated once with random fields switched off,
+        and the random part of each realization, simulated with
+        regular fields of the same physical quantity switched off in XML tree
+        (whether set by the field list or by the tree itself),
+        random parts are cached per random seed, parameters of fields involved
+        and the rest of XML tree (see `Hampyx.fingerprint`),
+        zero (thread-time dependent) seeds are never cached,
+        the cache keeps only random parts used in the latest call
+
+        Parameters
+        ----------
+
+        field_list
+            list of GeneralField objects
+
+        sims
+            Simulations object with reserved outputs
+        """
+        log.debug('@ hammurabi::_superposition_run')
+        random_fields = [f for f in field_list if 'random_seed' in f.field_checklist.keys()]
+        regular_fields = [f for f in field_list if 'random_seed' not in f.field_checklist.keys()]
+        random_kinds = set(self._kind(f) for f in random_fields)
+        switched = [f for f in regular_fields if self._kind(f) in random_kinds]
+        # outputs carrying random parts
+        random_keys = [key for key in self._output_checklist
+                       if random_kinds.intersection(_LINEAR_DEPENDENCE[key[0]])]
+        # parameters of fields involved in random parts
+        signature = tuple()
+        for f in field_list:
+            if self._kind(f) in _LINEAR_DEPENDENCE['fd'] and f not in switched:
+                signature += ((f.name, tuple(sorted((k, v) for k, v in f.parameters.items()
+                                                    if k != 'random_seed'))),)
+        # regular part
+        self._switch(random_fields, False)
+        self.update_fields(field_list, 0)
+        self._ham()
+        regular = dict((key, self._ham.sim_map[key]) for key in self._output_checklist)
+        # random parts, with regular fields of the same kinds switched off
+        self._switch(random_fields, True)
+        cues = dict()
+        for kind in random_kinds:
+            element = self._ham.tree.getroot().find('./%s/regular' % kind)
+            if element is not None:
+                cues[kind] = element.get('cue')
+                self._ham.mod_par([kind, 'regular'], {'cue': '0'})
+        signature += (self._ham.fingerprint(),)
+        cache = dict()
+        for i in range(self._ensemble_size):
+            seeds = tuple(f.report_parameters(i)['random_seed'] for f in random_fields)
+            mark = (seeds, signature)
+            if mark in cache.keys():
+                parts = cache[mark]
+            elif mark in self._superposition_cache.keys():
+                parts = self._superposition_cache[mark]
+            else:
+                self.update_fields(field_list, i)
+                self._ham()
+                parts = dict((key, self._ham.sim_map[key]) for key in random_keys)
+            if 0 not in seeds:
+                cache[mark] = parts
+            self._pack(sims, i, dict((key, regular[key] + parts[key]) if key in parts.keys()
+                                     else (key, regular[key]) for key in self._output_checklist))
+        for kind, cue in cues.items():
+            self._ham.mod_par([kind, 'regular'], {'cue': cue})
+        self._superposition_cache = cache
+
+    def _concurrent_run(self, field_list, sims):
+        """
+        run hammurabi ensemble with up to max_workers executables at once,
+        each realization works on its own Hampyx copy,
+        prepared once a slot is free and packed up once its outputs are read,
+        see `imagine.simulators.hammurabi.hampyx.run_ensemble`
+
+        Parameters
+        ----------
+
+        field_list
+            list of GeneralField objects
+
+        sims
+            Simulations object with reserved outputs
+        """
+        log.debug('@ hammurabi::_concurrent_run')
+
+        def prepare(i):
+            self.update_fields(field_list, i)
+            return self._ham.clone()
+
+        def collect(i, ham):
+            self._pack(sims, i, ham.sim_map)
+            for stage, elapsed in ham.timing.items():
+                self._ham.timing[stage] += elapsed
+
+        run_ensemble(prepare, self._ensemble_size, min(self._max_workers, self._ensemble_size), collect)
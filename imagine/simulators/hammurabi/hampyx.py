@@ -3,17 +3,21 @@ developed by Joe Taylor
 based on the initial work of Theo Steininger
 
 warning:
-working directory is set as the same directory as this file
 it relies on subprocess to fork c++ routine and passing data through disk
 so, it is not fast
 
+temporary parameter files and outputs are written in the working directory,
+by default a scratch directory created for each Hampyx object
+under the RAM-backed /dev/shm if available, otherwise under $TMPDIR,
+which is removed once the object (and all its clones) are gone
+
 methods:
 
 # Import class
 In []: import hampyx as hpx
 
 # Initialize object
-In []: object = hpx.hampyx (<xml file path>, <executable path>)
+In []: object = hpx.hampyx (<xml file path>, <executable path>, <working directory>)
 
 hammurabiX executable path is by default '/usr/local/hammurabi/bin/hamx'
 while xml file path is by default './'
@@ -21,6 +25,12 @@ while xml file path is by default './'
 # Modify parameter value from base xml file to temp xml file
 In []: object.mod_par (keychain=['key1','key2',...], attrib={'tag':'content'})
 
+# Register parameters updated between runs
+In []: object.compile_par (targets=[(['key1','key2',...], 'tag'), ...])
+
+the parameter file is then rendered from a cached byte template,
+where only registered parameters (and output file names) are filled in
+
 # Add new parameter with or without attributes
 In []: object.add_par (keychain=['key1','key2',...], subkey='keyfinal', attrib={'tag':'content'})
 
@@ -43,6 +53,31 @@ this will return the current value of the parameter in the XML associated with t
 # Run the executable
 In []: object(verbose=True/False)
 
+# Independent copy for concurrent runs
+In []: other = object.clone()
+
+the copy carries the current parameter tree,
+and writes its own temporary parameter file and outputs
+
+# Run an ensemble of copies concurrently
+In []: hpx.run_ensemble (prepare=<callable i -> Hampyx>, size=<int>, max_inflight=<int>, collect=<callable (i, Hampyx)>)
+
+at most max_inflight executables run at once under asyncio,
+each copy is prepared once a slot is free,
+and collected once its outputs are read,
+writing parameter files and reading outputs happen in threads
+overlapping with running executables
+
+# Read output maps memory-mapped instead of copied
+In []: object.memmap = True
+
+# Time spent in each stage, accumulated over runs
+In []: object.timing
+
+'xml' for writing the temporary parameter file,
+'exe' for the executable run,
+'read' for reading and removing output files
+
 if additional verbose=True (by default is False) hampyx_run.log and hampyx_err.log will be dumped to disk
 notice that dumping logs is not thread safe, use quiet mode in threading
 
@@ -57,31 +92,144 @@ object.sim_map[('sync',str(freq),str(Nside),'PA')] # synchrotron pol. angle at '
 object.sim_map[('fd','nan',str(Nside),'nan')] # Faraday depth map
 object.sim_map[('dm','nan',str(Nside),'nan')] # dispersion measure map
 
+# Fill object.sim_map only with requested entries
+In []: object.sim_map_request = [('sync',str(freq),str(Nside),'Q'), ...]
+
+maps not requested are dropped right after reading,
+derived maps ('PI', 'PA') are computed only if requested,
+by default (None) all maps are kept
+
 detailed caption of each function can be found with their implementation
 """
 
 import os
+import re
+import copy
+import asyncio
 import subprocess
 import healpy as hp
+from astropy.io import fits
 import xml.etree.ElementTree as et
 import numpy as np
 import tempfile as tf
+from xml.sax.saxutils import escape
+from concurrent.futures import ThreadPoolExecutor
 import logging as log
+from imagine.tools.timer import Timer
+
+
+def scratch_root():
+    """
+    root of scratch directories,
+    RAM-backed /dev/shm if available, otherwise $TMPDIR (or the system default)
+    """
+    shm = '/dev/shm'
+    if os.path.isdir(shm) and os.access(shm, os.W_OK | os.X_OK):
+        return shm
+    return tf.gettempdir()
+
+
+# placeholder of template slots, as written by ElementTree
+_SLOT = '{{hampyx:%d}}'
+_SLOT_PATTERN = re.compile(rb'\{\{hampyx:(\d+)\}\}')
+# attribute escaping, as done by ElementTree
+_ATTRIB_ENTITIES = {'"': '&quot;', '\r': '&#13;', '\n': '&#10;', '\t': '&#09;'}
+
+
+def run_ensemble(prepare, size, max_inflight, collect):
+    """
+    run an ensemble of Hampyx objects with a bounded number of in-flight executables,
+    driven by asyncio in its own event loop,
+    if called inside a running event loop (e.g. Jupyter), which cannot be nested,
+    the own loop runs in a helper thread while the calling thread waits
+
+    Parameters
+    ----------
+
+    prepare
+        callable, prepare(i) returns an independent Hampyx object for realization i,
+        called once an in-flight slot is free
+
+    size
+        number of realizations
+
+    max_inflight
+        maximal number of executables running at once
+
+    collect
+        callable, collect(i, ham) is called once outputs of realization i are read,
+        in the thread running the loop, not necessarily in realization order
+    """
+    assert (max_inflight > 0)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:  # no running loop in this thread
+        _run_ensemble(prepare, size, max_inflight, collect)
+        return
+    with ThreadPoolExecutor(max_workers=1) as helper:
+        helper.submit(_run_ensemble, prepare, size, max_inflight, collect).result()
+
+
+def _run_ensemble(prepare, size, max_inflight, collect):
+    """
+    run_ensemble in a new event loop of the current thread
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        with ThreadPoolExecutor(max_workers=max_inflight) as executor:
+            loop.run_until_complete(_ensemble(prepare, size, max_inflight, collect, executor))
+    finally:
+        loop.close()
+
+
+async def _ensemble(prepare, size, max_inflight, collect, executor):
+    """
+    coroutine of run_ensemble
+    """
+    slots = asyncio.Semaphore(max_inflight)
+
+    async def realization(i, ham):
+        try:
+            await ham.run_async(executor)
+            collect(i, ham)
+        finally:
+            slots.release()
+
+    tasks = list()
+    try:
+        for i in range(size):
+            await slots.acquire()
+            # stop preparing once a realization fails
+            if any(task.done() and not task.cancelled() and task.exception() is not None for task in tasks):
+                break
+            tasks.append(asyncio.ensure_future(realization(i, prepare(i))))
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
 
 
 class Hampyx(object):
     """
     default executable path is None, we will search users' environment,
     default executable path is './params.xml',
+    default working directory is None, a scratch directory is created,
     otherwise, *absolute* paths are required!!!
     """
     def __init__(self,
                  xml_path='./params.xml',
-                 exe_path=None):
+                 exe_path=None,
+                 wk_dir=None):
         log.debug('initialize Hampyx')
-        # current working directory
-        self.wk_dir = os.path.abspath(os.path.dirname(os.path.realpath(__file__)))
+        # working directory for temporary files
+        self.wk_dir = wk_dir
         log.debug('set working directory at %s' % self.wk_dir)
+        # accumulated time of each stage
+        self._timing = {'xml': 0., 'exe': 0., 'read': 0.}
+        # memory-mapping output maps
+        self.memmap = False
         # encapsulated below
         self.exe_path = exe_path
         self.xml_path = xml_path
@@ -92,6 +240,8 @@ class Hampyx(object):
         # simulation output
         self.sim_map_name = {}
         self.sim_map = {}
+        self.sim_map_request = None
+        self.sim_map_index = None
         # switches
         self._do_sync = False
         self._do_dm = False
@@ -134,7 +284,36 @@ class Hampyx(object):
 
     @wk_dir.setter
     def wk_dir(self, wk_dir):
-        self._wk_dir = wk_dir
+        if wk_dir is None:
+            # removed with the last object referring to it
+            self._scratch = tf.TemporaryDirectory(prefix='hampyx_', dir=scratch_root())
+            self._wk_dir = self._scratch.name
+        else:
+            assert isinstance(wk_dir, str)
+            self._scratch = None
+            self._wk_dir = os.path.abspath(wk_dir)
+
+    @property
+    def memmap(self):
+        """
+        if True, output files are memory-mapped instead of read into memory at once,
+        maps are still returned as float64 copies,
+        so memory is only saved where parts of a file are used,
+        i.e., unrequested columns and pixels left out by sim_map_index
+        """
+        return self._memmap
+
+    @memmap.setter
+    def memmap(self, memmap):
+        assert (memmap in (True, False))
+        self._memmap = memmap
+
+    @property
+    def timing(self):
+        """
+        accumulated time (in seconds) of each stage
+        """
+        return self._timing
 
     @property
     def temp_file(self):
@@ -151,6 +330,9 @@ class Hampyx(object):
     @tree.setter
     def tree(self, tree):
         self._tree = tree
+        # registered template slots, set of (element, tag)
+        self._slots = set()
+        self._reset_template()
         log.debug('capture XML parameter tree from %s' % str(tree))
 
     @property
@@ -166,6 +348,41 @@ class Hampyx(object):
             self._sim_map_name = sim_map_name
             log.debug('set simulation map name dict %s ' % str(sim_map_name))
 
+    @property
+    def sim_map_request(self):
+        """
+        keys of sim_map to be filled, None for all
+        """
+        return self._sim_map_request
+
+    @sim_map_request.setter
+    def sim_map_request(self, sim_map_request):
+        if sim_map_request is None:
+            self._sim_map_request = None
+        else:
+            self._sim_map_request = frozenset(tuple(k) for k in sim_map_request)
+        log.debug('set simulation map request %s' % str(sim_map_request))
+
+    @property
+    def sim_map_index(self):
+        """
+        pixel indices (in RING ordering) of sim_map entries, {key: index},
+        entries with an index hold the map at these pixels only,
+        which are gathered from output files without copying whole columns,
+        None (or missing keys) for full maps
+        """
+        return self._sim_map_index
+
+    @sim_map_index.setter
+    def sim_map_index(self, sim_map_index):
+        if sim_map_index is None:
+            self._sim_map_index = None
+        else:
+            self._sim_map_index = dict((tuple(k), np.asarray(v, dtype=np.int64))
+                                       for k, v in sim_map_index.items())
+        log.debug('set simulation map index for %s' % str(sim_map_index if sim_map_index is None
+                                                            else list(sim_map_index.keys())))
+
     @property
     def sim_map(self):
         return self._sim_map
@@ -183,9 +400,13 @@ class Hampyx(object):
         """
         the main routine for running hammurabiX executable
         """
+        t = Timer()
         # create new temp parameter file
+        t.tick('xml')
         if self.temp_file is self._base_file:
             self._new_xml_copy()
+        self._timing['xml'] += t.tock('xml')
+        t.tick('exe')
         # if need verbose output
         if verbose is True:
             logfile = open('hammurabiX_run.log', 'w')
@@ -206,9 +427,64 @@ class Hampyx(object):
                 last_call_log, last_call_err = temp_process.communicate()
                 print(last_call_log)
                 print(last_call_err)
+        self._timing['exe'] += t.tock('exe')
         # grab output maps and delete temp files
+        t.tick('read')
         self._get_sims()
         self._del_xml_copy()
+        self._timing['read'] += t.tock('read')
+
+    async def run_async(self, executor=None):
+        """
+        coroutine version of the main routine in quiet mode,
+        the executable runs as asyncio subprocess,
+        writing parameter file and reading outputs are done in executor (threads),
+        so that they overlap with other running executables
+        """
+        loop = asyncio.get_running_loop()
+        t = Timer()
+        # create new temp parameter file
+        t.tick('xml')
+        if self.temp_file is self._base_file:
+            await loop.run_in_executor(executor, self._new_xml_copy)
+        self._timing['xml'] += t.tock('xml')
+        t.tick('exe')
+        temp_process = await asyncio.create_subprocess_exec(self._executable, self._temp_file,
+                                                            stdout=subprocess.PIPE,
+                                                            stderr=subprocess.STDOUT)
+        last_call_log, last_call_err = await temp_process.communicate()
+        if temp_process.returncode != 0:
+            print(last_call_log)
+            print(last_call_err)
+        self._timing['exe'] += t.tock('exe')
+        # grab output maps and delete temp files
+        t.tick('read')
+        await loop.run_in_executor(executor, self._get_sims)
+        self._del_xml_copy()
+        self._timing['read'] += t.tock('read')
+
+    def clone(self):
+        """
+        return an independent copy carrying the current parameter tree,
+        its temporary parameter file and outputs are isolated from the origin,
+        so that copies can run the executable concurrently (in quiet mode)
+        """
+        new = copy.copy(self)
+        new._tree = copy.deepcopy(self._tree)
+        # move cached element handles onto the copied tree
+        pair = dict(zip(self._tree.iter(), new._tree.iter()))
+        new._handles = dict((k, pair[v]) for k, v in self._handles.items())
+        new._slots = set((pair[elem], tag) for elem, tag in self._slots)
+        if self._outputs is not None:
+            new._outputs = [(k, pair[elem], prefix) for k, elem, prefix in self._outputs]
+        if self._template is not None:
+            chunks, order = self._template
+            new._template = (chunks, [(pair[elem], tag) for elem, tag in order])
+        new._sim_map_name = dict()
+        new._sim_map = dict()
+        new._temp_file = self._base_file
+        new._timing = dict.fromkeys(self._timing, 0.)
+        return new
 
     def _new_xml_copy(self):
         """
@@ -216,35 +492,108 @@ class Hampyx(object):
         """
         # create a random file name which doesn't exist currently
         fd, new_path = tf.mkstemp(prefix='params_', suffix='.xml', dir=self._wk_dir)
-        os.close(fd)
         rnd_idx = new_path[new_path.index('params_')+7:-4]
         self.temp_file = new_path
-        # copy base_file to temp_file
+        # locate output entries once
+        if self._outputs is None:
+            self._outputs = self._find_outputs()
+        for key, target, prefix in self._outputs:
+            self.sim_map_name[key] = os.path.join(self._wk_dir, prefix+rnd_idx+'.fits')
+            target.set('filename', self.sim_map_name[key])
+        # render from byte template
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self._render())
+
+    def _find_outputs(self):
+        """
+        locate output entries in the tree
+
+        return
+        ------
+        list of (sim_map_name key, XML element, output file name prefix)
+        """
         root = self.tree.getroot()
-        # count number of sync output files
-        if root.find("./observable/sync[@cue='1']") is not None:
+        outputs = list()
+        # for each sync output
+        for sync in root.findall("./observable/sync[@cue='1']"):
             self._do_sync = True
-            # for each sync output
-            for sync in root.findall("./observable/sync[@cue='1']"):
-                freq = str(sync.get('freq'))
-                nside = str(sync.get('nside'))
-                self.sim_map_name[('sync', freq, nside)] = os.path.join(self.wk_dir,
-                                                                        'sync_'+freq+'_'+nside+'_'+rnd_idx+'.fits')
-                sync.set('filename', self.sim_map_name[('sync', freq, nside)])
+            freq = str(sync.get('freq'))
+            nside = str(sync.get('nside'))
+            outputs.append((('sync', freq, nside), sync, 'sync_'+freq+'_'+nside+'_'))
         fd = root.find("./observable/faraday[@cue='1']")
         if fd is not None:
             self._do_fd = True
             nside = str(fd.get('nside'))
-            self.sim_map_name[('fd', 'nan', nside)] = os.path.join(self.wk_dir, 'fd_'+nside+'_'+rnd_idx+'.fits')
-            fd.set('filename', self.sim_map_name[('fd', 'nan', nside)])
+            outputs.append((('fd', 'nan', nside), fd, 'fd_'+nside+'_'))
         dm = root.find("./observable/dm[@cue='1']")
         if dm is not None:
             self._do_dm = True
             nside = str(dm.get('nside'))
-            self.sim_map_name[('dm', 'nan', nside)] = os.path.join(self._wk_dir, 'dm_'+nside+'_'+rnd_idx+'.fits')
-            dm.set('filename', self.sim_map_name[('dm', 'nan', nside)])
-        # automatically create a new file
-        self.tree.write(self.temp_file)
+            outputs.append((('dm', 'nan', nside), dm, 'dm_'+nside+'_'))
+        return outputs
+
+    def _render(self):
+        """
+        serialize the tree into bytes, identical to ElementTree.write,
+        by filling current values of template slots into the cached byte template
+        """
+        if self._template is None:
+            self._compile_template()
+        chunks, order = self._template
+        rslt = [chunks[0]]
+        for (target, tag), chunk in zip(order, chunks[1:]):
+            rslt.append(escape(target.get(tag), _ATTRIB_ENTITIES).encode('us-ascii', 'xmlcharrefreplace'))
+            rslt.append(chunk)
+        return b''.join(rslt)
+
+    def _compile_template(self):
+        """
+        serialize the tree once with placeholders at template slots,
+        registered parameters and output file names,
+        and split it into byte chunks around the placeholders
+        """
+        log.debug('compile hammurabiX XML parameter template')
+        slots = [(target, tag) for target, tag in self._slots if target.get(tag) is not None]
+        # output file names are always filled in, even if not set yet
+        slots += [(target, 'filename') for _, target, _ in self._outputs or ()]
+        slots = list(dict.fromkeys(slots))
+        values = [target.get(tag) for target, tag in slots]
+        for i, (target, tag) in enumerate(slots):
+            target.set(tag, _SLOT % i)
+        try:
+            raw = et.tostring(self.tree.getroot(), encoding='us-ascii')
+        finally:
+            for (target, tag), value in zip(slots, values):
+                if value is None:
+                    del target.attrib[tag]
+                else:
+                    target.set(tag, value)
+        parts = _SLOT_PATTERN.split(raw)
+        self._template = (parts[0::2], [slots[int(i)] for i in parts[1::2]])
+
+    def fingerprint(self):
+        """
+        serialized tree with registered parameters and output file names left out,
+        i.e., the configuration shared by runs until the tree is modified otherwise
+
+        return
+        ------
+        bytes
+        """
+        if self._outputs is None:
+            self._outputs = self._find_outputs()
+        if self._template is None:
+            self._compile_template()
+        return b'\0'.join(self._template[0])
+
+    def _reset_template(self):
+        """
+        drop cached element handles, output entries and byte template,
+        necessary once the tree structure changes
+        """
+        self._handles = dict()
+        self._outputs = None
+        self._template = None
 
     def _get_sims(self):
         """
@@ -263,19 +612,25 @@ class Hampyx(object):
                 sync_key.append(k)
             else:
                 raise ValueError('mismatched key %s' % str(k))
+        # outputs of previous run are dropped
+        self._sim_map.clear()
         # read dispersion measure and delete file
         if self._do_dm is True:
             if os.path.isfile(self.sim_map_name[dm_key]):
-                [DM] = self._read_fits_file(self.sim_map_name[dm_key])
-                self.sim_map[(dm_key[0], dm_key[1], dm_key[2], 'nan')] = DM
+                key = (dm_key[0], dm_key[1], dm_key[2], 'nan')
+                if self._requested(key):
+                    [DM] = self._read_fits_file(self.sim_map_name[dm_key], index={0: self._index(key)})
+                    self.sim_map[key] = DM
                 os.remove(self.sim_map_name[dm_key])
             else:
                 raise ValueError('missing %s' % str(self.sim_map_name[dm_key]))
         # read faraday depth and delete file
         if self._do_fd is True:
             if os.path.isfile(self.sim_map_name[fd_key]):
-                [Fd] = self._read_fits_file(self.sim_map_name[fd_key])
-                self.sim_map[(fd_key[0], fd_key[1], fd_key[2], 'nan')] = Fd
+                key = (fd_key[0], fd_key[1], fd_key[2], 'nan')
+                if self._requested(key):
+                    [Fd] = self._read_fits_file(self.sim_map_name[fd_key], index={0: self._index(key)})
+                    self.sim_map[key] = Fd
                 os.remove(self.sim_map_name[fd_key])
             else:
                 raise ValueError('missing %s' % str(self.sim_map_name[fd_key]))
@@ -284,31 +639,107 @@ class Hampyx(object):
             for i in sync_key:
                 # if file exists
                 if os.path.isfile(self.sim_map_name[i]):
-                    [Is, Qs, Us] = self._read_fits_file(self.sim_map_name[i])
-                    self.sim_map[(i[0], i[1], i[2], 'I')] = Is
-                    self.sim_map[(i[0], i[1], i[2], 'Q')] = Qs
-                    self.sim_map[(i[0], i[1], i[2], 'U')] = Us
+                    flags = [flag for flag in ('I', 'Q', 'U', 'PI', 'PA')
+                             if self._requested((i[0], i[1], i[2], flag))]
+                    # derived maps need both Q and U
+                    fields = [f for f, flag in enumerate(('I', 'Q', 'U'))
+                              if flag in flags or (flag != 'I' and ('PI' in flags or 'PA' in flags))]
+                    # pixels read from each field, common to all maps it enters
+                    index = dict()
+                    for f, field_flags in ((0, ('I',)), (1, ('Q', 'PI', 'PA')), (2, ('U', 'PI', 'PA'))):
+                        index[f] = self._common_index([self._index((i[0], i[1], i[2], flag))
+                                                       for flag in field_flags if flag in flags])
+                    [Is, Qs, Us] = [None]*3
+                    if fields:
+                        [Is, Qs, Us] = self._read_fits_file(self.sim_map_name[i], fields, index)
+                    for f, flag, value in ((0, 'I', Is), (1, 'Q', Qs), (2, 'U', Us)):
+                        if flag in flags:
+                            key = (i[0], i[1], i[2], flag)
+                            self.sim_map[key] = self._gather(value, index[f], self._index(key))
                     # polarisation intensity
-                    self.sim_map[(i[0], i[1], i[2], 'PI')] = np.sqrt(np.square(Qs) + np.square(Us))
+                    if 'PI' in flags:
+                        key = (i[0], i[1], i[2], 'PI')
+                        Qk = self._gather(Qs, index[1], self._index(key))
+                        Uk = self._gather(Us, index[2], self._index(key))
+                        self.sim_map[key] = np.sqrt(np.square(Qk) + np.square(Uk))
                     # polarisatioin angle, IAU convention
-                    self.sim_map[(i[0], i[1], i[2], 'PA')] = np.arctan2(Us, Qs)/2.0
+                    if 'PA' in flags:
+                        key = (i[0], i[1], i[2], 'PA')
+                        Qk = self._gather(Qs, index[1], self._index(key))
+                        Uk = self._gather(Us, index[2], self._index(key))
+                        self.sim_map[key] = np.arctan2(Uk, Qk)/2.0
                     os.remove(self.sim_map_name[i])
                 else:
                     raise ValueError('missing %s' % str(self.sim_map_name[i]))
 
-    def _read_fits_file(self, path):
+    def _requested(self, key):
+        """
+        check if a sim_map entry is requested
+        """
+        return self._sim_map_request is None or key in self._sim_map_request
+
+    def _index(self, key):
+        """
+        pixel index of a sim_map entry, None for full map
+        """
+        if self._sim_map_index is None:
+            return None
+        return self._sim_map_index.get(key)
+
+    def _common_index(self, indices):
         """
-        read a single fits file with healpy
+        pixel index shared by all given indices, None (full map) if any differs
+        """
+        if len(indices) == 0 or any(index is None for index in indices):
+            return None
+        for index in indices[1:]:
+            if not np.array_equal(index, indices[0]):
+                return None
+        return indices[0]
+
+    def _gather(self, values, read_index, index):
+        """
+        map at the given pixel index (None for full map),
+        from values read at read_index (None for full map),
+        where read_index is either None or the given index
+        """
+        if index is None or read_index is not None:
+            return values
+        return values[index]
+
+    def _read_fits_file(self, path, fields=None, index=None):
+        """
+        read all fields of a single HEALPix fits file,
+        the file is opened once and the number of fields is taken from the header,
+        maps are returned in RING ordering as native float64 copies,
+        independent of the file (which is removed after reading),
+        if a list of field indices is given, other fields are returned as None,
+        if pixel indices (in RING ordering) are given as {field index: pixel index},
+        only these pixels of the field are gathered from the (memory-mapped) column
         """
         rslt = []
-        i = 0
-        while True:
-            try:
-                loaded_map = hp.read_map(path, verbose=False, field=i)
+        with fits.open(path, memmap=self._memmap) as hdul:
+            table = hdul[1]
+            nested = str(table.header.get('ORDERING', 'RING')).strip() == 'NESTED'
+            for i in range(table.header['TFIELDS']):
+                if fields is not None and i not in fields:
+                    rslt += [None]
+                    continue
+                pixels = None if index is None else index.get(i)
+                if pixels is None:
+                    # converted from (big-endian) FITS column in a single copy
+                    loaded_map = np.array(table.data.field(i), dtype=np.float64).reshape(-1)
+                    if nested:
+                        loaded_map = hp.reorder(loaded_map, n2r=True)
+                else:
+                    # column as (rows, pixels per row) view, without copying
+                    column = table.data.field(i)
+                    column = column.reshape(column.shape[0], -1)
+                    if nested:
+                        pixels = hp.ring2nest(hp.npix2nside(column.size), pixels)
+                    loaded_map = np.array(column[pixels // column.shape[1], pixels % column.shape[1]],
+                                          dtype=np.float64)
                 rslt += [loaded_map]
-                i += 1
-            except IndexError:
-                break
         return rslt
 
     def _del_xml_copy(self):
@@ -336,15 +767,50 @@ class Hampyx(object):
         # input type check
         if type(attrib) is not dict or type(keychain) is not list:
             raise ValueError('wrong input %s %s' % (keychain, attrib))
-        root = self.tree.getroot()
+        target = self._locate(keychain)
+        for i in attrib:
+            value = attrib.get(i)
+            old = target.get(i)
+            if old == value:  # patch only changes
+                continue
+            target.set(i, value)
+            # template slots are filled in at rendering
+            if old is None or (target, i) not in self._slots:
+                self._template = None
+
+    def compile_par(self, targets=None):
+        """
+        register parameters updated between runs
+        argument of type [(['path','to','target'], 'tag'), ...]
+        the temporary parameter file is rendered from a cached byte template,
+        where only registered parameters and output file names are filled in,
+        other modifications of the tree trigger recompilation
+        """
+        # input type check
+        if type(targets) is not list:
+            raise ValueError('wrong input %s' % targets)
+        slots = set((self._locate(keychain), tag) for keychain, tag in targets)
+        if slots != self._slots:
+            self._slots = slots
+            self._template = None
+
+    def _locate(self, keychain):
+        """
+        find (and cache) parameter element
+        argument of type ['path','to','target']
+        """
+        try:
+            return self._handles[tuple(keychain)]
+        except KeyError:
+            pass
         path_str = '.'
         for key in keychain:
             path_str += '/' + key
-        target = root.find(path_str)
+        target = self.tree.getroot().find(path_str)
         if target is None:
             raise ValueError('wrong path %s' % path_str)
-        for i in attrib:
-            target.set(i, attrib.get(i))
+        self._handles[tuple(keychain)] = target
+        return target
 
     def add_par(self, keychain=None, subkey=None, attrib=None):
         """
@@ -376,6 +842,7 @@ class Hampyx(object):
             et.SubElement(target, subkey)
         else:
             raise ValueError('wrong input %s %s %s' % (keychain, subkey, attrib))
+        self._reset_template()
 
 
     def print_par(self, keychain=None):
@@ -431,5 +898,8 @@ class Hampyx(object):
                     parent.remove(i)
             else:
                 raise ValueError('unsupported option at %s' % keychain)
+            remained = set(root.iter())
+            self._slots = set((elem, tag) for elem, tag in self._slots if elem in remained)
+            self._reset_template()
         else:
             raise ValueError('empty keychain')
@@ -10,3 +10,23 @@ class Simulator(object):
 
     def __call__(self, field_list):
         raise NotImplementedError
+
+    def fingerprint(self, field_list):
+        """
+        description of simulator configuration affecting outputs
+        of the given field list, apart from field parameters,
+        used in caching outputs (see `imagine.simulators.cached_simulator`),
+        by default the simulator class and its output_checklist,
+        simulators with further settings should extend it
+
+        Parameters
+        ----------
+
+        field_list
+            list of GeneralField objects
+
+        Returns
+        -------
+        str
+        """
+        return repr((type(self).__module__, type(self).__name__, tuple(self.output_checklist)))
@@ -8,11 +8,18 @@ For the testing suits, please turn to "imagine/tests/tools_tests.py".
 import numpy as np
 from mpi4py import MPI
 import logging as log
-from imagine.tools.mpi_helper import mpi_mean, mpi_trans, mpi_mult, mpi_eye, mpi_trace
+from imagine.tools.mpi_helper import mpi_arrange, mpi_mean, mpi_trans, mpi_mult, mpi_eye
+from imagine.tools.mpi_helper import DistributedArray, get_comm
 
-comm = MPI.COMM_WORLD
-mpisize = comm.Get_size()
-mpirank = comm.Get_rank()
+def _ensemble(data):
+    """
+    global ensemble size, local rows and row layout of the ensemble,
+    the layout is collected only if not cached by DistributedArray
+    """
+    if not isinstance(data, DistributedArray):
+        data = DistributedArray(data)
+    assert (len(data.data.shape) == 2)
+    return np.uint(data.global_shape[0]), data.data, data.row_counts
 
 def empirical_cov(data):
     r"""
@@ -39,7 +46,7 @@ def empirical_cov(data):
 
     Parameters
     ----------
-    data : numpy.ndarray
+    data : numpy.ndarray or DistributedArray
         ensemble of observables, in global shape (ensemble size, data size)
 
     Returns
@@ -49,16 +56,11 @@ def empirical_cov(data):
         (data size, data size) each node takes part of the rows
     """
     log.debug('@ covariance_estimator::empirical_cov')
-    assert isinstance(data, np.ndarray)
-    assert (len(data.shape) == 2)
     # Get ensemble size (i.e. the number of rows)
-    ensemble_size = np.array(0, dtype=np.uint)
-    comm.Allreduce([np.array(data.shape[0], dtype=np.uint),
-                    MPI.LONG], [ensemble_size, MPI.LONG],
-                   op=MPI.SUM)
+    ensemble_size, data, row_counts = _ensemble(data)
     # Calculates covariance
-    u = data - mpi_mean(data)
-    cov = mpi_mult(mpi_trans(u), u) / ensemble_size
+    u = DistributedArray(data - mpi_mean(data), row_counts)
+    cov = mpi_mult(u, u, trans_left=True) / ensemble_size
     return cov
 
 def oas_cov(data):
@@ -90,7 +92,7 @@ def oas_cov(data):
 
     Parameters
     ----------
-    data : numpy.ndarray
+    data : numpy.ndarray or DistributedArray
         distributed data in global shape (ensemble_size, data_size)
 
     Returns
@@ -112,7 +114,7 @@ def oas_mcov(data):
 
     Parameters
     ----------
-    data : numpy.ndarray
+    data : numpy.ndarray or DistributedArray
         distributed data in global shape (ensemble_size, data_size)
 
     Returns
@@ -123,22 +125,47 @@ def oas_mcov(data):
         distributed covariance matrix in shape (data_size, data_size)
     """
     log.debug('@ covariance_estimator::oas_mcov')
-    assert isinstance(data, np.ndarray)
-    assert (len(data.shape) == 2)
-
     # Finds ensemble size and data size
+    ensemble_size, data, row_counts = _ensemble(data)
     data_size = data.shape[1]
-    ensemble_size = np.array(0, dtype=np.uint)
-    comm.Allreduce([np.array(data.shape[0], dtype=np.uint), MPI.LONG],
-                   [ensemble_size, MPI.LONG], op=MPI.SUM)
 
     # Calculates OAS covariance extimator from empirical covariance estimator
     mean = mpi_mean(data)
-    u = data - mean
-    s = mpi_mult(mpi_trans(u), u) / ensemble_size
-    trs = mpi_trace(s)
-    trs2 = mpi_trace(mpi_mult(s, s))
+    u = DistributedArray(data - mean, row_counts)
+    s = mpi_mult(u, u, trans_left=True) / ensemble_size
+    # tr(S) and tr(S^2)=|S|_F^2 (S is symmetric) from local sums in one reduction
+    row_begin, row_end = mpi_arrange(data_size)
+    traces = np.array([np.trace(s, offset=int(row_begin)), np.sum(np.square(s))], dtype=np.float64)
+    get_comm().Allreduce(MPI.IN_PLACE, [traces, MPI.DOUBLE], op=MPI.SUM)
+    trs, trs2 = traces
+
+    rho = oas_shrinkage(trs, trs2, data_size, ensemble_size)
+    cov = (1.-rho)*s+mpi_eye(data_size)*rho*trs/data_size
+
+    return mean, cov
+
+def oas_shrinkage(trs, trs2, data_size, ensemble_size):
+    r"""
+    OAS shrinkage coefficient :math:`\rho`
+
+    See `imagine.tools.covariance_estimator.oas_cov` for details.
+
+    Parameters
+    ----------
+    trs : float
+        trace of the empirical covariance
+    trs2 : float
+        trace of the squared empirical covariance
+    data_size : int
+        data size
+    ensemble_size : int
+        ensemble size
 
+    Returns
+    -------
+    rho : float
+        shrinkage coefficient
+    """
     numerator = (1.0 - 2.0/data_size)*trs2 + trs*trs
     denominator = (ensemble_size +1.0-2.0/data_size)*(trs2 - (trs*trs)/data_size)
 
@@ -146,6 +173,58 @@ def oas_mcov(data):
         rho = 1
     else:
         rho = np.min([1, numerator/denominator])
-    cov = (1.-rho)*s+mpi_eye(data_size)*rho*trs/data_size
+    return rho
 
-    return mean, cov
+def oas_lowrank_mcov(data):
+    r"""
+    Estimate covariance with the Oracle Approximating Shrinkage algorithm,
+    in the low-rank representation.
+
+    The OAS covariance is a scaled identity plus a rank-N update
+
+    .. math::
+          \text{cov}_\text{OAS} = \tfrac{1}{m} t \rho I_m + \tfrac{1-\rho}{N} U^T U
+
+    so instead of forming the dense matrix, this function returns
+    the centered ensemble, its :math:`N\times N` Gram matrix :math:`U U^T`
+    and the two coefficients. All trace statistics come from the Gram matrix.
+
+    See `imagine.tools.covariance_estimator.oas_cov` for details.
+
+    Parameters
+    ----------
+    data : numpy.ndarray or DistributedArray
+        distributed data in global shape (ensemble_size, data_size)
+
+    Returns
+    -------
+    mean : numpy.ndarray
+        copied ensemble mean (on all nodes)
+    u : numpy.ndarray
+        distributed centered ensemble transposed, :math:`U^T`,
+        in global shape (data_size, ensemble_size)
+    gram : numpy.ndarray
+        copied Gram matrix :math:`U U^T`, in shape (ensemble_size, ensemble_size)
+    diagonal : float
+        coefficient of the identity
+    factor : float
+        coefficient of the low-rank part
+    """
+    log.debug('@ covariance_estimator::oas_lowrank_mcov')
+    _, data, row_counts = _ensemble(data)
+
+    # centered ensemble, distributed by data (column) index
+    data_size = data.shape[1]
+    mean = mpi_mean(data)
+    u = mpi_trans(DistributedArray(data - mean, row_counts))
+    gram = np.dot(np.transpose(u), u)
+    get_comm().Allreduce(MPI.IN_PLACE, [gram, MPI.DOUBLE], op=MPI.SUM)
+    ensemble_size = gram.shape[0]
+
+    # tr(S) and tr(S^2)=|S|_F^2 from the Gram matrix
+    trs = np.trace(gram)/ensemble_size
+    trs2 = np.sum(np.square(gram))/ensemble_size**2
+
+    rho = oas_shrinkage(trs, trs2, data_size, ensemble_size)
+
+    return mean, u, gram, rho*trs/data_size, (1.-rho)/ensemble_size
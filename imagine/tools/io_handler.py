@@ -23,13 +23,9 @@ from mpi4py import MPI
 import h5py
 import os
 import logging as log
-from imagine.tools.mpi_helper import mpi_arrange
+from imagine.tools.mpi_helper import mpi_arrange, get_comm
 
 
-comm = MPI.COMM_WORLD
-mpisize = comm.Get_size()
-mpirank = comm.Get_rank()
-
 class io_handler(object):
     """
     Handles the IO
@@ -88,6 +84,7 @@ class io_handler(object):
             in form 'group name/dataset name'
         """
         log.debug('@ io_handler::write')
+        comm = get_comm()
         assert isinstance(data, np.ndarray)
         assert (len(data.shape) == 2)
         assert isinstance(file, str)
@@ -95,7 +92,7 @@ class io_handler(object):
         # combine wk_path with filename
         self.file_path = os.path.join(self._wk_dir, file)
         # master node writing
-        if not mpirank:
+        if not comm.Get_rank():
             # write permission, create if not exist
             with h5py.File(self._file_path, mode='a') as fh:
                 # create group and dataset
@@ -126,6 +123,9 @@ class io_handler(object):
             in form 'group name/dataset name'
         """
         log.debug('@ io_handler::write')
+        comm = get_comm()
+        mpisize = comm.Get_size()
+        mpirank = comm.Get_rank()
         assert isinstance(data, np.ndarray)
         assert (len(data.shape) == 2)
         assert isinstance(file, str)
@@ -195,7 +195,7 @@ class io_handler(object):
         with h5py.File(self._file_path, mode='r') as fh:
             assert (fh[key].shape[0] == 1)
             data = fh[key][:,:]
-        comm.Barrier()
+        get_comm().Barrier()
         return data
         
     def read_dist(self, file, key):
@@ -230,5 +230,5 @@ class io_handler(object):
             global_shape = fh[key].shape
             offset_begin, offset_end = mpi_arrange(global_shape[0])
             data = fh[key][offset_begin:offset_end,:]
-        comm.Barrier()
+        get_comm().Barrier()
         return data
@@ -4,17 +4,91 @@ and/or the associated covariance matrix.
 For the testing suits, please turn to "imagine/tests/tools_tests.py".
 
 implemented with numpy.ndarray raw data
+
+masking is done with the kept pixel indices compiled by CompiledMask,
+which can be built once and applied to any number of data sets
+
+masked covariance rows are redistributed to the balanced layout
+of `imagine.tools.mpi_helper.mpi_arrange`, so heavy masks
+do not leave the nodes unequally loaded
 """
 
 import numpy as np
-from copy import deepcopy
-from mpi4py import MPI
 import logging as log
-from imagine.tools.mpi_helper import mpi_arrange
+from imagine.tools.mpi_helper import mpi_rebalance, get_comm, DistributedArray
+from imagine.tools.icy_decorator import icy
+
+
+@icy
+class CompiledMask(object):
+    """
+    Index representation of a mask map,
+    masking becomes a single gather of the kept pixels
+
+    Parameters
+    ----------
+    mask : numpy.ndarray
+        copied mask map in shape (1, data size) on each node
+    """
+    def __init__(self, mask):
+        log.debug('@ masker::CompiledMask::__init__')
+        assert isinstance(mask, np.ndarray)
+        assert (len(mask.shape) == 2)
+        assert (mask.shape[0] == 1)
+        self._size = mask.shape[1]
+        self._index = np.flatnonzero(mask[0].astype(bool))
+
+    @property
+    def size(self):
+        """
+        Data size before masking (`int`, read-only)
+        """
+        return self._size
+
+    @property
+    def masked_size(self):
+        """
+        Data size after masking (`int`, read-only)
+        """
+        return self._index.size
+
+    @property
+    def index(self):
+        """
+        Indices of the kept pixels (`numpy.ndarray`, read-only)
+        """
+        return self._index
 
-comm = MPI.COMM_WORLD
-mpisize = comm.Get_size()
-mpirank = comm.Get_rank()
+    def apply_obs(self, obs):
+        """
+        Applies the mask to an observable,
+        see `imagine.tools.masker.mask_obs`
+        """
+        log.debug('@ masker::CompiledMask::apply_obs')
+        assert isinstance(obs, np.ndarray)
+        assert (obs.shape[0] >= 1)
+        assert (obs.shape[1] == self._size)
+        return np.take(obs, self._index, axis=1)
+
+    def apply_cov(self, cov):
+        """
+        Applies the mask to the observable covariance,
+        see `imagine.tools.masker.mask_cov`
+        """
+        log.debug('@ masker::CompiledMask::apply_cov')
+        if not isinstance(cov, DistributedArray):
+            assert isinstance(cov, np.ndarray)
+            cov = DistributedArray.arranged(cov, self._size)  # balanced layout
+        assert (cov.data.shape[1] == self._size)
+        # kept rows on each node, known from the copied mask without communication
+        kept_begins = np.searchsorted(self._index, cov.row_offsets)
+        kept_ends = np.searchsorted(self._index, cov.row_offsets + cov.row_counts)
+        rank = get_comm().Get_rank()
+        rows = self._index[kept_begins[rank]:kept_ends[rank]] - cov.row_begin
+        masked = cov.data[np.ix_(rows, self._index)]
+        if self.masked_size < get_comm().Get_size():
+            return masked  # too few rows to be balanced
+        return mpi_rebalance(DistributedArray(masked, kept_ends - kept_begins))
 
 
 def mask_obs(obs, mask):
@@ -27,7 +101,7 @@ def mask_obs(obs, mask):
         ensemble of observables, in global shape (ensemble size, data size)
         each node contains part of the global rows
 
-    mask : numpy.ndarray
+    mask : numpy.ndarray or CompiledMask
         copied mask map in shape (1, data size) on each node
 
     Returns
@@ -36,22 +110,9 @@ def mask_obs(obs, mask):
         Masked observable of shape (ensemble size, masked data size)
     """
     log.debug('@ masker::mask_data')
-    assert isinstance(obs, np.ndarray)
-    assert isinstance(mask, np.ndarray)
-    assert (obs.shape[0] >= 1)
-    assert (mask.shape[0] == 1)
-    assert (obs.shape[1] == mask.shape[1])
-    new_obs = deepcopy(obs)
-    raw_mask = (deepcopy(mask)).astype(np.bool)
-    #
-    idx = int(0)
-    for ptr in raw_mask[0]:
-        if not ptr:
-            new_obs = np.delete(new_obs, idx, 1)
-        else:
-            idx += int(1)
-    assert (new_obs.shape[1] == idx)
-    return new_obs
+    if not isinstance(mask, CompiledMask):
+        mask = CompiledMask(mask)
+    return mask.apply_obs(obs)
 
 def mask_cov(cov, mask):
     """
@@ -59,38 +120,20 @@ def mask_cov(cov, mask):
 
     Parameters
     ----------
-    cov : distributed numpy.ndarray
+    cov : distributed numpy.ndarray or DistributedArray
         covariance matrix of observalbes in global shape (data size, data size)
-        each node contains part of the global rows
-    mask : numpy.ndarray
+        each node contains part of the global rows,
+        numpy.ndarray is assumed to be arranged as `imagine.tools.mpi_helper.mpi_arrange`
+    mask : numpy.ndarray or CompiledMask
         copied mask map in shape (1, data size)
 
     Returns
     -------
     numpy.ndarray
         Masked covariance matrix of shape (masked data size, masked data size)
+        arranged as `imagine.tools.mpi_helper.mpi_arrange`
     """
     log.debug('@ masker::mask_cov')
-    assert isinstance(cov, np.ndarray)
-    assert isinstance(mask, np.ndarray)
-    assert (mask.shape[0] == 1)
-    assert (cov.shape[1] == mask.shape[1])
-    new_cov = deepcopy(cov)
-    raw_mask = (deepcopy(mask)).astype(np.bool)
-    # masking cols
-    col_idx = int(0)
-    for ptr in raw_mask[0]:
-        if not ptr:
-            new_cov = np.delete(new_cov, col_idx, 1)
-        else:
-            col_idx += int(1)
-    assert (new_cov.shape[1] == col_idx)
-    # masking rows
-    row_idx = int(0)
-    row_min, row_max = mpi_arrange(raw_mask.shape[1])
-    for ptr in raw_mask[0, row_min : row_max]:
-        if ptr == 0:
-            new_cov = np.delete(new_cov, row_idx, 0)
-        else:
-            row_idx += int(1)
-    return new_cov
+    if not isinstance(mask, CompiledMask):
+        mask = CompiledMask(mask)
+    return mask.apply_cov(cov)
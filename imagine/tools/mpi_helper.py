@@ -1,17 +1,120 @@
 """
 this mpi helper module is designed for parallel computing and data handling.
 For the testing suits, please turn to "imagine/tests/tools_tests.py".
+
+backends:
+    'mpi', distributed routines implemented with MPI communications
+    'lapack', plain numpy (and scipy if available) calls on the local array,
+    only valid with a single rank, where BLAS threading does the parallelism
+    'auto' (default), 'lapack' with a single rank, otherwise 'mpi'
+
+communicator:
+    all routines work on the current communicator, MPI.COMM_WORLD by default,
+    the default is replaced with set_comm,
+    and comm_context overrides it temporarily (per pipeline or per call),
+    so that independent groups of ranks (e.g. from MPI.Comm.Split)
+    can run their own inferences in one job
+    distributed data must be used with the communicator it is distributed on
+
+pool:
+    MPIPool serves samplers driven by the master rank with groups of ranks,
+    each group executing tasks under its own communicator
 """
 
 import numpy as np
 from mpi4py import MPI
-from copy import deepcopy
 import logging as log
+import warnings
+from contextlib import contextmanager
+try:
+    import scipy.linalg as sla
+except ImportError:
+    sla = None
+
+
+# communicator stack, the last one is in use
+_comms = [MPI.COMM_WORLD]
+
+_backend = 'auto'
+
+def set_comm(comm):
+    """
+    replace the default communicator (MPI.COMM_WORLD at import)
+
+    Parameters
+    ----------
+
+    comm : mpi4py.MPI.Comm
+        intra-communicator
+    """
+    log.debug('@ mpi_helper::set_comm')
+    assert isinstance(comm, MPI.Intracomm)
+    _comms[0] = comm
+
+def get_comm():
+    """
+    return the communicator in use
+    """
+    return _comms[-1]
+
+@contextmanager
+def comm_context(comm=None):
+    """
+    run the enclosed block with given communicator,
+    the previous one is restored upon exit
+
+    Parameters
+    ----------
+
+    comm : mpi4py.MPI.Comm
+        intra-communicator, if None, the current one is kept
+    """
+    log.debug('@ mpi_helper::comm_context')
+    if comm is None:
+        comm = get_comm()
+    assert isinstance(comm, MPI.Intracomm)
+    _comms.append(comm)
+    try:
+        yield comm
+    finally:
+        _comms.pop()
+
+def _env():
+    """
+    communicator in use with its size and the current rank
+    """
+    comm = get_comm()
+    return comm, comm.Get_size(), comm.Get_rank()
 
+def set_backend(backend):
+    """
+    select the backend of the mpi_* routines
 
-comm = MPI.COMM_WORLD
-mpisize = comm.Get_size()
-mpirank = comm.Get_rank()
+    Parameters
+    ----------
+
+    backend : str
+        'auto', 'mpi' or 'lapack'
+    """
+    log.debug('@ mpi_helper::set_backend')
+    mpisize = get_comm().Get_size()
+    global _backend
+    if backend not in ('auto', 'mpi', 'lapack'):
+        raise ValueError('unsupported backend %s' % str(backend))
+    if backend == 'lapack' and mpisize != 1:
+        raise ValueError('lapack backend requires a single rank')
+    _backend = backend
+
+def get_backend():
+    """
+    return the backend in use, either 'mpi' or 'lapack'
+    """
+    mpisize = get_comm().Get_size()
+    if _backend == 'auto':
+        return 'lapack' if mpisize == 1 else 'mpi'
+    if _backend == 'lapack' and mpisize != 1:
+        raise ValueError('lapack backend requires a single rank')
+    return _backend
 
 def mpi_arrange(size):
     """
@@ -31,6 +134,7 @@ def mpi_arrange(size):
     the begin and end index [begin,end] for slicing the target
     """
     log.debug('@ mpi_helper::mpi_arrange')
+    comm, mpisize, mpirank = _env()
     assert (size > 0)
     res = min(mpirank, size%mpisize)
     ave = size//mpisize
@@ -39,6 +143,154 @@ def mpi_arrange(size):
     return np.uint(res + mpirank*ave), np.uint(res + (mpirank+1)*ave + 
                                                np.uint(mpirank < size%mpisize))
 
+def _arrange_all(size):
+    """
+    begin and end indices of all nodes for distributing the global size,
+    see `imagine.tools.mpi_helper.mpi_arrange`
+
+    Returns
+    -------
+    two numpy.ndarray of integers
+    """
+    mpisize = get_comm().Get_size()
+    ave = size//mpisize
+    if (ave == 0):
+        raise ValueError('over distribution')
+    ranks = np.arange(mpisize, dtype=np.int64)
+    begins = np.minimum(ranks, size%mpisize) + ranks*ave
+    ends = begins + ave + (ranks < size%mpisize)
+    return begins, ends
+
+# reusable communication buffers, grown on demand
+_buffers = dict()
+
+def _buffer(name, size):
+    """
+    return a contiguous double buffer of given size,
+    the memory is kept and reused by later calls with the same name,
+    so the content is only valid until the next call
+    """
+    buf = _buffers.get(name)
+    if buf is None or buf.size < size:
+        buf = np.empty(size, dtype=np.float64)
+        _buffers[name] = buf
+    return buf[:size]
+
+class DistributedArray(object):
+    """
+    local rows of a row-distributed array,
+    carrying the global layout (row counts and row offsets of all nodes)
+    so that mpi_* routines do not have to collect it again
+
+    the local array is kept as given, not copied
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        local rows of the distributed data
+    row_counts : list/tuple/numpy.ndarray
+        number of local rows on each node,
+        if None, it is collected from all nodes once
+    """
+    def __init__(self, data, row_counts=None):
+        comm, mpisize, mpirank = _env()
+        assert isinstance(data, np.ndarray)
+        assert (len(data.shape) == 2)
+        if row_counts is None:
+            row_counts = np.empty(mpisize, dtype=np.uint)
+            comm.Allgather([np.array(data.shape[0], dtype=np.uint), MPI.LONG], [row_counts, MPI.LONG])
+        self._row_counts = np.array(row_counts, dtype=np.int64).reshape(mpisize)
+        assert (self._row_counts[mpirank] == data.shape[0])
+        self._row_offsets = np.cumsum(self._row_counts) - self._row_counts
+        self._data = data
+
+    @classmethod
+    def arranged(cls, data, global_rows):
+        """
+        wrap local data distributed as `imagine.tools.mpi_helper.mpi_arrange`,
+        the layout is known without communication
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            local rows of the distributed data
+        global_rows : int
+            global number of rows
+        """
+        begins, ends = _arrange_all(global_rows)
+        return cls(data, ends - begins)
+
+    @classmethod
+    def copied(cls, data):
+        """
+        wrap data which has an identical copy on each node,
+        the layout is known without communication
+
+        Parameters
+        ----------
+        data : numpy.ndarray
+            copied data
+        """
+        mpisize = get_comm().Get_size()
+        return cls(data, np.full(mpisize, data.shape[0], dtype=np.int64))
+
+    @property
+    def data(self):
+        """
+        Local rows (`numpy.ndarray`, read-only)
+        """
+        return self._data
+
+    @property
+    def row_counts(self):
+        """
+        Number of local rows on each node (`numpy.ndarray`, read-only)
+        """
+        return self._row_counts
+
+    @property
+    def row_offsets(self):
+        """
+        Global index of the first local row on each node (`numpy.ndarray`, read-only)
+        """
+        return self._row_offsets
+
+    @property
+    def row_begin(self):
+        """
+        Global index of the first local row on current node (`int`, read-only)
+        """
+        mpirank = get_comm().Get_rank()
+        return int(self._row_offsets[mpirank])
+
+    @property
+    def global_shape(self):
+        """
+        Shape of the global array (`tuple`, read-only)
+        """
+        return (int(np.sum(self._row_counts)), self._data.shape[1])
+
+def _local(data):
+    """
+    local numpy.ndarray of numpy.ndarray or DistributedArray input
+    """
+    if isinstance(data, DistributedArray):
+        return data.data
+    assert isinstance(data, np.ndarray)
+    return data
+
+def _row_counts(data):
+    """
+    number of local rows on each node,
+    cached by DistributedArray, otherwise collected from all nodes
+    """
+    comm, mpisize, mpirank = _env()
+    if isinstance(data, DistributedArray):
+        return data.row_counts
+    local_rows = np.empty(mpisize, dtype=np.uint)
+    comm.Allgather([np.array(data.shape[0], dtype=np.uint), MPI.LONG], [local_rows, MPI.LONG])
+    return local_rows.astype(np.int64)
+
 def mpi_shape(data):
     """
     return the global number of rows and columns of given distributed data
@@ -46,7 +298,7 @@ def mpi_shape(data):
     Parameters
     ----------
     
-    data : numpy.ndarray
+    data : numpy.ndarray or DistributedArray
         the distributed data
         
     Returns
@@ -54,6 +306,10 @@ def mpi_shape(data):
     numpy.uint
     glboal row and column number
     """
+    comm = get_comm()
+    if isinstance(data, DistributedArray):
+        global_row, global_column = data.global_shape
+        return np.array(global_row, dtype=np.uint), np.array(global_column, dtype=np.uint)
     global_row = np.array(0, dtype=np.uint)
     comm.Allreduce([np.array(data.shape[0], dtype=np.uint), MPI.LONG], [global_row, MPI.LONG], op=MPI.SUM)
     global_column = np.array(data.shape[1], dtype=np.uint)
@@ -68,10 +324,18 @@ def mpi_prosecutor(data):
     Parameters
     ----------
     
-    data : numpy.ndarray
-        the distributed data to be examined
+    data : numpy.ndarray or DistributedArray
+        the distributed data to be examined,
+        with DistributedArray the cached layout is examined
+        without communication
     """
     log.debug('@ mpi_helper::mpi_prosecutor')
+    comm, mpisize, mpirank = _env()
+    if isinstance(data, DistributedArray):
+        begins, ends = _arrange_all(data.global_shape[0])
+        if np.any(data.row_counts != ends - begins):
+            raise ValueError('incorrect data allocation')
+        return
     assert isinstance(data, np.ndarray)
     # get the global shape
     local_rows = np.empty(mpisize, dtype=np.uint)
@@ -95,7 +359,7 @@ def mpi_mean(data):
     Parameters
     ----------
     
-    data : numpy.ndarray
+    data : numpy.ndarray or DistributedArray
         distributed data
         
     Returns
@@ -104,19 +368,18 @@ def mpi_mean(data):
     copied data mean, which means the mean is copied to all nodes
     """
     log.debug('@ mpi_helper::mpi_mean')
+    comm = get_comm()
+    data = _local(data)
     assert (len(data.shape)==2)
-    assert isinstance(data, np.ndarray)
-    # get the global shape
-    local_rows = np.empty(mpisize, dtype=np.uint)
-    local_cols = np.empty(mpisize, dtype=np.uint)
-    comm.Allgather([np.array(data.shape[0], dtype=np.uint), MPI.LONG], [local_rows, MPI.LONG])
-    comm.Allgather([np.array(data.shape[1], dtype=np.uint), MPI.LONG], [local_cols, MPI.LONG])
-    # do summation first before averaging out
-    partial_sum = np.empty(data.shape[1], dtype=np.float64)
-    partial_sum = np.sum(data, axis=0).reshape((data.shape[1],))
-    total_sum = np.empty(data.shape[1], dtype=np.float64)
+    if get_backend() == 'lapack':
+        return np.mean(data, axis=0, dtype=np.float64).reshape((1, data.shape[1]))
+    # partial sums and local row number travel in one reduction
+    partial_sum = np.empty(data.shape[1]+1, dtype=np.float64)
+    partial_sum[:-1] = np.sum(data, axis=0, dtype=np.float64).reshape((data.shape[1],))
+    partial_sum[-1] = data.shape[0]
+    total_sum = np.empty(data.shape[1]+1, dtype=np.float64)
     comm.Allreduce ([partial_sum, MPI.DOUBLE], [total_sum, MPI.DOUBLE], op=MPI.SUM)
-    avg = (total_sum / np.sum(local_rows)).reshape((1, data.shape[1]))
+    avg = (total_sum[:-1] / total_sum[-1]).reshape((1, data.shape[1]))
     return avg
 
 def mpi_trans(data):
@@ -127,7 +390,7 @@ def mpi_trans(data):
     Parameters
     ----------
     
-    data : numpy.ndarray
+    data : numpy.ndarray or DistributedArray
         distributed data
         
     Returns
@@ -136,57 +399,108 @@ def mpi_trans(data):
     transposed data in distribution
     """
     log.debug('@ mpi_helper::mpi_trans')
+    comm, mpisize, mpirank = _env()
+    if get_backend() == 'lapack':
+        data = _local(data)
+        assert (len(data.shape)==2)
+        return np.array(np.transpose(data), dtype=np.float64, order='C')
+    # get the global row distribution before transpose
+    local_rows = _row_counts(data)
+    data = _local(data)
     assert (len(data.shape)==2)
-    assert isinstance(data, np.ndarray)
-    # get the global shape before transpose
-    local_rows = np.empty(mpisize, dtype=np.uint)
-    local_cols = np.empty(mpisize, dtype=np.uint)
-    comm.Allgather([np.array(data.shape[0], dtype=np.uint), MPI.LONG], [local_rows, MPI.LONG])
-    comm.Allgather([np.array(data.shape[1], dtype=np.uint), MPI.LONG], [local_cols, MPI.LONG])
-    # the algorithm cuts local data into sub-pieces and passing them to the corresponding nodes
-    # which means we need to calculate the arrangement of pre-trans "columns" into post-trans "rows" 
-    cut_col_begin, cut_col_end = mpi_arrange(local_cols[0])
-    cut_col_begins = np.empty(mpisize, dtype=np.uint)
-    cut_col_ends = np.empty(mpisize, dtype=np.uint)
-    comm.Allgather([np.array(cut_col_begin, dtype=np.uint), MPI.LONG], [cut_col_begins, MPI.LONG])
-    comm.Allgather([np.array(cut_col_end, dtype=np.uint), MPI.LONG], [cut_col_ends, MPI.LONG])
-    # prepare empty post-trans local data shape
-    new_data = np.empty((cut_col_end-cut_col_begin, np.sum(local_rows)), dtype=np.float64)
-    # send and receive sub-pieces
+    global_rows = int(np.sum(local_rows))
+    # the algorithm cuts local data into column pieces, one for each node,
+    # pre-trans "columns" are arranged into post-trans "rows"
+    # all pieces are exchanged with a single Alltoallv
+    cut_col_begins, cut_col_ends = _arrange_all(data.shape[1])
+    cut_widths = cut_col_ends - cut_col_begins
+    new_rows = int(cut_widths[mpirank])
+    send_counts = data.shape[0]*cut_widths
+    send_displs = np.cumsum(send_counts) - send_counts
+    recv_counts = local_rows.astype(np.int64)*new_rows
+    recv_displs = np.cumsum(recv_counts) - recv_counts
+    # pack the column pieces contiguously, in double
+    send_buf = _buffer('trans_send', data.shape[0]*data.shape[1])
     for target in range(mpisize):
-        if (target != mpirank):  # send to other ranks
-            # the np.array(..., dtype=np.float64) is to ensure memory contiguous and data type correct
-            # the np.transpose won't work, but changing the memory order will (cross-node copy)
-            local_sent_buf = np.array(data[:, cut_col_begins[target]:cut_col_ends[target]], dtype=np.float64, order='F')
-            comm.Isend([local_sent_buf, MPI.DOUBLE], dest=target, tag=target)
-        else:  # recv from self
-            # note that transpose works here (in-node copy)
-            new_col_begin = np.sum(local_rows[0:mpirank])
-            new_col_end = new_col_begin + local_rows[mpirank]
-            new_data[:, new_col_begin:new_col_end] = np.transpose((data[:, cut_col_begin:cut_col_end]).astype(np.float64))
-    for source in range(mpisize):
-        if (source != mpirank):  # recv from other ranks
-            local_recv_buf = np.empty((cut_col_ends[mpirank]-cut_col_begins[mpirank], local_rows[source]), dtype=np.float64)
-            comm.Recv([local_recv_buf, MPI.DOUBLE], source=source, tag=mpirank)
-            new_data[:, np.sum(local_rows[0:source]):np.sum(local_rows[0:source+1])] = local_recv_buf
-    return new_data
+        piece = send_buf[send_displs[target]:send_displs[target]+send_counts[target]]
+        piece.reshape(data.shape[0], cut_widths[target])[:] = data[:, cut_col_begins[target]:cut_col_ends[target]]
+    # pieces from all sources stack up into the (global_rows, new_rows) pre-trans column block
+    recv_buf = _buffer('trans_recv', global_rows*new_rows)
+    comm.Alltoallv([send_buf, (send_counts, send_displs), MPI.DOUBLE],
+                   [recv_buf, (recv_counts, recv_displs), MPI.DOUBLE])
+    return np.array(np.transpose(recv_buf.reshape(global_rows, new_rows)), order='C')
     
-def mpi_mult(left, right):
+def mpi_rebalance(data):
+    """
+    redistribute rows of distributed data to the balanced layout
+    given by `imagine.tools.mpi_helper.mpi_arrange`,
+    the global row order is kept and rows are exchanged with a single Alltoallv
+    note that the numerical values will be converted into double
+
+    Parameters
+    ----------
+
+    data : numpy.ndarray or DistributedArray
+        distributed data in any row layout
+
+    Returns
+    -------
+    numpy.ndarray
+    distributed data in balanced layout
+    """
+    log.debug('@ mpi_helper::mpi_rebalance')
+    if get_backend() == 'lapack':
+        return np.array(_local(data), dtype=np.float64)
+    comm, mpisize, mpirank = _env()
+    row_counts = _row_counts(data)
+    data = _local(data)
+    assert (len(data.shape) == 2)
+    cols = data.shape[1]
+    source_begins = np.cumsum(row_counts) - row_counts
+    source_ends = source_begins + row_counts
+    target_begins, target_ends = _arrange_all(int(np.sum(row_counts)))
+    # overlap of local rows with each target range, and vice versa
+    send_rows = np.maximum(np.minimum(source_ends[mpirank], target_ends) -
+                           np.maximum(source_begins[mpirank], target_begins), 0)
+    recv_rows = np.maximum(np.minimum(source_ends, target_ends[mpirank]) -
+                           np.maximum(source_begins, target_begins[mpirank]), 0)
+    send_counts = send_rows*cols
+    send_displs = np.cumsum(send_counts) - send_counts
+    recv_counts = recv_rows*cols
+    recv_displs = np.cumsum(recv_counts) - recv_counts
+    # local rows are already in target order
+    send_buf = np.ascontiguousarray(data, dtype=np.float64).reshape(-1)
+    result = np.empty((target_ends[mpirank] - target_begins[mpirank], cols), dtype=np.float64)
+    comm.Alltoallv([send_buf, (send_counts, send_displs), MPI.DOUBLE],
+                   [result.reshape(-1), (recv_counts, recv_displs), MPI.DOUBLE])
+    return result
+
+def mpi_mult(left, right, trans_left=False):
     """
     calculate matrix multiplication of two distributed data,
     the result is data1*data2 in multi-node distribution
     note that the numerical values will be converted into double
     
-    we send the distributed right rows into other nodes (aka cannon method)
+    we pass the distributed right rows around all nodes in a ring (aka cannon method),
+    sending/receiving the next block is non-blocking and double-buffered,
+    so the transfer overlaps with the local multiplication of the current block
+
+    with trans_left, the result is transpose(data1)*data2,
+    where data1 and data2 share the same row distribution,
+    in this case rows of both sides travel together
+    and the explicit transpose of the left side is skipped
     
     Parameters
     ----------
     
-    left : numpy.ndarray
+    left : numpy.ndarray or DistributedArray
         distributed left side data
         
-    right : numpy.ndarray
+    right : numpy.ndarray or DistributedArray
         distributed right side data
+
+    trans_left : bool
+        if True, multiply with the transposed left side data
         
     Returns
     -------
@@ -194,41 +508,65 @@ def mpi_mult(left, right):
     distributed multiplication result
     """
     log.debug('@ mpi_helper::mpi_mult')
+    comm, mpisize, mpirank = _env()
+    if get_backend() != 'lapack':
+        # collect right matrix row info
+        right_rows = _row_counts(right)
+    left = _local(left)
+    right = _local(right)
     assert (len(left.shape) == 2)
     assert (len(right.shape) == 2)
-    assert isinstance(left, np.ndarray)
-    assert isinstance(right, np.ndarray)
-    # know the total rows
-    result_global_row = np.array(0, dtype=np.uint)
-    comm.Allreduce([np.array(left.shape[0], dtype=np.uint), MPI.LONG], [result_global_row, MPI.LONG], op=MPI.SUM)
-    # prepare the distributed result
-    result = np.zeros((left.shape[0], result_global_row), dtype=np.float64)
-    # collect left and right matrix row info
-    left_rows = np.empty(mpisize, dtype=np.uint)
-    right_rows = np.empty(mpisize, dtype=np.uint)
-    comm.Allgather([np.array(left.shape[0], dtype=np.uint), MPI.LONG], [left_rows, MPI.LONG])
-    comm.Allgather([np.array(right.shape[0], dtype=np.uint), MPI.LONG], [right_rows, MPI.LONG])
-    assert (np.sum(right_rows) == left.shape[1])  # ensure left*right is legal
-    # local self mult
-    left_col_begin = np.sum(right_rows[:mpirank])
-    left_col_end = left_col_begin + right_rows[mpirank]
-    left_block = np.array(left[:, left_col_begin:left_col_end], dtype=np.float64)
-    result += np.dot(left_block, right)
-    # local mult with right cannons
-    # allocate fixed bufs
-    for itr in range(1, mpisize):
-        target = (mpirank + itr) % mpisize
-        source = (mpirank - itr) % mpisize
-        # fire cannons
-        comm.Isend([right.astype(np.float64), MPI.DOUBLE], dest=target, tag=target)
-        # receive cannons
-        local_recv_buf = np.zeros((right_rows[source], right.shape[1]), dtype=np.float64)
-        comm.Recv([local_recv_buf, MPI.DOUBLE], source=source, tag=mpirank)
-        # accumulate local mult
-        left_col_begin = np.sum(right_rows[0:source])
-        left_col_end = left_col_begin + right_rows[source]
-        left_block = np.array(left[:, left_col_begin:left_col_end], dtype=np.float64)
-        result += np.dot(left_block, local_recv_buf)
+    if get_backend() == 'lapack':
+        if trans_left:
+            assert (left.shape[0] == right.shape[0])
+            return np.dot(np.transpose(left.astype(np.float64)), right.astype(np.float64))
+        assert (left.shape[1] == right.shape[0])
+        return np.dot(left.astype(np.float64), right.astype(np.float64))
+    right_row_begins = np.cumsum(right_rows) - right_rows
+    # circulating blocks, in shape (local rows, width)
+    if trans_left:
+        assert (left.shape[0] == right.shape[0])  # ensure left^T*right is legal
+        shared = left is right
+        width = right.shape[1] if shared else left.shape[1] + right.shape[1]
+        col_begin, col_end = mpi_arrange(left.shape[1])
+        col_begin, col_end = int(col_begin), int(col_end)
+        result = np.zeros((col_end - col_begin, right.shape[1]), dtype=np.float64)
+    else:
+        assert (np.sum(right_rows) == left.shape[1])  # ensure left*right is legal
+        width = right.shape[1]
+        left = np.asarray(left, dtype=np.float64)
+        result = np.zeros((left.shape[0], right.shape[1]), dtype=np.float64)
+    # allocate fixed double bufs
+    max_size = int(np.max(right_rows))*width
+    bufs = (_buffer('mult_0', max_size), _buffer('mult_1', max_size))
+    current = bufs[0][:right.shape[0]*width]
+    block = current.reshape(right.shape[0], width)
+    if trans_left and not shared:
+        block[:, :left.shape[1]] = left
+        block[:, left.shape[1]:] = right
+    else:
+        block[:] = right
+    source = mpirank
+    for itr in range(mpisize):
+        # fire the block at hand to the next node, receive the following one
+        if itr < mpisize - 1:
+            next_source = (mpirank - itr - 1) % mpisize
+            following = bufs[(itr + 1) % 2][:right_rows[next_source]*width]
+            requests = [comm.Isend([current, MPI.DOUBLE], dest=(mpirank + 1) % mpisize, tag=itr),
+                        comm.Irecv([following, MPI.DOUBLE], source=(mpirank - 1) % mpisize, tag=itr)]
+        # accumulate local mult while blocks are travelling
+        block = current.reshape(right_rows[source], width)
+        if trans_left:
+            left_block = block[:, col_begin:col_end]
+            right_block = block if shared else block[:, left.shape[1]:]
+            result += np.dot(np.transpose(left_block), right_block)
+        else:
+            left_col_begin = right_row_begins[source]
+            result += np.dot(left[:, left_col_begin:left_col_begin + right_rows[source]], block)
+        if itr < mpisize - 1:
+            MPI.Request.Waitall(requests)
+            current = following
+            source = next_source
     return result
 
 def mpi_trace(data):
@@ -237,8 +575,10 @@ def mpi_trace(data):
     
     Parameters
     ----------
-    data : numpy.ndarray
-        Array of data distributed over different processes
+    data : numpy.ndarray or DistributedArray
+        Array of data distributed over different processes,
+        numpy.ndarray is assumed to be arranged
+        as `imagine.tools.mpi_helper.mpi_arrange`
         
     Returns
     -------
@@ -246,13 +586,16 @@ def mpi_trace(data):
         Copied trace of given data
     """
     log.debug('@ mpi_helper::mpi_trace')
+    comm = get_comm()
+    if isinstance(data, DistributedArray):
+        local_row_begin = data.row_begin
+    else:
+        local_row_begin = int(mpi_arrange(data.shape[1])[0])
+    data = _local(data)
     assert (len(data.shape) == 2)
-    assert isinstance(data, np.ndarray)
-    local_acc = np.array(0, dtype=np.float64)
-    local_row_begin, local_row_end = mpi_arrange(data.shape[1])
-    for i in range(local_row_end - local_row_begin):
-        eye_pos = local_row_begin + np.uint(i)
-        local_acc += np.float64(data[i, eye_pos])
+    if get_backend() == 'lapack':
+        return np.array(np.trace(data), dtype=np.float64)
+    local_acc = np.array(np.trace(data, offset=local_row_begin), dtype=np.float64)
     result = np.array(0, dtype=np.float64)
     comm.Allreduce([local_acc, MPI.DOUBLE], [result, MPI.DOUBLE], op=MPI.SUM)
     return result
@@ -280,89 +623,253 @@ def mpi_eye(size):
         local_matrix[i, eye_pos] =  1.0
     return local_matrix
 
+class LUFactor(object):
+    """
+    LU factorization with partial (row) pivoting of a distributed square matrix
+
+    the factorization is done once upon initialization,
+    afterwards the log-determinant and solutions to linear systems
+    are obtained from the stored factors without repeating the elimination
+
+    rows are never moved between nodes,
+    pivoting is recorded as the global row index chosen at each column,
+    each local row stores its L multipliers (left to its pivot column)
+    and its U entries (from its pivot column on) in place
+
+    columns are processed in blocks (panels),
+    inside a panel only the panel columns are eliminated,
+    then the pivot rows of the panel are broadcast once
+    and all remaining local rows receive a single rank-k update,
+    the diagonal blocks of the factors are copied to all nodes
+
+    with the 'lapack' backend and scipy available,
+    the factorization is handed to LAPACK getrf/getrs directly
+
+    Parameters
+    ----------
+    operator : distributed numpy.ndarray or DistributedArray
+        matrix in global shape (size, size), each node takes part of the rows
+
+    block_size : int
+        number of columns in each panel
+    """
+    def __init__(self, operator, block_size=64):
+        log.debug('@ mpi_helper::LUFactor::__init__')
+        mpirank = get_comm().Get_rank()
+        if get_backend() != 'lapack' or sla is None:
+            # collect local rows for each node
+            local_rows = _row_counts(operator)
+        operator = _local(operator)
+        assert (len(operator.shape) == 2)
+        assert (block_size > 0)
+        self._size = operator.shape[1]
+        self._block_size = int(block_size)
+        if get_backend() == 'lapack' and sla is not None:
+            assert (operator.shape[0] == self._size)
+            with warnings.catch_warnings():
+                # getrf only warns on a zero pivot, raised below as with the 'mpi' backend
+                warnings.simplefilter('ignore', sla.LinAlgWarning)
+                self._lapack = sla.lu_factor(np.array(operator, dtype=np.float64))
+            if np.any(np.diag(self._lapack[0]) == 0):
+                raise ValueError('singular matrix')
+            return
+        self._lapack = None
+        self._lu = np.array(operator, dtype=np.float64)
+        assert (np.sum(local_rows) == self._size)
+        self._row_begin = int(np.sum(local_rows[:mpirank]))
+        # elimination step at which each local row serves as pivot
+        # (global size indicates not pivoted yet)
+        self._steps = np.full(operator.shape[0], self._size, dtype=np.int64)
+        # global row index of the pivot of each column
+        self._pivots = np.empty(self._size, dtype=np.int64)
+        # (begin column, end column, diagonal block) of each panel
+        self._blocks = list()
+        self._factorize()
+
+    @property
+    def size(self):
+        """
+        Global size of the factorized matrix (`int`, read-only)
+        """
+        return self._size
+
+    @property
+    def block_size(self):
+        """
+        Number of columns in each panel (`int`, read-only)
+        """
+        return self._block_size
+
+    def _factorize(self):
+        """
+        blocked Gauss elimination,
+        the pivot is the largest (in absolute value) candidate among all nodes
+        """
+        log.debug('@ mpi_helper::LUFactor::_factorize')
+        comm, mpisize, mpirank = _env()
+        lu = self._lu
+        for c_begin in range(0, self._size, self._block_size):
+            c_end = min(c_begin + self._block_size, self._size)
+            width = c_end - c_begin
+            # panel segments of the pivot rows, copied to all nodes
+            diag_block = np.empty((width, width), dtype=np.float64)
+            # local candidate, in (absolute value, global row index, panel segment)
+            candidate = np.empty(width+2, dtype=np.float64)
+            candidates = np.empty((mpisize, width+2), dtype=np.float64)
+            for j in range(width):
+                c = c_begin + j
+                free_idx = np.flatnonzero(self._steps == self._size)
+                if free_idx.size:
+                    local_r = free_idx[np.argmax(np.abs(lu[free_idx, c]))]
+                    candidate[0] = np.abs(lu[local_r, c])
+                    candidate[1] = self._row_begin + local_r
+                    candidate[2:] = lu[local_r, c_begin:c_end]
+                else:
+                    candidate[:] = -1.0
+                comm.Allgather([candidate, MPI.DOUBLE], [candidates, MPI.DOUBLE])
+                owner = int(np.argmax(candidates[:, 0]))
+                self._pivots[c] = int(candidates[owner, 1])
+                diag_block[j] = candidates[owner, 2:]
+                if diag_block[j, j] == 0:
+                    raise ValueError('singular matrix')
+                if mpirank == owner:
+                    self._steps[self._pivots[c] - self._row_begin] = c
+                # eliminate column c inside the panel
+                free_idx = np.flatnonzero(self._steps == self._size)
+                ratio = lu[free_idx, c]/diag_block[j, j]
+                lu[free_idx, c] = ratio
+                lu[free_idx, c+1:c_end] -= np.outer(ratio, diag_block[j, j+1:])
+            self._blocks.append((c_begin, c_end, diag_block))
+            if c_end == self._size:
+                break
+            # broadcast trailing part of the panel pivot rows
+            pivot_rows = np.zeros((width, self._size-c_end), dtype=np.float64)
+            local_pivots = np.flatnonzero((self._steps >= c_begin) & (self._steps < c_end))
+            pivot_rows[self._steps[local_pivots]-c_begin] = lu[local_pivots, c_end:]
+            comm.Allreduce(MPI.IN_PLACE, [pivot_rows, MPI.DOUBLE], op=MPI.SUM)
+            # U12 = L11^{-1} A12
+            unit_lower = np.tril(diag_block, -1) + np.eye(width)
+            pivot_rows = np.linalg.solve(unit_lower, pivot_rows)
+            lu[local_pivots, c_end:] = pivot_rows[self._steps[local_pivots]-c_begin]
+            # rank-k update of all remaining local rows
+            free_idx = np.flatnonzero(self._steps == self._size)
+            lu[free_idx, c_end:] -= np.dot(lu[free_idx, c_begin:c_end], pivot_rows)
+
+    def slogdet(self):
+        """
+        Sign and log of the determinant from the diagonal of U
+        and the parity of the row permutation
+
+        Returns
+        -------
+        sign : numpy.ndarray
+            Single element numpy array containing the sign of the determinant (copied to all nodes)
+        logdet : numpy.ndarray
+            Single element numpy array containing the log of the determinant (copied to all nodes)
+        """
+        log.debug('@ mpi_helper::LUFactor::slogdet')
+        if self._lapack is not None:
+            lu, piv = self._lapack
+            diag = np.diag(lu)
+            sign = np.array(np.prod(np.sign(diag)), dtype=np.float64)
+            if np.count_nonzero(piv != np.arange(self._size)) % 2:
+                sign *= -1.0
+            return sign, np.array(np.sum(np.log(np.abs(diag))), dtype=np.float64)
+        # diagonal blocks are copied, no communication needed
+        diag = np.hstack([np.diag(block) for (_, _, block) in self._blocks])
+        sign = np.array(np.prod(np.sign(diag)), dtype=np.float64)
+        logdet = np.array(np.sum(np.log(np.abs(diag))), dtype=np.float64)
+        # parity of the row permutation, counted by cycles
+        visited = np.zeros(self._size, dtype=bool)
+        for start in range(self._size):
+            length = 0
+            pos = start
+            while not visited[pos]:
+                visited[pos] = True
+                pos = self._pivots[pos]
+                length += 1
+            if length > 0 and length % 2 == 0:
+                sign *= -1.0
+        return sign, logdet
+
+    def solve(self, source):
+        """
+        Solves the linear algebra problem with blocked forward and backward substitutions,
+        each panel costs one reduction of panel size in each substitution
+
+        Parameters
+        ----------
+        source : copied numpy.ndarray
+            vector representation of the right-hand-side source, in shape (1, size)
+
+        Returns
+        -------
+        copied solution to the linear algebra problem
+        """
+        log.debug('@ mpi_helper::LUFactor::solve')
+        comm = get_comm()
+        assert isinstance(source, np.ndarray)
+        assert (source.shape == (1, self._size))
+        if self._lapack is not None:
+            return sla.lu_solve(self._lapack, source[0].astype(np.float64)).reshape(1, -1)
+        lu = self._lu
+        # forward substitution, Ly=Pb
+        # residuals of local rows, y is copied to all nodes panel by panel
+        residual = np.array(source[0, self._row_begin:self._row_begin+lu.shape[0]], dtype=np.float64)
+        y = np.empty(self._size, dtype=np.float64)
+        for (c_begin, c_end, diag_block) in self._blocks:
+            width = c_end - c_begin
+            y_block = np.zeros(width, dtype=np.float64)
+            local_pivots = np.flatnonzero((self._steps >= c_begin) & (self._steps < c_end))
+            y_block[self._steps[local_pivots]-c_begin] = residual[local_pivots]
+            comm.Allreduce(MPI.IN_PLACE, [y_block, MPI.DOUBLE], op=MPI.SUM)
+            y[c_begin:c_end] = np.linalg.solve(np.tril(diag_block, -1) + np.eye(width), y_block)
+            below = np.flatnonzero(self._steps >= c_end)
+            residual[below] -= np.dot(lu[below, c_begin:c_end], y[c_begin:c_end])
+        # backward substitution, Ux=y
+        x = np.empty((1, self._size), dtype=np.float64)
+        for (c_begin, c_end, diag_block) in reversed(self._blocks):
+            width = c_end - c_begin
+            partial = np.zeros(width, dtype=np.float64)
+            local_pivots = np.flatnonzero((self._steps >= c_begin) & (self._steps < c_end))
+            partial[self._steps[local_pivots]-c_begin] = np.dot(lu[local_pivots, c_end:], x[0, c_end:])
+            comm.Allreduce(MPI.IN_PLACE, [partial, MPI.DOUBLE], op=MPI.SUM)
+            x[0, c_begin:c_end] = np.linalg.solve(np.triu(diag_block), y[c_begin:c_end] - partial)
+        return x
+
+
 def mpi_lu_solve(operator, source):
     """
-    simple LU Gauss method WITHOUT pivot permutation
-    
+    LU Gauss method with partial pivoting,
+    see `imagine.tools.mpi_helper.LUFactor` for details (and backends),
+    use LUFactor directly if the same operator is used more than once
+
     Parameters
     ----------
-    operator : distributed numpy.ndarray
+    operator : distributed numpy.ndarray or DistributedArray
         matrix representation of the left-hand-side operator
-        
+
     source : copied numpy.ndarray
         vector representation of the right-hand-side source
-        
+
     Returns
     -------
     copied solution to the linear algebra problem
     """
     log.debug('@ mpi_helper::mpi_lu_solve')
-    assert isinstance(operator, np.ndarray)
     assert isinstance(source, np.ndarray)
-    global_rows = operator.shape[1]
-    assert (source.shape == (1, global_rows))
-    u = deepcopy(operator.astype(np.float64))
-    x = deepcopy(source.astype(np.float64))
-    # split x
-    xsplit_begin, xsplit_end = mpi_arrange(global_rows)
-    xsplit = np.array(x[0,xsplit_begin:xsplit_end])
-    # collect local rows for each node
-    local_rows = np.empty(mpisize, dtype=np.uint)
-    xsplit_begins = np.empty(mpisize, dtype=np.uint)
-    comm.Allgather([np.array(u.shape[0], dtype=np.uint), MPI.LONG], [local_rows, MPI.LONG])
-    comm.Allgather([np.array(xsplit_begin, dtype=np.uint), MPI.LONG], [xsplit_begins, MPI.LONG])
-    # start gauss method
-    # goes column by column
-    for c in range(global_rows-1):
-        # find the pivot rank and local row
-        pivot_rank = np.array(0, dtype=np.uint)
-        pivot_r = np.uint(c)  # local row index hosting the pivot
-        for i in range(len(local_rows)):
-            if (pivot_r >= local_rows[i]):
-                pivot_r -= local_rows[i]
-            else:
-                pivot_rank = np.uint(i)
-                break
-        # propagate pivot rank and pivot row
-        if mpirank == pivot_rank:
-            pivot_row = np.array(u[pivot_r, :])
-        else:
-            pivot_row = np.empty(global_rows, dtype=np.float64)
-        comm.Bcast([np.array(pivot_rank), MPI.LONG], root=pivot_rank)
-        comm.Bcast([pivot_row, MPI.DOUBLE], root=pivot_rank)
-        # gauss elimination
-        max_row = max(local_rows)
-        for local_r in range(max_row):
-            if (local_r + xsplit_begin > c and local_r < local_rows[mpirank]):
-                ratio = u[local_r, c]/pivot_row[c]
-                u[local_r,:] -= ratio*pivot_row
-                xsplit[local_r] -= ratio*x[0, c]  # manipulate split x instead x
-            # gather xsplit
-            comm.Allgatherv([xsplit, MPI.DOUBLE], [x, local_rows, xsplit_begins, MPI.DOUBLE])
-    # solve Ux=b
-    for i in range(mpisize):
-        op_rank = mpisize - 1 - i  # operational rank
-        if (mpirank == op_rank):
-            for j in range(local_rows[mpirank]):
-                local_r = np.uint(local_rows[mpirank] - 1 - j)
-                local_c = np.uint(xsplit_begin + local_r)
-                local_c_plus = np.uint(local_c + 1)
-                x[0,local_c] = (x[0,local_c] -
-                                np.dot(u[local_r, local_c_plus:],
-                                       x[0,local_c_plus:]) 
-                               )/u[local_r,local_c]
-        # update x
-        comm.Bcast([x, MPI.DOUBLE], root=op_rank)
-    return x
-                
+    assert (source.shape == (1, _local(operator).shape[1]))
+    return LUFactor(operator).solve(source)
+
 def mpi_slogdet(data):
     """
     Computes log determinant according to
-    simple LU Gauss method WITHOUT pivot permutation
+    LU Gauss method with partial pivoting,
+    see `imagine.tools.mpi_helper.LUFactor` for details (and backends)
         
     Parameters
     ----------
-    data : numpy.ndarray
+    data : numpy.ndarray or DistributedArray
         Array of data distributed over different processes
         
     Returns
@@ -373,55 +880,7 @@ def mpi_slogdet(data):
         Single element numpy array containing the log of the determinant (copied to all nodes)
     """
     log.debug('@ mpi_helper::mpi_slogdet')
-    assert isinstance(data, np.ndarray)
-    global_rows = data.shape[1]
-    u = deepcopy(data.astype(np.float64))
-    # collect local rows for each node
-    local_rows = np.empty(mpisize, dtype=np.uint)
-    comm.Allgather([np.array(u.shape[0], dtype=np.uint), MPI.LONG], [local_rows, MPI.LONG])
-    # start gauss method
-    # the hidden global row count in other nodes
-    global_row_begin = np.sum(local_rows[0:mpirank])
-    # goes column by column
-    for c in range(global_rows-1):
-        # find the pivot rank and local row
-        pivot_rank = np.array(0, dtype=np.uint)
-        pivot_r = np.uint(c)  # local row index hosting the pivot
-        for i in range(len(local_rows)):
-            if (pivot_r >= local_rows[i]):
-                pivot_r -= local_rows[i]
-            else:
-                pivot_rank = np.uint(i)
-                break
-        # propagate pivot rank and pivot row
-        if mpirank == pivot_rank:
-            pivot_row = np.array(u[pivot_r, :])
-        else:
-            pivot_row = np.empty(global_rows, dtype=np.float64)
-        comm.Bcast([np.array(pivot_rank), MPI.LONG], root=pivot_rank)
-        comm.Bcast([pivot_row, MPI.DOUBLE], root=pivot_rank)
-        # gauss elimination
-        max_row = max(local_rows)
-        for local_r in range(max_row):
-            if (local_r + global_row_begin > c and local_r < local_rows[mpirank]):
-                ratio = u[local_r, c]/pivot_row[c]
-                u[local_r,:] -= ratio*pivot_row
-    # calculate diagonal mult in the upper matrix
-    sign = np.array(1.0, dtype=np.float64)
-    logdet = np.array(0.0, dtype=np.float64)
-    local_sign = np.array(1.0, dtype=np.float64)
-    local_logdet = np.array(0.0, dtype=np.float64)
-    for local_r in range(local_rows[mpirank]):
-        local_c = np.uint(local_r + global_row_begin)
-        target = u[local_r, local_c]
-        target_sign = 2.0*np.float64(target>0) - 1.0
-        local_sign *= target_sign
-        local_logdet += np.log(target*target_sign)
-    # reduce local diagonal element mult
-    comm.Allreduce([local_logdet, MPI.DOUBLE], [logdet, MPI.DOUBLE], op=MPI.SUM)
-    comm.Allreduce([local_sign, MPI.DOUBLE], [sign, MPI.DOUBLE], op=MPI.PROD)
-    assert (logdet != 0 and sign != 0)
-    return sign, logdet
+    return LUFactor(data).slogdet()
 
 def mpi_global(data):
     """
@@ -429,8 +888,11 @@ def mpi_global(data):
         
     Parameters
     ----------
-    data : numpy.ndarray
-        Array of data distributed over different processes
+    data : numpy.ndarray or DistributedArray
+        Array of data distributed over different processes,
+        with DistributedArray the cached layout is used
+        and the data needs not to be arranged as
+        `imagine.tools.mpi_helper.mpi_arrange`
         
     Returns
     -------
@@ -438,6 +900,22 @@ def mpi_global(data):
         root process returns the gathered data. 
         Other processes return `None`
     """
+    log.debug('@ mpi_helper::mpi_global')
+    comm, mpisize, mpirank = _env()
+    if get_backend() == 'lapack':
+        return np.array(_local(data), dtype=np.float64)
+    if isinstance(data, DistributedArray):
+        row_begins = data.row_offsets
+        row_ends = row_begins + data.row_counts
+        data = data.data
+        if not mpirank:
+            global_array = np.empty((row_ends[-1], data.shape[1]), dtype=np.float64)
+            global_array[row_begins[0]:row_ends[0],:] = data
+            for source in range(1,mpisize):
+                comm.Recv([global_array[row_begins[source]:row_ends[source],:], MPI.DOUBLE] ,source=source, tag=source)
+            return global_array
+        comm.Send([np.array(data, dtype=np.float64), MPI.DOUBLE], dest=0, tag=mpirank)
+        return None
     local_rows = np.array(data.shape[0], dtype=np.uint)
     global_rows = np.array(0, dtype=np.uint)
     comm.Allreduce([local_rows, MPI.LONG], [global_rows, MPI.LONG], op=MPI.SUM)
@@ -482,6 +960,10 @@ def mpi_local(data):
     local_array : numpy.ndarray
         return the distributed array on all preocesses
     """
+    log.debug('@ mpi_helper::mpi_local')
+    comm, mpisize, mpirank = _env()
+    if get_backend() == 'lapack':
+        return np.array(data, dtype=np.float64)
     if not mpirank:
         global_shape = np.array(data.shape, dtype=np.uint)
         row_begins = np.empty(mpisize, dtype=np.uint)
@@ -504,3 +986,156 @@ def mpi_local(data):
         local_data = np.empty((local_row_end-local_row_begin,global_shape[1]), dtype=np.float64)
         comm.Recv([local_data, MPI.DOUBLE], source=0, tag=mpirank)
     return local_data
+
+
+class MPIPool(object):
+    """
+    pool of rank groups serving a sampler driven by the master rank,
+    e.g. dynesty with `pool` and `queue_size`
+
+    the current communicator is split into groups of consecutive ranks,
+    the master rank (rank 0, leading the first group) calls `map`,
+    the other ranks stay in `wait` until the master calls `close`,
+    tasks of each `map` are handed out dynamically,
+    each idle group takes the next task from a counter hosted by the master rank,
+    so that groups with cheap tasks take more of them,
+    all ranks of a group execute the same task together
+    under the group communicator (see `comm_context`),
+    so that collective routines (e.g. ensemble likelihood) work inside tasks,
+    an exception raised by a task on any rank is sent back to the master rank
+    and re-raised there by `map` once all tasks are done,
+    the workers keep waiting for the next `map` or `close`,
+    functions, tasks and exceptions are pickled
+
+    Parameters
+    ----------
+
+    group_size : int
+        number of ranks in each group, must divide the communicator size
+    """
+    def __init__(self, group_size=1):
+        log.debug('@ mpi_helper::MPIPool::__init__')
+        comm, mpisize, mpirank = _env()
+        assert (group_size > 0 and mpisize % group_size == 0)
+        self._group_id = mpirank // group_size
+        self._group = comm.Split(self._group_id, mpirank)
+        # communicator of group leaders, where group id is the rank
+        self._leaders = comm.Split(0 if self._group.Get_rank() == 0 else MPI.UNDEFINED, mpirank)
+        self._is_master = (mpirank == 0)
+        self._size = mpisize // group_size
+
+    @property
+    def size(self):
+        """
+        number of groups, tasks executed concurrently
+        """
+        return self._size
+
+    @property
+    def is_master(self):
+        return self._is_master
+
+    def map(self, func, iterable):
+        """
+        execute func on each task with all groups, called by the master rank only
+
+        Parameters
+        ----------
+
+        func
+            picklable callable
+
+        iterable
+            picklable tasks
+
+        Returns
+        -------
+        list of results, in the order of tasks
+        """
+        log.debug('@ mpi_helper::MPIPool::map')
+        assert self._is_master
+        return self._execute(self._receive((func, list(iterable))))
+
+    def wait(self):
+        """
+        execute tasks from the master rank, until it closes the pool
+        """
+        log.debug('@ mpi_helper::MPIPool::wait')
+        assert not self._is_master
+        while True:
+            job = self._receive()
+            if job is None:
+                break
+            self._execute(job)
+
+    def close(self):
+        """
+        release the workers (by the master rank) and free communicators,
+        called by all ranks
+        """
+        log.debug('@ mpi_helper::MPIPool::close')
+        if self._is_master:
+            self._receive(None)
+        if self._leaders != MPI.COMM_NULL:
+            self._leaders.Free()
+        self._group.Free()
+
+    def _receive(self, job=None):
+        """
+        broadcast job from the master rank to all ranks
+        """
+        if self._leaders != MPI.COMM_NULL:
+            job = self._leaders.bcast(job, root=0)
+        return self._group.bcast(job, root=0)
+
+    def _execute(self, job):
+        """
+        execute tasks taken by this group, collect results to the master rank,
+        re-raise the first failed task there
+        """
+        func, tasks = job
+        is_leader = (self._leaders != MPI.COMM_NULL)
+        # task index: (error, result), kept by group leaders
+        done = dict()
+        win = None
+        if is_leader and self._size > 1:
+            counter = np.zeros(1, dtype=np.int64)
+            win = MPI.Win.Create(counter, comm=self._leaders)
+            one = np.ones(1, dtype=np.int64)
+        task_id = np.zeros(1, dtype=np.int64)
+        while True:
+            if is_leader:
+                if win is None:
+                    task_id[0] = len(done)
+                else:
+                    win.Lock(0)
+                    win.Fetch_and_op(one, task_id, 0)
+                    win.Unlock(0)
+            self._group.Bcast([task_id, MPI.INT64_T], root=0)
+            if task_id[0] >= len(tasks):
+                break
+            error = None
+            result = None
+            try:
+                with comm_context(self._group):
+                    result = func(tasks[task_id[0]])
+            except Exception as err:
+                error = err
+            errors = self._group.gather(error, root=0)
+            if is_leader:
+                error = next((err for err in errors if err is not None), None)
+                done[int(task_id[0])] = (error, result)
+        if win is not None:
+            win.Free()
+        if not is_leader:
+            return None
+        done = self._leaders.gather(done, root=0)
+        if not self._is_master:
+            return None
+        merged = dict()
+        for group_done in done:
+            merged.update(group_done)
+        for i in range(len(tasks)):
+            if merged[i][0] is not None:
+                raise merged[i][0]
+        return [merged[i][1] for i in range(len(tasks))]
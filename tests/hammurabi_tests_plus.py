@@ -4,10 +4,18 @@ this is not a rigorous testing unit
 
 import unittest
 import os
+import sys
+import asyncio
+import tempfile
+import zipfile
 import numpy as np
+import healpy as hp
+import xml.etree.ElementTree as et
 #import logging as log
-from imagine.observables.observable_dict import Measurements
+from imagine.observables.observable_dict import Measurements, Masks
 from imagine.simulators.hammurabi.hammurabi import Hammurabi
+from imagine.simulators.cached_simulator import CachedSimulator
+from imagine.simulators.hammurabi.hampyx import Hampyx, run_ensemble, scratch_root
 from imagine.fields.breg_lsa.hamx_field import BregLSA
 from imagine.fields.brnd_es.hamx_field import BrndES
 from imagine.fields.cre_analytic.hamx_field import CREAna
@@ -89,5 +97,384 @@ class HammurabiTests(unittest.TestCase):
             simer._ham.print_par(['freeelectron', 'regular'])
 
 
+# stand-in for the hammurabiX executable,
+# fills each requested output map with the random seed (random field switched on)
+# plus b0 (regular lsa field switched on) or bv (regular unif field switched on)
+STANDIN = """#!%s
+import sys
+import numpy as np
+import healpy as hp
+import xml.etree.ElementTree as et
+root = et.parse(sys.argv[1]).getroot()
+value = 0.
+random = root.find('./magneticfield/random')
+if random.get('cue') == '1':
+    value += float(random.get('seed'))
+regular = root.find('./magneticfield/regular')
+if regular.get('cue') == '1' and regular.get('type') == 'lsa':
+    value += float(regular.find('./lsa/b0').get('value'))
+if regular.get('cue') == '1' and regular.get('type') == 'unif':
+    value += float(regular.find('./unif/bv').get('value'))
+for obs in root.find('./observable'):
+    if obs.get('cue') != '1':
+        continue
+    npix = 12*int(obs.get('nside'))**2
+    nfields = 3 if obs.tag == 'sync' else 1
+    maps = [np.full(npix, value+i) for i in range(nfields)]
+    hp.write_map(obs.get('filename'), maps if nfields > 1 else maps[0], overwrite=True, dtype=np.float64)
+"""
+
+class HammurabiStandinTests(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.exe = tempfile.mkstemp(suffix='_hamx')
+        with os.fdopen(fd, 'w') as f:
+            f.write(STANDIN % sys.executable)
+        os.chmod(self.exe, 0o755)
+
+    def tearDown(self):
+        os.remove(self.exe)
+
+    def test_concurrent_ensemble(self):
+        arr = np.random.rand(1, 48)
+        measuredict = Measurements()
+        measuredict.append(('sync', '23', '2', 'I'), arr)
+        measuredict.append(('sync', '23', '2', 'PI'), arr)
+        measuredict.append(('fd', 'nan', '2', 'nan'), arr)
+        xmlpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_ham.xml')
+        ensemble_size = 5
+        seeds = [11, 23, 37, 41, 53]
+        paramlist = {'rms': 2., 'k1':0.1, 'a1':1.0, 'k0': 0.5, 'a0': 1.7, 'rho': 0.5, 'r0': 8., 'z0': 1.}
+        brnd_es = BrndES(paramlist, ensemble_size, seeds)
+        rslt = list()
+        for workers in (1, 3):
+            simer = Hammurabi(measurements=measuredict, xml_path=xmlpath, exe_path=self.exe, max_workers=workers)
+            rslt.append(simer([brnd_es]))
+        for key in measuredict.keys():
+            serial = rslt[0][key].data
+            concurrent = rslt[1][key].data
+            self.assertEqual(concurrent.shape, (ensemble_size, 48))
+            self.assertTrue(np.array_equal(serial, concurrent))
+        # realization order is kept
+        fd = rslt[1][('fd', 'nan', '2', 'nan')].data
+        self.assertListEqual(list(fd[:, 0]), [float(s) for s in seeds])
+
+    def test_deterministic_ensemble(self):
+        arr = np.random.rand(1, 48)
+        measuredict = Measurements()
+        measuredict.append(('sync', '23', '2', 'Q'), arr)
+        measuredict.append(('fd', 'nan', '2', 'nan'), arr)
+        xmlpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_ham.xml')
+        ensemble_size = 4
+        paramlist = {'b0': 6.0, 'psi0': 27., 'psi1': 0.9, 'chi0': 25.}
+        breg_lsa = BregLSA(paramlist, ensemble_size)
+        brnd_es = BrndES(dict(), ensemble_size, [1, 2, 3, 4])
+        simer = Hammurabi(measurements=measuredict, xml_path=xmlpath, exe_path=self.exe)
+        self.assertTrue(simer.deterministic([breg_lsa]))
+        self.assertFalse(simer.deterministic([breg_lsa, brnd_es]))
+        # count executable runs
+        runs = list()
+        call = Hampyx.__call__
+        Hampyx.__call__ = lambda ham, verbose=False: (runs.append(1), call(ham, verbose))
+        try:
+            sims = simer([breg_lsa])
+        finally:
+            Hampyx.__call__ = call
+        self.assertEqual(len(runs), 1)
+        for key in measuredict.keys():
+            self.assertTrue(sims[key].deterministic)
+            self.assertEqual(sims[key].data.shape, (ensemble_size, 48))
+            self.assertTrue(np.array_equal(sims[key].data, np.repeat(sims[key].data[:1], ensemble_size, axis=0)))
+
+    def test_superposition(self):
+        arr = np.random.rand(1, 48)
+        measuredict = Measurements()
+        measuredict.append(('fd', 'nan', '2', 'nan'), arr)
+        measuredict.append(('dm', 'nan', '2', 'nan'), arr)
+        xmlpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_ham.xml')
+        ensemble_size = 3
+        seeds = [11, 23, 11]
+        paramlist = {'rms': 2., 'k1':0.1, 'a1':1.0, 'k0': 0.5, 'a0': 1.7, 'rho': 1., 'r0': 8., 'z0': 1.}
+        brnd_es = BrndES(paramlist, ensemble_size, seeds)
+        simer = Hammurabi(measurements=measuredict, xml_path=xmlpath, exe_path=self.exe, superposition=True)
+        self.assertTrue(simer.decomposable([brnd_es]))
+        # anisotropic random field depends on the regular one
+        self.assertFalse(simer.decomposable([BrndES(dict(paramlist, rho=0.5), ensemble_size, seeds)]))
+        self.assertFalse(simer.decomposable([BrndES(dict((k, v) for k, v in paramlist.items() if k != 'rho'),
+                                                    ensemble_size, seeds)]))
+        syncdict = Measurements()
+        syncdict.append(('sync', '23', '2', 'Q'), arr)
+        self.assertFalse(Hammurabi(syncdict, xmlpath, self.exe).decomposable([brnd_es]))
+        # count executable runs
+        runs = list()
+        call = Hampyx.__call__
+        Hampyx.__call__ = lambda ham, verbose=False: (runs.append(1), call(ham, verbose))
+        try:
+            for b0, expected_runs in ((6., 3), (3., 1)):
+                runs.clear()
+                breg_lsa = BregLSA({'b0': b0, 'psi0': 27., 'psi1': 0.9, 'chi0': 25.}, ensemble_size)
+                sims = simer([breg_lsa, brnd_es])
+                # one regular run, random parts cached per seed
+                self.assertEqual(len(runs), expected_runs)
+                fd = sims[('fd', 'nan', '2', 'nan')].data
+                self.assertListEqual(list(fd[:, 0]), [b0+s for s in seeds])
+                # dispersion measure is free from magnetic field
+                dm = sims[('dm', 'nan', '2', 'nan')].data
+                self.assertListEqual(list(dm[:, 0]), [b0]*ensemble_size)
+            # thread-time dependent seeds are never cached
+            runs.clear()
+            simer([breg_lsa, BrndES(paramlist, ensemble_size)])
+            self.assertEqual(len(runs), 1+ensemble_size)
+        finally:
+            Hampyx.__call__ = call
+        # consistent with plain runs
+        plain = Hammurabi(measurements=measuredict, xml_path=xmlpath, exe_path=self.exe)
+        sims = plain([breg_lsa, brnd_es])
+        self.assertListEqual(list(sims[('fd', 'nan', '2', 'nan')].data[:, 0]), [3.+s for s in seeds])
+        # regular field switched on by XML tree itself, not by the field list
+        for superposition in (False, True):
+            simer = Hammurabi(measurements=measuredict, xml_path=xmlpath,
+                              exe_path=self.exe, superposition=superposition)
+            simer._ham.mod_par(['magneticfield', 'regular', 'unif', 'bv'], {'value': '1000.'})
+            fd = simer([brnd_es])[('fd', 'nan', '2', 'nan')].data
+            self.assertListEqual(list(fd[:, 0]), [1000.+s for s in seeds])
+            self.assertEqual(simer._ham.tree.getroot().find('./magneticfield/regular').get('cue'), '1')
+        # XML edits outside field list are not served from stale cache
+        runs.clear()
+        Hampyx.__call__ = lambda ham, verbose=False: (runs.append(1), call(ham, verbose))
+        try:
+            simer([brnd_es])
+            self.assertEqual(len(runs), 1)
+            simer._ham.mod_par(['grid', 'observer', 'x'], {'value': '-8.0'})
+            simer([brnd_es])
+            self.assertEqual(len(runs), 1+1+len(set(seeds)))
+        finally:
+            Hampyx.__call__ = call
+
+    def test_run_ensemble(self):
+        xmlpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_ham.xml')
+        ham = Hampyx(xmlpath, self.exe)
+        for name in ('sync', 'dm', 'faraday'):
+            ham.del_par(['observable', name], 'all')
+        ham.add_par(['observable'], 'faraday', {'cue': '1', 'nside': '2'})
+        ham.mod_par(['magneticfield', 'random'], {'cue': '1'})
+        size = 6
+        bound = 2
+        inflight = list()
+        rslt = dict()
+
+        def prepare(i):
+            self.assertTrue(len(inflight) < bound)
+            inflight.append(i)
+            ham.mod_par(['magneticfield', 'random'], {'seed': str(i+1)})
+            return ham.clone()
+
+        def collect(i, other):
+            inflight.remove(i)
+            rslt[i] = other.sim_map[('fd', 'nan', '2', 'nan')]
+            self.assertTrue(other.timing['exe'] > 0)
+
+        run_ensemble(prepare, size, bound, collect)
+        self.assertListEqual(inflight, [])
+        self.assertListEqual(sorted(rslt.keys()), list(range(size)))
+        for i in range(size):
+            self.assertTrue(np.array_equal(rslt[i], np.full(48, i+1.)))
+        self.assertListEqual(os.listdir(ham.wk_dir), [])
+        # inside a running event loop, as in Jupyter
+        rslt.clear()
+
+        async def main():
+            run_ensemble(prepare, size, bound, collect)
+
+        asyncio.run(main())
+        self.assertListEqual(sorted(rslt.keys()), list(range(size)))
+        # failing executable
+        ham.exe_path = '/bin/false'
+        with self.assertRaises(ValueError):
+            run_ensemble(lambda i: ham.clone(), size, bound, collect)
+
+    def test_masked_output(self):
+        arr = np.random.rand(1, 48)
+        measuredict = Measurements()
+        measuredict.append(('sync', '23', '2', 'U'), arr)
+        measuredict.append(('fd', 'nan', '2', 'nan'), arr)
+        mask = np.random.randint(0, 2, (1, 48))
+        mask[0, :2] = (0, 1)
+        comm.Bcast(mask, root=0)
+        maskdict = Masks()
+        maskdict.append(('fd', 'nan', '2', 'nan'), mask)
+        masked_name = ('fd', 'nan', str(int(np.sum(mask))), 'nan')
+        xmlpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_ham.xml')
+        paramlist = {'rms': 2., 'k1':0.1, 'a1':1.0, 'k0': 0.5, 'a0': 1.7, 'rho': 0.5, 'r0': 8., 'z0': 1.}
+        brnd_es = BrndES(paramlist, 3, [11, 23, 37])
+        simer = Hammurabi(measurements=measuredict, xml_path=xmlpath, exe_path=self.exe)
+        full = simer([brnd_es])
+        simer = Hammurabi(measurements=measuredict, xml_path=xmlpath, exe_path=self.exe, mask_dict=maskdict)
+        self.assertTrue(simer._ham.memmap)
+        self.assertListEqual(list(simer._ham.sim_map_index.keys()), [('fd', 'nan', '2', 'nan')])
+        sims = simer([brnd_es])
+        self.assertListEqual(sorted(sims.keys()), [masked_name, ('sync', '23', '2', 'U')])
+        self.assertTrue(np.array_equal(sims[masked_name].data,
+                                       full[('fd', 'nan', '2', 'nan')].data[:, mask[0].astype(bool)]))
+        self.assertTrue(np.array_equal(sims[('sync', '23', '2', 'U')].data, full[('sync', '23', '2', 'U')].data))
+        # masking afterwards leaves source-masked outputs untouched
+        sims.apply_mask(maskdict)
+        self.assertEqual(sims[masked_name].shape, (3*mpisize, int(np.sum(mask))))
+        # deterministic outputs keep the flag under masked names
+        sims = simer([BregLSA({'b0': 6.0, 'psi0': 27., 'psi1': 0.9, 'chi0': 25.}, 3)])
+        self.assertTrue(sims[masked_name].deterministic)
+
+    def test_cached_masked(self):
+        arr = np.random.rand(1, 48)
+        measuredict = Measurements()
+        measuredict.append(('fd', 'nan', '2', 'nan'), arr)
+        mask = np.zeros((1, 48))
+        mask[0, :10] = 1
+        maskdict = Masks()
+        maskdict.append(('fd', 'nan', '2', 'nan'), mask)
+        masked_name = ('fd', 'nan', '10', 'nan')
+        xmlpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_ham.xml')
+        paramlist = {'rms': 2., 'k1':0.1, 'a1':1.0, 'k0': 0.5, 'a0': 1.7, 'rho': 0.5, 'r0': 8., 'z0': 1.}
+        regular = {'b0': 6.0, 'psi0': 27., 'psi1': 0.9, 'chi0': 25.}
+        with tempfile.TemporaryDirectory() as cache_dir:
+            simer = Hammurabi(measurements=measuredict, xml_path=xmlpath, exe_path=self.exe, mask_dict=maskdict)
+            cached = CachedSimulator(simer, cache_dir)
+            first = cached([BrndES(paramlist, 2, [11, 23])])
+            self.assertListEqual(list(first.keys()), [masked_name])
+            second = cached([BrndES(paramlist, 3, [23, 11, 37])])
+            self.assertEqual(cached.statistics['hits'], 2)
+            self.assertListEqual(list(second.keys()), [masked_name])
+            self.assertTrue(np.array_equal(second[masked_name].data[:2], first[masked_name].data[::-1]))
+            self.assertTrue(np.allclose(second[masked_name].data[2], 37.))
+            # stored compressed
+            path = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+            with zipfile.ZipFile(path) as f:
+                self.assertTrue(all(info.compress_type == zipfile.ZIP_DEFLATED for info in f.infolist()))
+            # deterministic flag kept on hits
+            cached([BregLSA(regular, 2)])
+            self.assertTrue(cached([BregLSA(regular, 2)])[masked_name].deterministic)
+            self.assertEqual(cached.statistics['hits'], 4)
+            # different configurations do not share entries
+            unmasked = CachedSimulator(Hammurabi(measurements=measuredict, xml_path=xmlpath, exe_path=self.exe),
+                                       cache_dir)
+            self.assertListEqual(list(unmasked([BrndES(paramlist, 2, [11, 23])]).keys()), [('fd', 'nan', '2', 'nan')])
+            self.assertEqual(unmasked.statistics['hits'], 0)
+            simer = Hammurabi(measurements=measuredict, xml_path=xmlpath, exe_path=self.exe, mask_dict=maskdict)
+            simer._ham.mod_par(['grid', 'observer', 'x'], {'value': '-8.0'})
+            other = CachedSimulator(simer, cache_dir)
+            other([BrndES(paramlist, 2, [11, 23])])
+            self.assertEqual(other.statistics['hits'], 0)
+
+    def test_scratch(self):
+        arr = np.random.rand(1, 48)
+        measuredict = Measurements()
+        measuredict.append(('dm', 'nan', '2', 'nan'), arr)
+        xmlpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_ham.xml')
+        paramlist = {'rms': 2., 'k1':0.1, 'a1':1.0, 'k0': 0.5, 'a0': 1.7, 'rho': 0.5, 'r0': 8., 'z0': 1.}
+        brnd_es = BrndES(paramlist, 2, [1, 2])
+        simer = Hammurabi(measurements=measuredict, xml_path=xmlpath, exe_path=self.exe)
+        wk_dir = simer._ham.wk_dir
+        self.assertTrue(wk_dir.startswith(scratch_root()))
+        self.assertTrue(os.path.isdir(wk_dir))
+        simer([brnd_es])
+        self.assertListEqual(os.listdir(wk_dir), [])  # temporary files removed
+        self.assertListEqual(sorted(simer.timing.keys()), ['exe', 'read', 'xml'])
+        self.assertTrue(simer.timing['exe'] > 0)
+        del simer
+        self.assertFalse(os.path.isdir(wk_dir))
+
+    def test_read_fits(self):
+        xmlpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_ham.xml')
+        ham = Hampyx(xmlpath, self.exe)
+        maps = [np.random.rand(192) for i in range(3)]
+        path = os.path.join(ham.wk_dir, 'test.fits')
+        hp.write_map(path, maps, overwrite=True, dtype=np.float64)
+        expected = [hp.read_map(path, field=i) for i in range(3)]
+        for memmap in (False, True):
+            ham.memmap = memmap
+            hp.write_map(path, maps, overwrite=True, dtype=np.float64)
+            rslt = ham._read_fits_file(path)
+            # native float64, independent of the file
+            os.remove(path)
+            self.assertEqual(len(rslt), 3)
+            for i in range(3):
+                self.assertTrue(np.array_equal(rslt[i], expected[i]))
+                self.assertEqual(rslt[i].dtype, np.dtype(np.float64))
+                self.assertTrue(rslt[i].dtype.isnative)
+        # kept pixels gathered from vector columns
+        maps = [np.random.rand(3072) for i in range(3)]
+        index = np.sort(np.random.choice(3072, 100, replace=False))
+        for nest in (False, True):
+            hp.write_map(path, maps, overwrite=True, dtype=np.float64, nest=nest)
+            expected = [hp.read_map(path, field=i) for i in range(3)]
+            rslt = ham._read_fits_file(path, [1, 2], {1: index})
+            self.assertTrue(rslt[0] is None)
+            self.assertTrue(np.array_equal(rslt[1], expected[1][index]))
+            self.assertTrue(np.array_equal(rslt[2], expected[2]))
+        hp.write_map(path, maps[0][:192], overwrite=True, dtype=np.float32, nest=True)
+        rslt = ham._read_fits_file(path)
+        self.assertEqual(len(rslt), 1)
+        self.assertEqual(rslt[0].dtype, np.dtype(np.float64))
+        self.assertTrue(np.allclose(rslt[0], hp.reorder(maps[0][:192], n2r=True)))
+        os.remove(path)
+
+    def test_sim_map_request(self):
+        xmlpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_ham.xml')
+        ham = Hampyx(xmlpath, self.exe)
+        for name in ('sync', 'dm', 'faraday'):
+            ham.del_par(['observable', name], 'all')
+        ham.add_par(['observable'], 'sync', {'cue': '1', 'freq': '23', 'nside': '2'})
+        ham.add_par(['observable'], 'faraday', {'cue': '1', 'nside': '2'})
+        ham.mod_par(['magneticfield', 'random'], {'cue': '1', 'seed': '3'})
+        ham()
+        self.assertEqual(len(ham.sim_map), 6)
+        self.assertTrue(np.allclose(ham.sim_map[('sync', '23', '2', 'PI')], np.sqrt(4.**2+5.**2)))
+        self.assertTrue(np.allclose(ham.sim_map[('sync', '23', '2', 'PA')], np.arctan2(5., 4.)/2.))
+        # only requested maps are kept
+        ham.sim_map_request = [('sync', '23', '2', 'Q'), ('sync', '23', '2', 'PA')]
+        ham()
+        self.assertListEqual(sorted(ham.sim_map.keys()), [('sync', '23', '2', 'PA'), ('sync', '23', '2', 'Q')])
+        self.assertTrue(np.allclose(ham.sim_map[('sync', '23', '2', 'Q')], 4.))
+        self.assertTrue(np.allclose(ham.sim_map[('sync', '23', '2', 'PA')], np.arctan2(5., 4.)/2.))
+        ham.sim_map_request = [('fd', 'nan', '2', 'nan')]
+        ham()
+        self.assertListEqual(list(ham.sim_map.keys()), [('fd', 'nan', '2', 'nan')])
+        # maps at given pixels only
+        ham.sim_map_request = [('sync', '23', '2', flag) for flag in ('Q', 'U', 'PI')]
+        ham.sim_map_index = {('sync', '23', '2', 'Q'): [1, 5],
+                             ('sync', '23', '2', 'PI'): [1, 5],
+                             ('sync', '23', '2', 'U'): [0]}
+        ham()
+        self.assertTrue(np.allclose(ham.sim_map[('sync', '23', '2', 'Q')], [4., 4.]))
+        self.assertTrue(np.allclose(ham.sim_map[('sync', '23', '2', 'U')], [5.]))
+        self.assertTrue(np.allclose(ham.sim_map[('sync', '23', '2', 'PI')], [np.sqrt(41.)]*2))
+        self.assertListEqual(os.listdir(ham.wk_dir), [])
+
+    def test_xml_template(self):
+        xmlpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'test_ham.xml')
+        ham = Hampyx(xmlpath, self.exe)
+        ham.compile_par([(['magneticfield', 'random'], 'seed'),
+                         (['magneticfield', 'random', 'global', 'es', 'rms'], 'value')])
+        ham.mod_par(['magneticfield', 'random'], {'seed': '7'})
+        self.assertEqual(ham._render(), et.tostring(ham.tree.getroot(), encoding='us-ascii'))
+        chunks = ham._template[0]
+        # registered slots reuse the template
+        ham.mod_par(['magneticfield', 'random'], {'seed': '<8>'})
+        ham.mod_par(['magneticfield', 'random', 'global', 'es', 'rms'], {'value': '2.5'})
+        self.assertIs(ham._template[0], chunks)
+        self.assertEqual(ham._render(), et.tostring(ham.tree.getroot(), encoding='us-ascii'))
+        # other modifications recompile
+        ham.mod_par(['magneticfield', 'random', 'global', 'es', 'k0'], {'value': '0.3'})
+        self.assertIsNone(ham._template)
+        ham.add_par(['magneticfield'], 'test', {'value': '1'})
+        self.assertEqual(ham._render(), et.tostring(ham.tree.getroot(), encoding='us-ascii'))
+        # copies render their own tree
+        other = ham.clone()
+        other.mod_par(['magneticfield', 'random'], {'seed': '9'})
+        self.assertIs(other._template[0], ham._template[0])
+        self.assertEqual(other._render(), et.tostring(other.tree.getroot(), encoding='us-ascii'))
+        self.assertEqual(ham.tree.getroot().find('./magneticfield/random').get('seed'), '<8>')
+
+
 if __name__ == '__main__':
     unittest.main()
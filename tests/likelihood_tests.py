@@ -5,6 +5,7 @@ from imagine.observables.observable import Observable
 from imagine.observables.observable_dict import Simulations, Measurements, Covariances
 from imagine.likelihoods.simple_likelihood import SimpleLikelihood
 from imagine.likelihoods.ensemble_likelihood import EnsembleLikelihood
+from imagine.tools.mpi_helper import comm_context
 
 
 comm = MPI.COMM_WORLD
@@ -64,7 +65,58 @@ class TestSimpleLikeli(unittest.TestCase):
         (sign, logdet) = np.linalg.slogdet(full_cov*2.*np.pi)
         baseline = -float(0.5)*float(np.vdot(diff, np.linalg.solve(full_cov, diff.T))+sign*logdet)
         self.assertAlmostEqual(rslt, baseline)
-    
+
+    def test_with_cov_repeated(self):
+        meadict = Measurements()
+        covdict = Covariances()
+        # mock measurements
+        arr_a = np.random.rand(1, 4*mpisize)
+        comm.Bcast(arr_a, root=0)
+        meadict.append(('test', 'nan', str(4*mpisize), 'nan'), arr_a, True)
+        # mock covariance
+        arr_c = np.random.rand(4, 4*mpisize)
+        covdict.append(('test', 'nan', str(4*mpisize), 'nan'), arr_c, True)
+        full_cov = np.vstack(comm.allgather(arr_c))  # global covariance
+        (sign, logdet) = np.linalg.slogdet(full_cov*2.*np.pi)
+        # covariance is factorized once, reused by every call
+        lh = SimpleLikelihood(meadict, covdict)
+        for _ in range(3):
+            simdict = Simulations()
+            arr_b = np.random.rand(2, 4*mpisize)
+            simdict.append(('test', 'nan', str(4*mpisize), 'nan'), arr_b, True)
+            rslt = lh(simdict)
+            full_b = np.vstack(comm.allgather(arr_b))  # global arr_b
+            diff = (np.mean(full_b, axis=0) - arr_a)
+            baseline = -float(0.5)*float(np.vdot(diff, np.linalg.solve(full_cov, diff.T))+sign*logdet)
+            self.assertAlmostEqual(rslt, baseline)
+
+    def test_with_cov_subcomm(self):
+        # data of a group, likelihood built outside its context, called inside
+        group = comm.Split(mpirank%2, mpirank)
+        size = 4*group.Get_size()
+        name = ('test', 'nan', str(size), 'nan')
+        arr_a = np.random.rand(1, size)
+        group.Bcast(arr_a, root=0)
+        arr_b = np.random.rand(2, size)
+        arr_c = np.random.rand(4, size) + np.eye(4, size, 4*group.Get_rank())*size
+        with comm_context(group):
+            meadict = Measurements()
+            meadict.append(name, arr_a, True)
+            covdict = Covariances()
+            covdict.append(name, arr_c, True)
+            simdict = Simulations()
+            simdict.append(name, arr_b, True)
+        lh = SimpleLikelihood(meadict, covdict)
+        with comm_context(group):
+            rslt = lh(simdict)
+        full_b = np.vstack(group.allgather(arr_b))
+        diff = (np.mean(full_b, axis=0) - arr_a)
+        full_cov = np.vstack(group.allgather(arr_c))
+        (sign, logdet) = np.linalg.slogdet(full_cov*2.*np.pi)
+        baseline = -float(0.5)*float(np.vdot(diff, np.linalg.solve(full_cov, diff.T))+sign*logdet)
+        self.assertAlmostEqual(rslt, baseline)
+        group.Free()
+
 
 class TestEnsembleLikeli(unittest.TestCase):
     
@@ -97,6 +149,33 @@ class TestEnsembleLikeli(unittest.TestCase):
         rslt_ensemble = lh_ensemble(simdict)
         self.assertEqual(rslt_ensemble, rslt_simple)
     
+    def test_deterministic(self):
+        meadict = Measurements()
+        covdict = Covariances()
+        # mock measurements
+        arr_a = np.random.rand(1, 4*mpisize)
+        comm.Bcast(arr_a, root=0)
+        meadict.append(('test', 'nan', str(4*mpisize), 'nan'), arr_a, True)
+        meadict.append(('other', 'nan', str(4*mpisize), 'nan'), arr_a, True)
+        # mock covariance
+        arr_c = np.random.rand(4, 4*mpisize)
+        covdict.append(('test', 'nan', str(4*mpisize), 'nan'), arr_c, True)
+        # mock observable with repeated single realisation
+        arr_b = np.random.rand(1, 4*mpisize)
+        comm.Bcast(arr_b, root=0)
+        rslt = list()
+        for deterministic in (False, True):
+            simdict = Simulations()
+            for name in meadict.keys():
+                sim = Observable(np.vstack([arr_b]*3), 'simulated')
+                sim.deterministic = deterministic
+                simdict.append(name, sim, True)
+            lh_ensemble = EnsembleLikelihood(meadict, covdict)
+            rslt.append(lh_ensemble(simdict))
+            rslt.append(lh_ensemble(simdict))  # with kept factor
+        for value in rslt[1:]:
+            self.assertAlmostEqual(value, rslt[0])
+
     def test_without_cov(self):
         simdict = Simulations()
         meadict = Measurements()
@@ -123,7 +202,34 @@ class TestEnsembleLikeli(unittest.TestCase):
         lh_ensemble = EnsembleLikelihood(meadict)
         rslt_ensemble = lh_ensemble(simdict)
         self.assertEqual(rslt_ensemble, rslt_simple)
-        
+
+    def test_lowrank(self):
+        simdict = Simulations()
+        meadict = Measurements()
+        covdict = Covariances()
+        # mock measurements
+        arr_a = np.random.rand(1, 12*mpisize**2)
+        comm.Bcast(arr_a, root=0)
+        meadict.append(('test', 'nan', str(mpisize), 'nan'), arr_a)
+        arr_m = np.random.rand(1, 4*mpisize)
+        comm.Bcast(arr_m, root=0)
+        meadict.append(('other', 'nan', str(4*mpisize), 'nan'), arr_m, True)
+        # mock ensembles
+        arr_b = np.random.rand(3, 12*mpisize**2)
+        simdict.append(('test', 'nan', str(mpisize), 'nan'), arr_b)
+        arr_e = np.random.rand(2, 4*mpisize)
+        simdict.append(('other', 'nan', str(4*mpisize), 'nan'), arr_e, True)
+        # low-rank vs dense simulation covariance
+        lh_dense = EnsembleLikelihood(meadict)
+        lh_lowrank = EnsembleLikelihood(meadict, lowrank=True)
+        self.assertAlmostEqual(lh_lowrank(simdict), lh_dense(simdict))
+        # measurement covariance for one of the entries only
+        arr_c = np.random.rand(4, 4*mpisize)
+        covdict.append(('other', 'nan', str(4*mpisize), 'nan'), arr_c, True)
+        lh_dense = EnsembleLikelihood(meadict, covdict)
+        lh_lowrank = EnsembleLikelihood(meadict, covdict, lowrank=True)
+        self.assertAlmostEqual(lh_lowrank(simdict), lh_dense(simdict))
+
 
 if __name__ == '__main__':
     unittest.main()
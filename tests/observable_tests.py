@@ -42,6 +42,35 @@ class TestObservalbes(unittest.TestCase):
         for i in range(fullrr.shape[0]):
             self.assertListEqual(list(fullrr[i]), list(test_obs.data[i]))
     
+    def test_layout(self):
+        if not mpirank:
+            arr = np.random.rand(2,128)
+        else:
+            arr = np.random.rand(1,128)
+        test_obs = Observable(arr, 'simulated')
+        test_obs.append(np.random.rand(1,128))
+        test_obs.append(Observable(np.random.rand(1,128), 'simulated'))
+        self.assertEqual(test_obs.shape, (mpisize+1+2*mpisize, 128))
+        self.assertEqual(list(test_obs.distributed.row_counts), [4]+[3]*(mpisize-1))
+        self.assertTrue(test_obs.distributed.data is test_obs.data)
+        test_obs.rw_flag = True
+        test_obs.append(np.random.rand(1,128))
+        self.assertEqual(test_obs.shape, (mpisize, 128))
+    
+    def test_local(self):
+        # setting and appending Observable on a single node needs no communication
+        if not mpirank:
+            test_obs = Observable(np.random.rand(2,128), 'simulated')
+            test_obs.append(Observable(np.random.rand(1,128), 'simulated'))
+            self.assertTrue(test_obs._distributed is None)
+            self.assertEqual(test_obs.data.shape, (3, 128))
+        comm.Barrier()
+        # known layout is kept
+        test_obs = Observable(np.random.rand(1,128), 'simulated')
+        self.assertEqual(list(test_obs.distributed.row_counts), [1]*mpisize)
+        test_obs.append(np.random.rand(1,128))
+        self.assertEqual(list(test_obs._distributed.row_counts), [2]*mpisize)
+
     def test_append_obs(self):
         if not mpirank:
             arr = np.random.rand(2,128)
@@ -114,6 +143,47 @@ class TestObservalbes(unittest.TestCase):
         fullrr = np.vstack([brr, crr])
         for i in range(fullrr.shape[0]):
             self.assertTrue(test_obs.data[i] in fullrr)
+
+    def test_reserve_fill(self):
+        arr = np.random.rand(3,128)
+        test_obs = Observable(None, 'simulated')
+        test_obs.reserve(3, 128)
+        self.assertEqual(test_obs.data.shape, (0, 128))
+        buffer = test_obs._buffer
+        for i in (2, 0, 1):
+            test_obs.fill(i, arr[i])
+        self.assertTrue(test_obs._buffer is buffer)  # filled in place
+        self.assertEqual(test_obs.shape, (3*mpisize, 128))
+        self.assertTrue(np.allclose(test_obs.data, arr))
+        self.assertTrue(np.allclose(test_obs.ensemble_mean, np.mean(np.vstack(comm.allgather(arr)), axis=0)))
+        # appending beyond capacity
+        test_obs.append(arr[:1])
+        self.assertEqual(test_obs.shape, (4*mpisize, 128))
+        self.assertTrue(np.allclose(test_obs.data, np.vstack([arr, arr[:1]])))
+
+    def test_append_in_place(self):
+        arr = np.random.rand(1,128)
+        test_obs = Observable(arr, 'simulated')
+        test_obs.reserve(4)
+        buffer = test_obs._buffer
+        for i in range(3):
+            test_obs.append(arr)
+        self.assertTrue(test_obs._buffer is buffer)
+        self.assertEqual(test_obs.shape, (4*mpisize, 128))
+        self.assertTrue(np.allclose(test_obs.data, np.vstack([arr]*4)))
+
+    def test_deterministic(self):
+        arr = np.random.rand(1,128)
+        test_obs = Observable(np.vstack([arr]*2), 'simulated')
+        self.assertFalse(test_obs.deterministic)
+        test_obs.deterministic = True
+        self.assertTrue(test_obs.deterministic)
+        # dropped once new realizations arrive
+        test_obs.append(arr)
+        self.assertFalse(test_obs.deterministic)
+        test_obs.deterministic = True
+        test_obs.fill(0, arr)
+        self.assertFalse(test_obs.deterministic)
     
 if __name__ == '__main__':
     unittest.main()
@@ -75,6 +75,26 @@ class TestObservableDicts(unittest.TestCase):
         for i in range(len(arr)):
             self.assertListEqual(list((simdict[('test', 'nan', '3', 'nan')].data)[i]), list(arr[i]))
     
+    def test_simdict_reserve_fill(self):
+        hrr = np.random.rand(2, 48)
+        simdict = Simulations()
+        simdict.reserve(('test', 'nan', '2', 'nan'), 2)
+        simdict.reserve(('test', 'nan', '3', 'nan'), 2, True)
+        for i in range(2):
+            simdict.fill(('test', 'nan', '2', 'nan'), i, hrr[i])
+            simdict.fill(('test', 'nan', '3', 'nan'), i, hrr[i:i+1, :3])
+        self.assertEqual(simdict[('test', 'nan', '2', 'nan')].shape, (2*mpisize, 48))
+        self.assertEqual(simdict[('test', 'nan', '3', 'nan')].shape, (2*mpisize, 3))
+        self.assertTrue(np.allclose(simdict[('test', 'nan', '2', 'nan')].data, hrr))
+        self.assertTrue(np.allclose(simdict[('test', 'nan', '3', 'nan')].data, hrr[:, :3]))
+        self.assertFalse(simdict.is_plain(('test', 'nan', '2', 'nan')))
+        self.assertTrue(simdict.is_plain(('test', 'nan', '3', 'nan')))
+        # masked entries are plain
+        mskdict = Masks()
+        mskdict.append(('test', 'nan', '2', 'nan'), np.ones((1, 48)))
+        simdict.apply_mask(mskdict)
+        self.assertTrue(simdict.is_plain(('test', 'nan', '48', 'nan')))
+    
     def test_covdict_append_array(self):
         cov = np.random.rand(2, 2*mpisize)
         covdict = Covariances()
@@ -110,6 +130,17 @@ class TestObservableDicts(unittest.TestCase):
         local_msk = mskdict[('test', 'nan', '48', 'nan')].data
         self.assertListEqual(list(local_msk[0]), list(msk[0]))
     
+    def test_maskdict_compiled(self):
+        msk = np.array([0, 1, 0, 1, 1]).reshape(1, 5)
+        mskdict = Masks()
+        mskdict.append(('test', 'nan', '5', 'nan'), msk, True)
+        compiled = mskdict.compiled[('test', 'nan', '5', 'nan')]
+        self.assertListEqual(list(compiled.index), [1, 3, 4])
+        self.assertEqual(compiled.masked_size, 3)
+        # rewriting recompiles
+        mskdict.append(('test', 'nan', '5', 'nan'), np.array([1, 1, 0, 0, 0]).reshape(1, 5), True)
+        self.assertListEqual(list(mskdict.compiled[('test', 'nan', '5', 'nan')].index), [0, 1])
+    
     def test_meadict_apply_mask(self):
         msk = np.array([0, 1, 0, 1, 1]).reshape(1, 5)
         mskdict = Masks()
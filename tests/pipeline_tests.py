@@ -1,5 +1,6 @@
 import unittest
 import numpy as np
+from mpi4py import MPI
 from imagine.observables.observable_dict import Measurements
 from imagine.likelihoods.ensemble_likelihood import EnsembleLikelihood
 from imagine.fields.test_field.test_field_factory import TestFieldFactory
@@ -91,6 +92,33 @@ class TestPipelines(unittest.TestCase):
         self.assertListEqual(list(s1), list(s1re))  # should get the same seeds
         
 
+    def test_task_farm(self):
+        # mock measures, identical on all nodes
+        arr = np.linspace(0., 1., 8).reshape(1, 8)
+        measuredict = Measurements()
+        measuredict.append(('test', 'nan', '8', 'nan'), arr, True)
+        simer = LiSimulator(measuredict)
+        # no random field by default, so ensembles are reproducible
+        tf = TestFieldFactory(active_parameters=tuple('a'))
+        lh = EnsembleLikelihood(measuredict)
+        pipe = MultinestPipeline(simer, (tf,), lh, FlatPrior(), 5)
+        self.assertEqual(pipe.task_farm, False)
+        farm = MultinestPipeline(simer, (tf,), lh, FlatPrior(), 5, task_farm=True)
+        self.assertEqual(farm.task_farm, True)
+        farm.likelihood_rescaler = pipe.likelihood_rescaler = 0.5
+        # different cubes on different nodes
+        for cube in ([0.2], [0.7], [1.2]):
+            cube = np.array(cube) + 0.05*MPI.COMM_WORLD.Get_rank()
+            self.assertAlmostEqual(pipe._mpi_likelihood(cube), farm._mpi_likelihood(cube))
+        self.assertEqual(farm._mpi_likelihood(np.array([1.2])), np.nan_to_num(-np.inf))
+        # tasks take seeds explicitly and keep pipeline state, layouts are sent along
+        farm._randomness()
+        seeds = farm._ensemble_seeds
+        block = farm._simulate_block(np.array([0.2]), [1, 2, 3, 4, 5])
+        self.assertTrue(farm._ensemble_seeds is seeds)
+        sims = simer(farm._field_list(np.array([0.2]), [1, 2, 3, 4, 5]))
+        self.assertListEqual([b[2] for b in block], [sims.is_plain(name) for name in sims.keys()])
+
     def test_dynesty(self):
         # mock measures
         arr = np.random.rand(1, 3)
@@ -169,6 +197,25 @@ class TestPipelines(unittest.TestCase):
         s1re = pipe._ensemble_seeds
         self.assertListEqual(list(s1), list(s1re))
 
+    def test_dynesty_pool(self):
+        # mock measures, identical on all nodes
+        arr = np.linspace(0., 1., 8).reshape(1, 8)
+        measuredict = Measurements()
+        measuredict.append(('test', 'nan', '8', 'nan'), arr, True)
+        simer = LiSimulator(measuredict)
+        tf = TestFieldFactory(active_parameters=tuple('a'))
+        lh = EnsembleLikelihood(measuredict)
+        pipe = DynestyPipeline(simer, (tf,), lh, FlatPrior(), 2)
+        self.assertEqual(pipe.pool_mode, False)
+        self.assertEqual(pipe.group_size, 1)
+        pipe.pool_mode = True
+        pipe.sampling_controllers = {'nlive': 20}
+        rslt = pipe({'maxiter': 30, 'print_progress': False})
+        # all nodes get the same results
+        self.assertEqual(len(rslt.logl), rslt.niter+20)
+        self.assertTrue(np.isfinite(rslt.logl).all())
+        self.assertTrue(np.allclose(MPI.COMM_WORLD.bcast(rslt.logl, root=0), rslt.logl))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,8 +1,11 @@
 import unittest
+import os
+import tempfile
 import numpy as np
 from mpi4py import MPI
 from imagine.simulators.test.li_simulator import LiSimulator
 from imagine.simulators.test.bi_simulator import BiSimulator
+from imagine.simulators.cached_simulator import CachedSimulator
 from imagine.fields.test_field.test_field import TestField
 from imagine.observables.observable_dict import Simulations, Measurements
 
@@ -100,6 +103,43 @@ class TestSimulators(unittest.TestCase):
         self.assertEqual(len(simdict.keys()), 1)
         self.assertEqual(simdict[('test', 'nan', '10', 'nan')].shape, (5*mpisize, 10))
 
+    def test_cached(self):
+        arr = np.random.rand(1, 10)
+        measuredict = Measurements()
+        measuredict.append(('test', 'nan', '10', 'nan'), arr, True)
+        key = ('test', 'nan', '10', 'nan')
+        mock_par = {'a': 2., 'b': 0.2}
+        simer = LiSimulator(measuredict)
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cached = CachedSimulator(simer, cache_dir)
+            first = cached([TestField(mock_par, 2, [23, 24])])
+            self.assertEqual(cached.statistics['misses'], 2)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            # served from cache
+            second = cached([TestField(mock_par, 2, [23, 24])])[key].data
+            self.assertEqual(cached.statistics['hits'], 2)
+            self.assertTrue(np.array_equal(first[key].data, second))
+            # partial hits keep realization order
+            third = cached([TestField(mock_par, 3, [25, 24, 23])])[key].data
+            self.assertEqual(cached.statistics['hits'], 4)
+            self.assertEqual(cached.statistics['misses'], 3)
+            self.assertTrue(np.array_equal(third[1:], second[::-1]))
+            self.assertTrue(np.array_equal(third[:1], simer([TestField(mock_par, 1, [25])])[key].data))
+            # restart from the same directory
+            cached = CachedSimulator(simer, cache_dir)
+            cached([TestField(mock_par, 2, [23, 25])])
+            self.assertEqual(cached.statistics['hit_rate'], 1.)
+            # thread-time dependent seeds are not cached
+            cached([TestField(mock_par, 2, None)])
+            self.assertEqual(cached.statistics['skipped'], 2)
+            self.assertEqual(len(os.listdir(cache_dir)), 3)
+            # least recently used files are removed
+            cached.max_size = os.path.getsize(os.path.join(cache_dir, os.listdir(cache_dir)[0]))
+            cached([TestField(mock_par, 1, [26])])
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            cached([TestField(mock_par, 1, [26])])
+            self.assertEqual(cached.statistics['hits'], 3)
+
 
 if __name__ == '__main__':
     unittest.main()
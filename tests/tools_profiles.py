@@ -1,8 +1,9 @@
 import numpy as np
 from mpi4py import MPI
 
-from imagine.tools.mpi_helper import mpi_mean, mpi_arrange, mpi_trans, mpi_trace, mpi_slogdet
-from imagine.tools.covariance_estimator import oas_mcov
+from imagine.tools.mpi_helper import mpi_mean, mpi_arrange, mpi_trans, mpi_trace, mpi_slogdet, LUFactor
+from imagine.tools.mpi_helper import mpi_mult, set_backend
+from imagine.tools.covariance_estimator import oas_mcov, oas_lowrank_mcov
 from imagine.tools.timer import Timer
 
 comm = MPI.COMM_WORLD
@@ -61,6 +62,34 @@ def oas_estimator_timing(data_size):
         print('elapse time '+str(tmr.record['oas_estimator'])+'\n')
 
 
+def oas_trace_timing(ensemble_size, data_size):
+    local_ensemble_size = mpi_arrange(ensemble_size)[1] - mpi_arrange(ensemble_size)[0]
+    random_data = np.random.rand(local_ensemble_size, data_size)
+    u = random_data - mpi_mean(random_data)
+    s = mpi_mult(u, u, trans_left=True) / ensemble_size
+    tmr = Timer()
+    # tr(S^2) through the distributed product
+    tmr.tick('product')
+    trs2 = mpi_trace(mpi_mult(s, s))
+    tmr.tock('product')
+    # tr(S^2) as squared Frobenius norm from local sums
+    tmr.tick('frobenius')
+    local_sum = np.array(np.sum(np.square(s)), dtype=np.float64)
+    trs2 = np.array(0, dtype=np.float64)
+    comm.Allreduce([local_sum, MPI.DOUBLE], [trs2, MPI.DOUBLE], op=MPI.SUM)
+    tmr.tock('frobenius')
+    # all trace statistics from the Gram matrix
+    tmr.tick('gram')
+    oas_lowrank_mcov(random_data)
+    tmr.tock('gram')
+    if not mpirank:
+        print('@ tools_profiles::oas_trace_timing with '+str(mpisize)+' nodes')
+        print('global array shape ('+str(ensemble_size)+','+str(data_size)+')')
+        print('tr(S^2) by product time '+str(tmr.record['product']))
+        print('tr(S^2) by Frobenius norm time '+str(tmr.record['frobenius']))
+        print('low-rank OAS from Gram matrix time '+str(tmr.record['gram'])+'\n')
+
+
 def mpi_slogdet_timing(data_size):
     local_row_size = mpi_arrange(data_size)[1] - mpi_arrange(data_size)[0]
     random_data = np.random.rand(local_row_size, data_size)
@@ -74,6 +103,33 @@ def mpi_slogdet_timing(data_size):
         print('elapse time '+str(tmr.record['mpi_slogdet'])+'\n')
 
 
+def lu_factor_timing(data_size, backend='mpi'):
+    # single rank defaults to the lapack backend, select the blocked elimination explicitly
+    local_row_size = mpi_arrange(data_size)[1] - mpi_arrange(data_size)[0]
+    random_data = np.random.rand(local_row_size, data_size)
+    source = np.random.rand(1, data_size)
+    comm.Bcast(source, root=0)
+    tmr = Timer()
+    set_backend(backend)
+    try:
+        tmr.tick('lu_factor')
+        factor = LUFactor(random_data)
+        tmr.tock('lu_factor')
+        tmr.tick('lu_slogdet')
+        factor.slogdet()
+        tmr.tock('lu_slogdet')
+        tmr.tick('lu_solve')
+        factor.solve(source)
+        tmr.tock('lu_solve')
+    finally:
+        set_backend('auto')
+    if not mpirank:
+        print('@ tools_profiles::lu_factor_timing with '+str(mpisize)+' nodes, '+backend+' backend')
+        print('global matrix size ('+str(data_size)+','+str(data_size)+')')
+        print('factorization time '+str(tmr.record['lu_factor']))
+        print('slogdet time '+str(tmr.record['lu_slogdet']))
+        print('solve time '+str(tmr.record['lu_solve'])+'\n')
+
 if __name__ == '__main__':
     N = 2**10
     mpi_mean_timing(N, N)
@@ -81,3 +137,11 @@ if __name__ == '__main__':
     mpi_trace_timing(N)
     oas_estimator_timing(N)
     mpi_slogdet_timing(N)
+    # trace statistics in OAS estimator
+    for n in (2**10, 2**11, 2**12):
+        oas_trace_timing(32, n)
+    # scaling of the blocked LU factorization
+    for n in (2**8, 2**9, 2**10, 2**11, 2**12, 2**13):
+        lu_factor_timing(n)
+        if mpisize == 1:
+            lu_factor_timing(n, 'lapack')
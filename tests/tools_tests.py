@@ -1,19 +1,38 @@
 import unittest
+import time
 import numpy as np
 from mpi4py import MPI
 from imagine.tools.random_seed import seed_generator
 from imagine.tools.mpi_helper import mpi_mean, mpi_arrange, mpi_trans
 from imagine.tools.mpi_helper import mpi_mult, mpi_eye, mpi_trace
 from imagine.tools.mpi_helper import  mpi_shape, mpi_lu_solve, mpi_slogdet
-from imagine.tools.mpi_helper import mpi_global, mpi_local
-from imagine.tools.masker import mask_obs, mask_cov
-from imagine.tools.covariance_estimator import empirical_cov, oas_cov, oas_mcov
+from imagine.tools.mpi_helper import mpi_global, mpi_local, LUFactor
+from imagine.tools.mpi_helper import set_backend, get_backend, DistributedArray
+from imagine.tools.mpi_helper import get_comm, comm_context, mpi_rebalance, MPIPool
+from imagine.tools.masker import mask_obs, mask_cov, CompiledMask
+from imagine.tools.covariance_estimator import empirical_cov, oas_cov, oas_mcov, oas_lowrank_mcov
 
 
 comm = MPI.COMM_WORLD
 mpisize = comm.Get_size()
 mpirank = comm.Get_rank()
 
+def _pool_task(x):
+    # executed jointly by a rank group
+    return (x**2, get_comm().Get_size(), get_comm().allreduce(x))
+
+def _pool_uneven(x):
+    # the first task is expensive, returns the rank leading the group
+    if x == 0:
+        time.sleep(0.5)
+    return get_comm().bcast(mpirank, root=0)
+
+def _pool_fail(x):
+    # raises on the last rank of a group only
+    if x == 3 and get_comm().Get_rank() == get_comm().Get_size()-1:
+        raise ValueError('task %d' % x)
+    return x
+
 class TestTools(unittest.TestCase):
     
     def test_seed(self):
@@ -33,6 +52,34 @@ class TestTools(unittest.TestCase):
         self.assertEqual(test_shape[0], mpisize+1)
         self.assertEqual(test_shape[1], 128)
     
+    def test_distributed_array(self):
+        if not mpirank:
+            arr = np.random.rand(2,16)
+        else:
+            arr = np.random.rand(1,16)
+        test_dist = DistributedArray(arr)
+        self.assertEqual(test_dist.global_shape, (mpisize+1, 16))
+        self.assertEqual(list(test_dist.row_counts), [2]+[1]*(mpisize-1))
+        self.assertEqual(test_dist.row_begin, 0 if not mpirank else mpirank+1)
+        self.assertTrue(test_dist.data is arr)
+        # routines take cached layout
+        full_arr = np.vstack(comm.allgather(arr))
+        self.assertTrue(np.allclose(mpi_mean(test_dist), np.mean(full_arr, axis=0)))
+        self.assertTrue(np.allclose(mpi_trans(test_dist), mpi_trans(arr)))
+        self.assertTrue(np.allclose(mpi_mult(test_dist, test_dist, trans_left=True),
+                                    mpi_mult(arr, arr, trans_left=True)))
+        test_global = mpi_global(test_dist)
+        if not mpirank:
+            self.assertTrue(np.allclose(test_global, full_arr))
+        # canonical layout without communication
+        arr = comm.bcast(np.random.rand(mpisize*3, mpisize*3), root=0)
+        local_begin, local_end = mpi_arrange(arr.shape[0])
+        test_dist = DistributedArray.arranged(arr[local_begin:local_end], arr.shape[0])
+        self.assertEqual(test_dist.row_begin, local_begin)
+        self.assertAlmostEqual(mpi_trace(test_dist), np.trace(arr))
+        test_dist = DistributedArray.copied(arr[:1])
+        self.assertEqual(test_dist.global_shape, (mpisize, mpisize*3))
+    
     def test_mean(self):
         if not mpirank:
             arr = np.random.rand(2,128)
@@ -72,6 +119,39 @@ class TestTools(unittest.TestCase):
         test_cov = test_cov[test_cov != 0]
         self.assertListEqual(list(test_cov), list(test_cov))
     
+    def test_compiled_mask(self):
+        msk_arr = comm.bcast(np.random.choice([0,1], size=(1,128)), root=0)
+        full_cov = comm.bcast(np.random.rand(128,128), root=0)
+        local_begin, local_end = mpi_arrange(128)
+        dat_arr = np.random.rand(3,128)
+        test_msk = CompiledMask(msk_arr)
+        kept = np.flatnonzero(msk_arr[0])
+        self.assertEqual(test_msk.size, 128)
+        self.assertEqual(test_msk.masked_size, kept.size)
+        self.assertTrue(np.array_equal(test_msk.apply_obs(dat_arr), dat_arr[:, kept]))
+        self.assertTrue(np.array_equal(mask_obs(dat_arr, test_msk), dat_arr[:, kept]))
+        test_cov = np.vstack(comm.allgather(test_msk.apply_cov(full_cov[local_begin:local_end])))
+        self.assertTrue(np.array_equal(test_cov, full_cov[np.ix_(kept, kept)]))
+    
+    def test_mask_cov_balanced(self):
+        # heavy mask, kept pixels lie on the first node only
+        msk_arr = np.zeros((1, 16*mpisize))
+        msk_arr[0, :mpisize+3] = 1
+        kept = np.flatnonzero(msk_arr[0])
+        full_cov = comm.bcast(np.random.rand(16*mpisize, 16*mpisize), root=0)
+        local_begin, local_end = mpi_arrange(16*mpisize)
+        cov_msk = mask_cov(full_cov[local_begin:local_end], msk_arr)
+        new_begin, new_end = mpi_arrange(kept.size)
+        self.assertEqual(cov_msk.shape, (new_end-new_begin, kept.size))
+        self.assertTrue(np.array_equal(cov_msk, full_cov[np.ix_(kept, kept)][new_begin:new_end]))
+    
+    def test_rebalance(self):
+        arr = np.random.rand(2*mpirank+1, 8)
+        full_arr = np.vstack(comm.allgather(arr))
+        test_arr = mpi_rebalance(arr)
+        local_begin, local_end = mpi_arrange(full_arr.shape[0])
+        self.assertTrue(np.array_equal(test_arr, full_arr[local_begin:local_end]))
+    
     def test_trans(self):
         if not mpirank:
             arr = np.random.rand(2,128)
@@ -84,6 +164,15 @@ class TestTools(unittest.TestCase):
         for i in range(part_arr.shape[0]):
             self.assertListEqual(list(part_arr[i]), list(test_arr[i]))
     
+    def test_trans_repeated(self):
+        # communication buffers are reused across calls of different sizes
+        for cols in (128, 16*mpisize, 256):
+            arr = np.random.rand(3, cols)
+            test_arr = mpi_trans(arr)
+            full_arr = np.transpose(np.vstack(comm.allgather(arr)))
+            local_begin, local_end = mpi_arrange(full_arr.shape[0])
+            self.assertTrue(np.array_equal(full_arr[local_begin:local_end], test_arr))
+
     def test_mult(self):
         if not mpirank:
             arr_a = np.random.rand(2,128)
@@ -101,6 +190,24 @@ class TestTools(unittest.TestCase):
         for i in range(len(part_c)):
             self.assertAlmostEqual(part_c[0][i], test_c[0][i])
             
+    def test_mult_trans_left(self):
+        if not mpirank:
+            arr_a = np.random.rand(2,64)
+        else:
+            arr_a = np.random.rand(1,64)
+        arr_b = np.random.rand(arr_a.shape[0],32)
+        test_c = mpi_mult(arr_a, arr_b, trans_left=True)
+        test_d = mpi_mult(arr_a, arr_a, trans_left=True)
+        # make comparison
+        full_a = np.vstack(comm.allgather(arr_a))
+        full_b = np.vstack(comm.allgather(arr_b))
+        local_begin, local_end = mpi_arrange(64)
+        part_c = np.dot(full_a.T, full_b)[local_begin:local_end]
+        part_d = np.dot(full_a.T, full_a)[local_begin:local_end]
+        self.assertTrue(np.allclose(part_c, test_c))
+        self.assertTrue(np.allclose(part_d, test_d))
+        self.assertTrue(np.allclose(mpi_mult(mpi_trans(arr_a), arr_a), test_d))
+
     def test_mpi_global(self):
         if not mpirank:
             arr_a = np.random.rand(2,128)
@@ -181,6 +288,17 @@ class TestTools(unittest.TestCase):
             for j in range(full_cov.shape[1]):
                 self.assertAlmostEqual(null_cov[i,j], full_cov[i,j])
     
+    def test_oas_lowrank_mcov(self):
+        arr = np.random.rand(2, 64)
+        mean, local_cov = oas_mcov(arr)
+        lr_mean, u, gram, diagonal, factor = oas_lowrank_mcov(arr)
+        self.assertTrue(np.allclose(mean, lr_mean))
+        full_u = np.vstack(comm.allgather(u))
+        self.assertTrue(np.allclose(gram, np.dot(full_u.T, full_u)))
+        local_begin, local_end = mpi_arrange(64)
+        lr_cov = diagonal*np.eye(64) + factor*np.dot(full_u, full_u.T)
+        self.assertTrue(np.allclose(lr_cov[local_begin:local_end], local_cov))
+
     def test_lu_solve(self):
         np.random.seed(mpirank)
         arr = np.random.rand(2, 2*mpisize)
@@ -223,5 +341,134 @@ class TestTools(unittest.TestCase):
         self.assertEqual(sign, test_sign)
         self.assertAlmostEqual(logdet, test_logdet)
 
+    def test_lu_factor(self):
+        cols = 32
+        rows = mpi_arrange(cols)[1] - mpi_arrange(cols)[0]
+        arr = np.random.rand(rows, cols)
+        full_arr = np.vstack(comm.allgather(arr))
+        test_sign, test_logdet = np.linalg.slogdet(full_arr)
+        # single panel, several panels and column-wise elimination
+        for block_size in (64, 5, 1):
+            factor = LUFactor(arr, block_size)
+            # reuse the same factorization
+            sign, logdet = factor.slogdet()
+            self.assertEqual(sign, test_sign)
+            self.assertAlmostEqual(logdet, test_logdet)
+            for _ in range(2):
+                brr = np.random.rand(1, cols)
+                comm.Bcast(brr, root=0)
+                xrr = factor.solve(brr)
+                test_xrr = (np.linalg.solve(full_arr, brr.T)).T
+                for i in range(xrr.shape[1]):
+                    self.assertAlmostEqual(xrr[0,i], test_xrr[0,i])
+
+    def test_lu_factor_pivot(self):
+        # vanishing leading entry requires row pivoting
+        cols = 4*mpisize
+        full_arr = np.random.rand(cols, cols)
+        comm.Bcast(full_arr, root=0)
+        full_arr[0, 0] = 0.
+        begin, end = mpi_arrange(cols)
+        factor = LUFactor(full_arr[begin:end], 3)
+        sign, logdet = factor.slogdet()
+        test_sign, test_logdet = np.linalg.slogdet(full_arr)
+        self.assertEqual(sign, test_sign)
+        self.assertAlmostEqual(logdet, test_logdet)
+        brr = np.random.rand(1, cols)
+        comm.Bcast(brr, root=0)
+        xrr = factor.solve(brr)
+        test_xrr = (np.linalg.solve(full_arr, brr.T)).T
+        for i in range(xrr.shape[1]):
+            self.assertAlmostEqual(xrr[0,i], test_xrr[0,i])
+
+
+class TestBackends(unittest.TestCase):
+
+    def tearDown(self):
+        set_backend('auto')
+
+    def test_auto(self):
+        set_backend('auto')
+        if mpisize == 1:
+            self.assertEqual(get_backend(), 'lapack')
+        else:
+            self.assertEqual(get_backend(), 'mpi')
+            with self.assertRaises(ValueError):
+                set_backend('lapack')
+
+    def test_equivalence(self):
+        if mpisize != 1:
+            return
+        arr = np.random.rand(24, 24)
+        brr = np.random.rand(1, 24)
+        rslt = dict()
+        for backend in ('mpi', 'lapack'):
+            set_backend(backend)
+            factor = LUFactor(arr, 5)
+            rslt[backend] = (mpi_mean(arr), mpi_trans(arr), mpi_mult(arr, arr),
+                             mpi_trace(arr), mpi_global(arr), mpi_local(arr),
+                             mpi_lu_solve(arr, brr), mpi_slogdet(arr)[0], mpi_slogdet(arr)[1],
+                             factor.solve(brr), factor.slogdet()[0], factor.slogdet()[1],
+                             oas_mcov(arr)[1])
+        for mpi_val, lapack_val in zip(rslt['mpi'], rslt['lapack']):
+            self.assertTrue(np.allclose(mpi_val, lapack_val, rtol=1e-10, atol=1e-12))
+        # singular matrix
+        arr[:, 3] = 0.
+        for backend in ('mpi', 'lapack'):
+            set_backend(backend)
+            with self.assertRaises(ValueError):
+                LUFactor(arr, 5)
+            with self.assertRaises(ValueError):
+                mpi_slogdet(arr)
+            with self.assertRaises(ValueError):
+                mpi_lu_solve(arr, brr)
+
+
+class TestComm(unittest.TestCase):
+
+    def test_default(self):
+        self.assertTrue(get_comm() is comm)
+
+    def test_context(self):
+        # split nodes into groups of odd and even ranks
+        group = comm.Split(mpirank%2, mpirank)
+        arr = np.random.rand(2, 8)
+        with comm_context(group) as sub:
+            self.assertTrue(get_comm() is group)
+            self.assertTrue(sub is group)
+            self.assertEqual(mpi_shape(arr)[0], 2*group.Get_size())
+            self.assertEqual(mpi_arrange(group.Get_size())[0], group.Get_rank())
+            full_arr = np.vstack(group.allgather(arr))
+            self.assertTrue(np.allclose(mpi_mean(arr), np.mean(full_arr, axis=0)))
+            # nested
+            with comm_context(MPI.COMM_SELF):
+                self.assertEqual(mpi_shape(arr)[0], 2)
+            self.assertTrue(get_comm() is group)
+        self.assertTrue(get_comm() is comm)
+        group.Free()
+
+    def test_pool(self):
+        group_size = 2 if mpisize%2 == 0 else 1
+        pool = MPIPool(group_size)
+        self.assertEqual(pool.size, mpisize//group_size)
+        self.assertEqual(pool.is_master, mpirank == 0)
+        if pool.is_master:
+            rslt = pool.map(_pool_task, range(7))
+            self.assertListEqual(rslt, [(x**2, group_size, x*group_size) for x in range(7)])
+            self.assertListEqual(pool.map(_pool_task, []), [])
+            # dynamic dealing, the group on the expensive task takes no other
+            if pool.size > 1:
+                rslt = pool.map(_pool_uneven, range(4*pool.size))
+                self.assertEqual(rslt.count(rslt[0]), 1)
+            # failures are re-raised, the pool stays usable
+            with self.assertRaises(ValueError):
+                pool.map(_pool_fail, range(7))
+            self.assertListEqual(pool.map(_pool_fail, range(3)), [0, 1, 2])
+        else:
+            pool.wait()
+        pool.close()
+        self.assertTrue(get_comm() is comm)
+
+
 if __name__ == '__main__':
     unittest.main()